@@ -6,9 +6,14 @@ from the engagement environment.
 
 import ast
 import json
-from typing import List, Dict, Any, Tuple, Callable
+from typing import List, Dict, Any, Tuple, Callable, Optional, Sequence
 
+import numpy as np
+
+from fitness.game_theory_analysis import get_memory_one_payoffs, get_memory_one_strategy
+from fitness.game_theory_game import GameTheoryGame, LookupTableStrategy
 from heuristics.donkey_ge import Individual, DEFAULT_FITNESS, FitnessFunction
+from heuristics.donkey_ge_coev import CoevFitnessFunction
 from util import utils
 
 class SimpleSum(FitnessFunction):
@@ -28,9 +33,9 @@ class SimpleSum(FitnessFunction):
         """ Returns the sum of the phenotype (fcn_str).
         """
         key: str = "{}".format(fcn_str)
-        if key in cache:
-            fitness: float = cache[key]
-        else:
+        # One lookup, another thread may evict the key between `in` and reading it
+        fitness: Optional[float] = cache.get(key)
+        if fitness is None:
             lst = ast.literal_eval(fcn_str)
             fitness = self.get_fitness(lst)
             cache[key] = fitness
@@ -47,5 +52,89 @@ class SimpleSum(FitnessFunction):
         return fitness
     
 
+class SimpleSumGame(CoevFitnessFunction):
+    """
+    Zero-sum game of two SimpleSum phenotypes. The payoff is the
+    difference of the SimpleSum fitness of the phenotypes.
+    """
+
+    def __init__(self, param: Dict[str, Any]) -> None:
+        """ Initialize object
+        """
+        self.simple_sum = SimpleSum(param)
+
+    def __call__(self, fcn_str: str, cache: Dict[str, float]) -> float:
+        """ Returns the sum of the phenotype (fcn_str).
+        """
+        return self.simple_sum(fcn_str, cache)
+
+    def coev_matrix(
+        self, phenotypes: Sequence[str], adversary_phenotypes: Sequence[str]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """ Returns the payoffs of the phenotypes and of the adversary phenotypes.
+        """
+        sums = np.array([self.simple_sum.get_fitness(ast.literal_eval(_)) for _ in phenotypes])
+        adversary_sums = np.array(
+            [self.simple_sum.get_fitness(ast.literal_eval(_)) for _ in adversary_phenotypes]
+        )
+        payoffs = sums[:, np.newaxis] - adversary_sums[np.newaxis, :]
+        return payoffs, -payoffs
+
+
+class MemoryOneGame(CoevFitnessFunction):
+    """
+    Iterated game of memory-one strategies, scored with the analytic
+    expected payoffs of `game_theory_analysis` instead of playing the game.
+    A phenotype is a list of moves, the first move and the response to each
+    move of the opponent, e.g. `["C", "C", "D"]` is tit for tat in the
+    Prisoners Dilemma. The phenotypes are player 1 and the adversary
+    phenotypes player 2. Payoffs are utilities, see `GameTheoryGame.MINIMIZE`.
+
+    Attributes:
+        game: Game, `game` is its class name and `n_iterations` its number of iterations
+    """
+
+    def __init__(self, param: Dict[str, Any]) -> None:
+        """ Initialize object
+        """
+        game_class = utils.import_function(
+            param.get("game", "fitness.game_theory_game.PrisonersDilemma")
+        )
+        self.game: GameTheoryGame = game_class(
+            n_iterations=param.get("n_iterations", 1), memory_size=1
+        )
+
+    def get_strategy(self, fcn_str: str) -> np.ndarray:
+        """ Returns the move probabilities of a phenotype.
+        """
+        moves = self.game.get_moves()
+        table = [moves.index(_) + 1 for _ in ast.literal_eval(fcn_str)]
+        return get_memory_one_strategy(LookupTableStrategy(moves, 1, table))
+
+    def __call__(self, fcn_str: str, cache: Dict[str, float]) -> float:
+        """ Returns the payoff of the phenotype (fcn_str) against itself.
+        """
+        payoffs, _ = self.coev_matrix([fcn_str], [fcn_str])
+        return float(payoffs[0, 0])
+
+    def coev_matrix(
+        self, phenotypes: Sequence[str], adversary_phenotypes: Sequence[str]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """ Returns the payoffs of the phenotypes and of the adversary phenotypes.
+        """
+        strategies = [self.get_strategy(_) for _ in phenotypes]
+        adversary_strategies = [self.get_strategy(_) for _ in adversary_phenotypes]
+        payoffs = np.array(
+            [
+                [get_memory_one_payoffs(self.game, _1, _2) for _2 in adversary_strategies]
+                for _1 in strategies
+            ]
+        ).reshape(len(strategies), len(adversary_strategies), 2)
+        if self.game.MINIMIZE:
+            payoffs = -payoffs
+
+        return payoffs[:, :, 0], payoffs[:, :, 1]
+
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""Module for storing the statistics of game theoretic games. Games are
+appended to a JSON Lines file, one record per line. The source of a player
+is written once, in a `player` record with an ID, and the game records
+refer to the ID.
+"""
+
+import atexit
+import inspect
+import json
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Open writers, flushed before their file is read and at exit
+_WRITERS: "weakref.WeakValueDictionary[str, GameStatsWriter]" = weakref.WeakValueDictionary()
+
+
+class GameStatsWriter:
+    """
+    Buffered, append-only writer of game statistics. A background thread
+    flushes the buffer every `flush_interval` seconds, and it is flushed
+    when it has `buffer_size` games.
+
+    Attributes:
+        out_file_name: JSON Lines file, truncated when the writer is created
+        buffer_size: Maximum number of buffered games
+        flush_interval: Seconds between background flushes
+    """
+
+    def __init__(
+        self, out_file_name: str, buffer_size: int = 1000, flush_interval: float = 1.0
+    ) -> None:
+        """Constructor"""
+        self.out_file_name = out_file_name
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._player_ids: Dict[str, int] = {}
+        self._sources: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        with open(self.out_file_name, "w"):
+            pass
+
+        _WRITERS[os.path.abspath(self.out_file_name)] = self
+        self._thread = threading.Thread(
+            target=GameStatsWriter._flush_periodically, args=(weakref.ref(self),), daemon=True
+        )
+        self._thread.start()
+
+    def get_source(self, player: Callable[[List[str], int], str]) -> str:
+        """Return the source code of a player. Sources of functions are
+        looked up once per code object.
+        """
+        key = getattr(player, "__code__", None)
+        if key is None:
+            # E.g. a lookup table strategy
+            return repr(player)
+
+        if key not in self._sources:
+            self._sources[key] = str(inspect.getsourcelines(player)[0])
+
+        return self._sources[key]
+
+    def get_player_id(self, source: str) -> int:
+        """Return the ID of a player source, the source is buffered the
+        first time it is seen. Assumes the lock is held.
+        """
+        if source not in self._player_ids:
+            self._player_ids[source] = len(self._player_ids)
+            self._buffer.append(json.dumps({"player": self._player_ids[source], "source": source}))
+
+        return self._player_ids[source]
+
+    def write(
+        self,
+        player_1: Callable[[List[str], int], str],
+        player_2: Callable[[List[str], int], str],
+        payoffs: List[Tuple[float, float]],
+        history: List[Tuple[str, str]],
+    ) -> None:
+        """Buffer the statistics of a game."""
+        sources = (self.get_source(player_1), self.get_source(player_2))
+        with self._lock:
+            data = {
+                "player_1": self.get_player_id(sources[0]),
+                "player_2": self.get_player_id(sources[1]),
+                "payoffs": payoffs,
+                "history": history,
+            }
+            self._buffer.append(json.dumps(data))
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Append the buffered games to the file."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Append the buffered games to the file. Assumes the lock is held."""
+        if not self._buffer:
+            return
+
+        with open(self.out_file_name, "a") as out_file:
+            out_file.write("\n".join(self._buffer) + "\n")
+
+        self._buffer = []
+
+    def close(self) -> None:
+        """Flush the buffer and stop the background thread."""
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        self.flush()
+        if _WRITERS.get(os.path.abspath(self.out_file_name)) is self:
+            del _WRITERS[os.path.abspath(self.out_file_name)]
+
+    def __del__(self) -> None:
+        self.close()
+
+    @staticmethod
+    def _flush_periodically(writer_ref: "weakref.ref[GameStatsWriter]") -> None:
+        """Flush the writer until it is closed or garbage collected. Only
+        holds a weak reference, so the writer can be collected.
+        """
+        writer: Optional[GameStatsWriter] = writer_ref()
+        while writer is not None and not writer._closed.is_set():
+            closed, interval = writer._closed, writer.flush_interval
+            writer.flush()
+            writer = None
+            if closed.wait(interval):
+                break
+
+            writer = writer_ref()
+
+
+def flush_game_stats(file_name: str) -> None:
+    """Flush the open writer of a statistics file, if any."""
+    writer = _WRITERS.get(os.path.abspath(file_name))
+    if writer is not None:
+        writer.flush()
+
+
+@atexit.register
+def _close_writers() -> None:
+    for writer in list(_WRITERS.values()):
+        writer.close()
+
+
+def read_game_stats(in_file_name: str) -> Iterator[Dict[str, Any]]:
+    """Yield the games of a statistics file, one at a time, with the
+    player IDs replaced by their source. Files in the previous format, a
+    JSON list of games, are also read.
+
+    :param in_file_name: Statistics file
+    :type in_file_name: str
+    :return: Games with `player_1`, `player_2`, `payoffs` and `history`
+    :rtype: Iterator of dict
+    """
+    flush_game_stats(in_file_name)
+    sources: Dict[int, str] = {}
+    with open(in_file_name, "r") as in_file:
+        for line in in_file:
+            if line.lstrip().startswith("["):
+                # Previous format, the whole file is a JSON list
+                in_file.seek(0)
+                yield from json.load(in_file)
+                return
+
+            if not line.strip():
+                continue
+
+            data = json.loads(line)
+            if "source" in data:
+                sources[data["player"]] = data["source"]
+                continue
+
+            data["player_1"] = sources[data["player_1"]]
+            data["player_2"] = sources[data["player_2"]]
+            yield data
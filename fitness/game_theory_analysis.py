@@ -0,0 +1,307 @@
+"""Module for analysing game theoretic games without simulating them. The
+payoffs of a game, see `GameTheoryGame.get_payoff_matrix`, give the Nash
+equilibria and evolutionarily stable strategies. The expected payoffs of
+memory-one strategies are computed from the Markov chain of the moves.
+
+Strategies are probabilities of the moves, in the order of
+`GameTheoryGame.get_moves`. Payoffs are utilities, i.e. they are negated
+for games where the payoffs are minimized, see `GameTheoryGame.MINIMIZE`.
+"""
+
+import itertools
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from fitness.game_theory_game import GameTheoryGame, LookupTableStrategy
+
+# Tolerance of the equilibrium conditions
+TOLERANCE: float = 1e-9
+
+
+def get_utilities(game: GameTheoryGame) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the utility matrices of player 1 and player 2, indexed by the
+    moves of player 1 and player 2.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :return: Utilities of player 1 and player 2, each of shape (moves, moves)
+    :rtype: tuple of numpy.ndarray
+    """
+    payoffs = game.get_payoff_matrix()[1:, 1:]
+    if game.MINIMIZE:
+        payoffs = -payoffs
+
+    return payoffs[:, :, 0], payoffs[:, :, 1]
+
+
+def get_pure_nash_equilibria(game: GameTheoryGame) -> List[Tuple[str, str]]:
+    """Return the pairs of moves where neither player gains by changing move.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :return: Moves of player 1 and player 2 of each equilibrium
+    :rtype: list of tuple
+    """
+    utilities_1, utilities_2 = get_utilities(game)
+    best_1 = utilities_1 >= utilities_1.max(axis=0, keepdims=True) - TOLERANCE
+    best_2 = utilities_2 >= utilities_2.max(axis=1, keepdims=True) - TOLERANCE
+    moves = game.get_moves()
+    return [(moves[i], moves[j]) for i, j in zip(*np.nonzero(best_1 & best_2))]
+
+
+def get_nash_equilibria(game: GameTheoryGame) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Return the pure and mixed Nash equilibria found by support enumeration.
+    For each pair of supports of equal size, the strategies that make the
+    opponent indifferent between its supported moves are solved for.
+    Assumes a nondegenerate game, e.g. the games in `game_theory_game`.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :return: Strategies of player 1 and player 2 of each equilibrium
+    :rtype: list of tuple of numpy.ndarray
+    """
+    utilities_1, utilities_2 = get_utilities(game)
+    n_moves = utilities_1.shape[0]
+    equilibria: List[Tuple[np.ndarray, np.ndarray]] = []
+    for size in range(1, n_moves + 1):
+        for support_1 in itertools.combinations(range(n_moves), size):
+            for support_2 in itertools.combinations(range(n_moves), size):
+                strategy_2 = solve_indifference(utilities_1[np.ix_(support_1, support_2)])
+                strategy_1 = solve_indifference(utilities_2[np.ix_(support_1, support_2)].T)
+                if strategy_1 is None or strategy_2 is None:
+                    continue
+
+                x = np.zeros(n_moves)
+                x[list(support_1)] = strategy_1
+                y = np.zeros(n_moves)
+                y[list(support_2)] = strategy_2
+                # No move outside the supports is better
+                if (utilities_1 @ y).max() > x @ utilities_1 @ y + TOLERANCE:
+                    continue
+                if (x @ utilities_2).max() > x @ utilities_2 @ y + TOLERANCE:
+                    continue
+                if not any(np.allclose(x, _x) and np.allclose(y, _y) for _x, _y in equilibria):
+                    equilibria.append((x, y))
+
+    return equilibria
+
+
+def solve_indifference(utilities: np.ndarray) -> Optional[np.ndarray]:
+    """Return the strategy of the column player that gives each row the
+    same utility, or None if there is no such strategy.
+
+    :param utilities: Utilities of the row player, shape (size, size)
+    :type utilities: numpy.ndarray
+    :return: Probabilities of the columns
+    :rtype: numpy.ndarray or None
+    """
+    size = utilities.shape[0]
+    # Unknowns are the probabilities and the utility, the probabilities sum to one
+    system = np.zeros((size + 1, size + 1))
+    system[:size, :size] = utilities
+    system[:size, size] = -1
+    system[size, :size] = 1
+    rhs = np.zeros(size + 1)
+    rhs[size] = 1
+    try:
+        solution = np.linalg.solve(system, rhs)
+    except np.linalg.LinAlgError:
+        return None
+
+    strategy = solution[:size]
+    if (strategy < -TOLERANCE).any():
+        return None
+
+    return np.clip(strategy, 0, 1)
+
+
+def is_evolutionarily_stable(game: GameTheoryGame, strategy: np.ndarray) -> bool:
+    """Return if a strategy of a symmetric game is evolutionarily stable, i.e.
+    a symmetric Nash equilibrium that does better against any other best
+    response than the best response does against itself.
+
+    The condition on the best responses is that the utility matrix is
+    negative definite on the strategies that only mix best responses. It
+    is exact when there are at most two best responses or the strategy
+    mixes all best responses, otherwise it is sufficient.
+
+    :param game: Symmetric game
+    :type game: GameTheoryGame
+    :param strategy: Probabilities of the moves
+    :type strategy: numpy.ndarray
+    :return: True if the strategy is evolutionarily stable
+    :rtype: bool
+    """
+    utilities, utilities_2 = get_utilities(game)
+    assert np.allclose(utilities, utilities_2.T), "Game is not symmetric"
+    strategy = np.asarray(strategy, dtype=float)
+    move_utilities = utilities @ strategy
+    utility = strategy @ move_utilities
+    if move_utilities.max() > utility + TOLERANCE:
+        return False
+
+    best_responses = np.flatnonzero(move_utilities >= utility - TOLERANCE)
+    if len(best_responses) == 1:
+        # Strict Nash equilibrium
+        return True
+
+    # Directions between the best responses
+    directions = np.zeros((len(utilities), len(best_responses) - 1))
+    directions[best_responses[0]] = -1
+    directions[best_responses[1:], np.arange(len(best_responses) - 1)] = 1
+    quadratic = directions.T @ (utilities + utilities.T) @ directions / 2
+    return bool(np.linalg.eigvalsh(quadratic).max() < -TOLERANCE)
+
+
+def get_memory_one_strategy(strategy: LookupTableStrategy) -> np.ndarray:
+    """Return the move probabilities of a deterministic memory-one lookup table strategy.
+
+    :param strategy: Lookup table strategy with `memory_size` one
+    :type strategy: LookupTableStrategy
+    :return: Move probabilities for each opponent move code, shape (moves + 1, moves)
+    :rtype: numpy.ndarray
+    """
+    assert strategy.memory_size == 1, strategy.memory_size
+    assert not strategy.iteration_tables, "Strategy depends on the iteration"
+    return np.eye(len(strategy.moves))[np.array(strategy.table) - 1]
+
+
+def get_markov_chain(
+    game: GameTheoryGame, strategy_1: np.ndarray, strategy_2: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the Markov chain of the moves of two memory-one strategies.
+    A strategy is the move probabilities for each opponent move code, the
+    first row is the first move, see `get_memory_one_strategy`. As in
+    `GameTheoryGame.run`, player 2 responds to the current move of player 1.
+
+    The states are the pairs of moves of an iteration, state `i * moves + j`
+    is move `i` of player 1 and move `j` of player 2.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :param strategy_1: Strategy of player 1, shape (moves + 1, moves)
+    :type strategy_1: numpy.ndarray
+    :param strategy_2: Strategy of player 2, shape (moves + 1, moves)
+    :type strategy_2: numpy.ndarray
+    :return: Distribution of the first iteration, shape (states,), and transition
+        probabilities, shape (states, states)
+    :rtype: tuple of numpy.ndarray
+    """
+    n_moves = len(game.get_moves())
+    assert strategy_1.shape == (n_moves + 1, n_moves), strategy_1.shape
+    assert strategy_2.shape == (n_moves + 1, n_moves), strategy_2.shape
+    # Probability of the moves of player 2 after each move of player 1
+    responses_2 = strategy_2[1:]
+    initial = (strategy_1[0][:, np.newaxis] * responses_2).ravel()
+    # From state (i, j) player 1 responds to j, then player 2 to the new move of player 1
+    transitions = (strategy_1[1:][:, :, np.newaxis] * responses_2[np.newaxis, :, :]).reshape(
+        n_moves, n_moves * n_moves
+    )
+    transitions = np.tile(transitions, (n_moves, 1))
+    return initial, transitions
+
+
+def get_memory_one_payoffs(
+    game: GameTheoryGame, strategy_1: np.ndarray, strategy_2: np.ndarray
+) -> np.ndarray:
+    """Return the expected payoff per iteration of two memory-one strategies
+    over the `n_iterations` of the game, see `get_markov_chain`.
+
+    The expected visits of the states are the finite sum `p0 (I + T + ... +
+    T^(n - 1))` of the initial distribution `p0` and the transitions `T`.
+    `I - T` is singular, so the sum is `(n - 1) p0 L + p0 (I - T^n + L) Z`,
+    where `L` is the long run limit of `T`, see `get_stationary_distribution`,
+    and `Z = (I - T + L)^-1` is the fundamental matrix of the chain. It is one
+    linear solve and a matrix power, independent of the number of iterations.
+
+    :return: Expected payoff per iteration of player 1 and player 2
+    :rtype: numpy.ndarray
+    """
+    initial, transitions = get_markov_chain(game, strategy_1, strategy_2)
+    n_iterations = game.n_iterations
+    identity = np.eye(len(initial))
+    # Long run limit of each state, the rows are the limits of the chain started in the state
+    limits = np.array([get_stationary_distribution(_, transitions) for _ in identity])
+    limit = initial @ limits
+    last = initial @ np.linalg.matrix_power(transitions, n_iterations)
+    # Solves x (I - T + L) = p0 (I - T^n + L)
+    visits = (n_iterations - 1) * limit + np.linalg.solve(
+        (identity - transitions + limits).T, initial - last + limit
+    )
+    return visits @ get_state_payoffs(game) / n_iterations
+
+
+def get_stationary_payoffs(
+    game: GameTheoryGame, strategy_1: np.ndarray, strategy_2: np.ndarray
+) -> np.ndarray:
+    """Return the long run expected payoff per iteration of two memory-one
+    strategies, from the stationary distribution of their Markov chain, see
+    `get_stationary_distribution`.
+
+    :return: Expected payoff per iteration of player 1 and player 2
+    :rtype: numpy.ndarray
+    """
+    initial, transitions = get_markov_chain(game, strategy_1, strategy_2)
+    return get_stationary_distribution(initial, transitions) @ get_state_payoffs(game)
+
+
+def get_state_payoffs(game: GameTheoryGame) -> np.ndarray:
+    """Return the payoffs of each state of `get_markov_chain`, shape (states, 2)."""
+    n_moves = len(game.get_moves())
+    return game.get_payoff_matrix()[1:, 1:].reshape(n_moves * n_moves, 2)
+
+
+def get_stationary_distribution(initial: np.ndarray, transitions: np.ndarray) -> np.ndarray:
+    """Return the long run fraction of iterations in each state of a Markov
+    chain, i.e. the limit of the mean distribution of the first iterations.
+
+    Deterministic strategies give chains with several closed classes, e.g.
+    mutual cooperation and mutual defection. The distribution is the
+    stationary distribution of each closed class, weighted by the
+    probability of reaching the class from the initial distribution.
+
+    :param initial: Distribution of the first iteration, shape (states,)
+    :type initial: numpy.ndarray
+    :param transitions: Transition probabilities, shape (states, states)
+    :type transitions: numpy.ndarray
+    :return: Stationary distribution, shape (states,)
+    :rtype: numpy.ndarray
+    """
+    n_states = len(initial)
+    # States that can reach each other
+    reachable = (np.eye(n_states) + transitions) > 0
+    for _ in range(n_states):
+        reachable = (reachable.astype(int) @ reachable.astype(int)) > 0
+
+    # States that can be reached back from every state they reach
+    closed = [state for state in range(n_states) if reachable[reachable[state], state].all()]
+    transient = np.array([_ for _ in range(n_states) if _ not in closed], dtype=int)
+    # Probability of leaving the transient states for each closed state
+    arrival = initial.copy()
+    if len(transient):
+        visits = initial[transient] @ np.linalg.inv(
+            np.eye(len(transient)) - transitions[np.ix_(transient, transient)]
+        )
+        arrival += visits @ transitions[transient]
+        arrival[transient] = 0
+
+    distribution = np.zeros(n_states)
+    classes = {tuple(np.flatnonzero(reachable[state])) for state in closed}
+    for states in classes:
+        _states = np.array(states)
+        probability = arrival[_states].sum()
+        if probability <= 0:
+            continue
+
+        # Stationary distribution of the irreducible class, it sums to one
+        size = len(_states)
+        system = np.vstack(
+            [transitions[np.ix_(_states, _states)].T - np.eye(size), np.ones((1, size))]
+        )
+        rhs = np.zeros(size + 1)
+        rhs[size] = 1
+        stationary = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        distribution[_states] = probability * stationary
+
+    return distribution
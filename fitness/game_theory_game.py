@@ -1,6 +1,8 @@
-from typing import List, Dict, Tuple, Callable
-import json
-import inspect
+from typing import List, Dict, Tuple, Callable, Sequence, Optional
+
+import numpy as np
+
+from fitness.game_stats import GameStatsWriter
 
 # TODO Define as an abstract base class
 class GameTheoryGame:
@@ -10,8 +12,12 @@ class GameTheoryGame:
     Attributes:
         n_iterations: Number of iterations
         memory_size: Size of history available
+        stats_writer: Writer of the game statistics, if `store_stats`
     """
 
+    # Payoffs are costs, e.g. sentences, that the players minimize
+    MINIMIZE: bool = False
+
     def __init__(
         self,
         n_iterations: int = 1,
@@ -25,14 +31,177 @@ class GameTheoryGame:
         self.memory_size = memory_size
         self.store_stats = store_stats
         self.out_file_name = out_file_name
+        self.stats_writer: Optional[GameStatsWriter] = None
 
         if self.store_stats:
-            with open(self.out_file_name, "w") as out_file:
-                json.dump([], out_file)
+            self.stats_writer = GameStatsWriter(self.out_file_name)
 
     def get_payoff(self) -> Dict[Tuple[str, str], Tuple[float, float]]:
         raise NotImplementedError("Implement in game")
 
+    def get_moves(self) -> List[str]:
+        """Return the moves of the game. Move codes are the index of the move plus one,
+        code 0 is no move, i.e. the history before the first iteration.
+        """
+        moves: List[str] = []
+        for move_1, move_2 in self.get_payoff().keys():
+            for move in (move_1, move_2):
+                if move not in moves:
+                    moves.append(move)
+
+        return moves
+
+    def get_payoff_matrix(self) -> np.ndarray:
+        """Return the payoffs indexed by the move codes of player 1 and player 2."""
+        moves = self.get_moves()
+        payoff_matrix = np.full((len(moves) + 1, len(moves) + 1, 2), np.nan)
+        for (move_1, move_2), payoff in self.get_payoff().items():
+            payoff_matrix[moves.index(move_1) + 1, moves.index(move_2) + 1] = payoff
+
+        return payoff_matrix
+
+    def run_batch(
+        self, tables_1: np.ndarray, tables_2: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the payoffs and moves of each iteration for many pairs of lookup table
+        strategies at once, see `LookupTableStrategy`. Row `i` of the tables is pair `i`.
+
+        The tables of a player can also have iteration buckets, shape (pairs, buckets,
+        histories), see `LookupTableStrategy.get_tables`. Iteration `i` uses bucket `i`, the
+        last bucket is used for the remaining iterations.
+
+        The payoffs and moves are the same as `run` with the `LookupTableStrategy` players.
+        Stats are not stored.
+
+        :param tables_1: Move codes of player 1 for each history, shape (pairs, histories)
+        :type tables_1: numpy.ndarray
+        :param tables_2: Move codes of player 2 for each history, shape (pairs, histories)
+        :type tables_2: numpy.ndarray
+        :return: Payoffs, shape (pairs, iterations, 2), and move codes, shape (pairs, iterations, 2)
+        :rtype: tuple of numpy.ndarray
+        """
+        n_codes = len(self.get_moves()) + 1
+        n_histories = n_codes ** self.memory_size
+        if tables_1.ndim == 2:
+            tables_1 = tables_1[:, np.newaxis, :]
+        if tables_2.ndim == 2:
+            tables_2 = tables_2[:, np.newaxis, :]
+        assert tables_1.shape[0] == tables_2.shape[0], "{} != {}".format(
+            tables_1.shape[0], tables_2.shape[0]
+        )
+        for tables in (tables_1, tables_2):
+            assert tables.shape[2] == n_histories, "{} != {}".format(tables.shape[2], n_histories)
+
+        n_pairs = tables_1.shape[0]
+        pairs = np.arange(n_pairs)
+        moves = np.zeros((n_pairs, self.n_iterations, 2), dtype=np.int64)
+        # Encoded history of the opponent, seen by each player
+        history_1 = np.zeros(n_pairs, dtype=np.int64)
+        history_2 = np.zeros(n_pairs, dtype=np.int64)
+        for i in range(self.n_iterations):
+            move_1 = tables_1[pairs, min(i, tables_1.shape[1] - 1), history_1]
+            # Player 2 sees the move of player 1, as in `run`
+            history_2 = (history_2 * n_codes + move_1) % n_histories
+            move_2 = tables_2[pairs, min(i, tables_2.shape[1] - 1), history_2]
+            history_1 = (history_1 * n_codes + move_2) % n_histories
+            moves[:, i, 0] = move_1
+            moves[:, i, 1] = move_2
+
+        payoffs = self.get_payoff_matrix()[moves[:, :, 0], moves[:, :, 1]]
+        return payoffs, moves
+
+    def compile_strategy(
+        self, player: Callable[[List[str], int], str], player_index: int = 1
+    ) -> "LookupTableStrategy":
+        """Return a lookup table strategy that makes the same moves as the player in this
+        game.
+
+        The player is probed with every history of the last `memory_size` opponent moves
+        at each iteration. The history is bounded, one older move is put before the last
+        moves and it is filled with each of the moves, the player must not depend on it.
+        Probing stops at the first iteration, after the histories are padded, that makes
+        the same moves as the previous iteration, if the last iteration also makes them.
+        Iterations that make the same moves as the last iteration share its table. So
+        the compile time does not depend on `n_iterations` unless the moves change with
+        the iteration, e.g. `i % 2`. A player whose moves change again after an unchanged
+        iteration, other than in the last iteration, is not supported.
+
+        :param player: Deterministic player
+        :type player: Callable
+        :param player_index: Player 1 or player 2, player 2 sees the current move of player 1
+        :type player_index: int
+        :return: Lookup table strategy
+        :rtype: LookupTableStrategy
+        :raises ValueError: If the player is not a deterministic memory-k strategy
+        """
+        assert player_index in (1, 2), player_index
+        moves = self.get_moves()
+        n_codes = len(moves) + 1
+        n_histories = n_codes ** self.memory_size
+
+        def probe(i: int) -> List[int]:
+            length = self.memory_size + i + player_index - 1
+            # Length of the history before the last moves, and if a last move is padding
+            n_older = length - self.memory_size
+            padding = [n_older + _ < self.memory_size for _ in range(self.memory_size)]
+            table = [0] * n_histories
+            for history in range(n_histories):
+                last = [(history // n_codes ** _) % n_codes for _ in range(self.memory_size)][::-1]
+                if any((code == 0) != pad for code, pad in zip(last, padding)):
+                    # Not a history the player can see in this iteration
+                    continue
+
+                last_moves = [moves[code - 1] if code else "" for code in last]
+                probed = set()
+                for older_move in moves:
+                    older = [older_move if n_older > self.memory_size else ""][:n_older]
+                    for _ in range(2):
+                        probed.add(player(older + last_moves, i))
+
+                if len(probed) != 1:
+                    raise ValueError(
+                        "Player is not a deterministic memory-{} strategy, iteration {}: {}".format(
+                            self.memory_size, i, sorted(probed)
+                        )
+                    )
+                table[history] = moves.index(probed.pop()) + 1
+
+            return table
+
+        tables: List[List[int]] = []
+        last_table: Optional[List[int]] = None
+        for i in range(self.n_iterations):
+            table = probe(i)
+            # Histories are no longer padded after the first memory_size iterations
+            if tables and tables[-1] == table and i + player_index - 1 > self.memory_size:
+                if last_table is None:
+                    last_table = probe(self.n_iterations - 1)
+                if last_table == table:
+                    break
+
+            tables.append(table)
+
+        # Unseen histories make the same move as the last iteration, or the first move
+        table = [code or 1 for code in tables[-1]] if tables else [1] * n_histories
+        iteration_tables = [
+            [code or default for code, default in zip(_table, table)] for _table in tables
+        ]
+        while iteration_tables and iteration_tables[-1] == table:
+            iteration_tables.pop()
+
+        return LookupTableStrategy(moves, self.memory_size, table, iteration_tables)
+
+    def get_run_output(
+        self, payoffs: np.ndarray, moves: np.ndarray, pair: int
+    ) -> Tuple[List[Tuple[float, float]], Dict[str, List[str]]]:
+        """Return the payoffs and history of a pair from `run_batch` in the format of `run`."""
+        _moves = [""] + self.get_moves()
+        history: Dict[str, List[str]] = {
+            "player_1": [""] * self.memory_size + [_moves[_] for _ in moves[pair, :, 0]],
+            "player_2": [""] * self.memory_size + [_moves[_] for _ in moves[pair, :, 1]],
+        }
+        return [tuple(_) for _ in payoffs[pair].tolist()], history
+
     @staticmethod
     def get_move(
         player: Callable[[List[Tuple[str, str]], int], str], history: List[str], iteration: int
@@ -51,6 +220,19 @@ class GameTheoryGame:
     ) -> Tuple[List[Tuple[float, float]], List[Tuple[str, str]]]:
         """Return the payoff for each iteration of the game.
         """
+        if isinstance(player_1, LookupTableStrategy) and isinstance(
+            player_2, LookupTableStrategy
+        ):
+            # Index the tables instead of calling the players
+            batch_payoffs, batch_moves = self.run_batch(
+                player_1.get_tables()[np.newaxis], player_2.get_tables()[np.newaxis]
+            )
+            payoffs, history = self.get_run_output(batch_payoffs, batch_moves, 0)
+            if self.store_stats:
+                self.dump_stats(player_1, player_2, payoffs, history)
+
+            return payoffs, history
+
         history: Dict[str, List[str]] = {
             "player_1": [""] * self.memory_size,
             "player_2": [""] * self.memory_size,
@@ -84,23 +266,72 @@ class GameTheoryGame:
         payoffs: List[Tuple[float, float]],
         history: Dict[str, List[str]],
     ) -> None:
-        """ Append run statistics to JSON file.
+        """ Append run statistics to the JSON Lines file, see `fitness.game_stats`.
 
-        Note, File IO can be slow.
+        Writes are buffered, the file is flushed in the background.
         """
-        revised_history: List[Tuple[str, str]] = self.revise_history(history)
-        data = {
-            "player_1": str(inspect.getsourcelines(player_1)[0]),
-            "player_2": str(inspect.getsourcelines(player_2)[0]),
-            "payoffs": payoffs,
-            "history": revised_history,
-        }
-        with open(self.out_file_name, "r") as in_file:
-            json_data = json.load(in_file)
+        assert self.stats_writer is not None
+        self.stats_writer.write(player_1, player_2, payoffs, self.revise_history(history))
+
+
+class LookupTableStrategy:
+    """
+    Memory-k strategy, the move is looked up from the last k moves of the opponent
+
+    Attributes:
+        moves: Moves of the game, see `GameTheoryGame.get_moves`
+        memory_size: Number of opponent moves the move depends on
+        table: Move code for each encoded history, see `encode_history`
+        iteration_tables: Tables of the first iterations, `table` is used after them
+    """
+
+    def __init__(
+        self,
+        moves: Sequence[str],
+        memory_size: int,
+        table: Sequence[int],
+        iteration_tables: Sequence[Sequence[int]] = (),
+    ) -> None:
+        """ Constructor
+        """
+        self.moves = list(moves)
+        self.memory_size = memory_size
+        self.table = list(table)
+        self.iteration_tables = [list(_) for _ in iteration_tables]
+        for _table in [self.table] + self.iteration_tables:
+            assert len(_table) == (len(self.moves) + 1) ** memory_size
+            assert all(0 < _ <= len(self.moves) for _ in _table)
+
+    def encode_history(self, history: Sequence[str]) -> int:
+        """Return the last `memory_size` moves of a history as an integer, oldest move first.
+        """
+        code = 0
+        start = len(history) - self.memory_size
+        for move in history[start:]:
+            code = code * (len(self.moves) + 1) + (self.moves.index(move) + 1 if move else 0)
+
+        return code
+
+    def get_tables(self) -> np.ndarray:
+        """Return the tables of each iteration bucket, shape (buckets, histories), see
+        `GameTheoryGame.run_batch`.
+        """
+        return np.array(self.iteration_tables + [self.table], dtype=np.int64)
+
+    def __call__(self, history: Sequence[str], iteration: int) -> str:
+        """Return the move for the opponent history.
+        """
+        if iteration < len(self.iteration_tables):
+            table = self.iteration_tables[iteration]
+        else:
+            table = self.table
+
+        return self.moves[table[self.encode_history(history)] - 1]
 
-        json_data.append(data)
-        with open(self.out_file_name, "w") as out_file:
-            json.dump(json_data, out_file)
+    def __repr__(self) -> str:
+        return "LookupTableStrategy({}, {}, {}, {})".format(
+            self.moves, self.memory_size, self.table, self.iteration_tables
+        )
 
 
 class PrisonersDilemma(GameTheoryGame):
@@ -122,6 +353,8 @@ class PrisonersDilemma(GameTheoryGame):
         (DEFECT, DEFECT): (P, P),
     }
     DEFAULT_OUT_FILE: str = "ipd_stats.json"
+    # Payoffs are sentences
+    MINIMIZE: bool = True
 
     # TODO It should be a @classmethod instead of an instance method. Should use get_payoff(cls) instead of get_payoff(self) and should use cls.PAYOFF
     def get_payoff(self) -> Dict[Tuple[str, str], Tuple[float, float]]:
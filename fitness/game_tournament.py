@@ -0,0 +1,287 @@
+"""Module for round-robin tournaments between strategies of a game
+theoretic game, and for the evolutionary dynamics of a population playing
+the tournament. The payoff matrix of the tournament is computed once, and
+the replicator and Moran dynamics only use the matrix.
+
+Strategies are players, see `GameTheoryGame.run`, or their source, e.g.
+`lambda h, i: "C"`. Only strategies given as source can be played in
+worker processes and cached.
+"""
+
+import concurrent.futures
+import json
+import math
+import os
+from typing import Any, Callable, Dict, List, MutableMapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from fitness.game_theory_game import GameTheoryGame
+
+Strategy = Union[str, Callable[[List[str], int], str]]
+
+BACKENDS: Tuple[str, ...] = ("process", "thread", "serial")
+
+# Worker process state, set once per worker by `_initialise_worker`
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def get_player(strategy: Strategy) -> Callable[[List[str], int], str]:
+    """Return the player of a strategy, the source of a strategy is evaluated."""
+    if isinstance(strategy, str):
+        player: Callable[[List[str], int], str] = eval(strategy)
+        return player
+
+    return strategy
+
+
+def get_game_key(game: GameTheoryGame, strategy_1: str, strategy_2: str, player: int) -> str:
+    """Return the cache key of the mean payoff of a player in a game between two strategies."""
+    return json.dumps(
+        [type(game).__name__, game.n_iterations, game.memory_size, strategy_1, strategy_2, player]
+    )
+
+
+def play(
+    game: GameTheoryGame,
+    players: Sequence[Callable[[List[str], int], str]],
+    pairs: Sequence[Tuple[int, int]],
+) -> List[Tuple[float, float]]:
+    """Return the mean payoff per iteration of player 1 and player 2 for each pair of players.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :param players: Players
+    :type players: list of Callable
+    :param pairs: Indices of player 1 and player 2
+    :type pairs: list of tuple
+    :return: Mean payoffs of each pair
+    :rtype: list of tuple
+    """
+    results: List[Tuple[float, float]] = []
+    for i, j in pairs:
+        payoffs, _ = game.run(players[i], players[j])
+        payoff_1, payoff_2 = np.mean(payoffs, axis=0).tolist()
+        results.append((payoff_1, payoff_2))
+
+    return results
+
+
+def _initialise_worker(game: GameTheoryGame, strategies: Sequence[str]) -> None:
+    """Set up the game and players of a worker process.
+
+    :param game: Game
+    :type game: GameTheoryGame
+    :param strategies: Source of each strategy
+    :type strategies: list of str
+    """
+    _WORKER_STATE["game"] = game
+    _WORKER_STATE["players"] = [get_player(_) for _ in strategies]
+
+
+def _play_in_worker(pairs: Sequence[Tuple[int, int]]) -> List[Tuple[float, float]]:
+    """Play pairs of players in a worker process, see `play`."""
+    return play(_WORKER_STATE["game"], _WORKER_STATE["players"], pairs)
+
+
+def play_batch(
+    game: GameTheoryGame, strategies: Sequence[Strategy], pairs: Sequence[Tuple[int, int]]
+) -> List[Tuple[float, float]]:
+    """Play pairs of strategies with the lookup table engine, see
+    `GameTheoryGame.compile_strategy` and `GameTheoryGame.run_batch`. The
+    strategies are compiled once for each role.
+
+    :return: Mean payoffs of each pair
+    :rtype: list of tuple
+    """
+    players = [get_player(_) for _ in strategies]
+    tables: Dict[Tuple[int, int], np.ndarray] = {}
+    for role, indices in ((1, {_[0] for _ in pairs}), (2, {_[1] for _ in pairs})):
+        for index in indices:
+            tables[(role, index)] = game.compile_strategy(players[index], role).get_tables()
+
+    # Iteration buckets are repeated to the same number for all strategies
+    n_buckets = max(_.shape[0] for _ in tables.values())
+    for key, _tables in tables.items():
+        tables[key] = _tables[np.minimum(np.arange(n_buckets), _tables.shape[0] - 1)]
+
+    payoffs, _ = game.run_batch(
+        np.array([tables[(1, i)] for i, _ in pairs]), np.array([tables[(2, j)] for _, j in pairs])
+    )
+    return [(payoff_1, payoff_2) for payoff_1, payoff_2 in payoffs.mean(axis=1).tolist()]
+
+
+def get_tournament_payoffs(
+    game: GameTheoryGame,
+    strategies: Sequence[Strategy],
+    settings: Optional[Dict[str, Any]] = None,
+    cache: Optional[MutableMapping[str, Any]] = None,
+    compile_strategies: bool = False,
+) -> np.ndarray:
+    """Return the payoff matrix of a round-robin tournament. Each strategy
+    plays each strategy, itself included, once as player 1 and once as
+    player 2. Entry `i, j` is the mean payoff per iteration of strategy `i`
+    against strategy `j`, averaged over the two roles.
+
+    :param game: Game, without `store_stats`
+    :type game: GameTheoryGame
+    :param strategies: Strategies
+    :type strategies: list of str or Callable
+    :param settings: `parallel` settings, `workers`, `chunk_size` and `backend`,
+                     default is serial
+    :type settings: dict
+    :param cache: Mean payoffs of the games between strategies given as source, e.g.
+                  a fitness cache
+    :type cache: dict
+    :param compile_strategies: Play the strategies with the lookup table engine, the
+                               strategies must be deterministic memory-k strategies
+    :type compile_strategies: bool
+    :return: Payoff matrix, shape (strategies, strategies)
+    :rtype: numpy.ndarray
+    """
+    assert not game.store_stats, "Stats are not stored by tournaments"
+    settings = settings or {"backend": "serial"}
+    backend: str = settings.get("backend", "process")
+    workers: int = settings.get("workers", os.cpu_count() or 1)
+    assert backend in BACKENDS, backend
+    assert workers > 0, workers
+
+    n_strategies = len(strategies)
+    results: Dict[Tuple[int, int], Tuple[float, float]] = {}
+    for i, strategy_1 in enumerate(strategies):
+        for j, strategy_2 in enumerate(strategies):
+            if cache is not None and isinstance(strategy_1, str) and isinstance(strategy_2, str):
+                keys = [get_game_key(game, strategy_1, strategy_2, _) for _ in (1, 2)]
+                if all(key in cache for key in keys):
+                    results[(i, j)] = (cache[keys[0]], cache[keys[1]])
+
+    pairs = [
+        (i, j) for i in range(n_strategies) for j in range(n_strategies) if (i, j) not in results
+    ]
+    if compile_strategies and pairs:
+        _results = play_batch(game, strategies, pairs)
+    elif backend == "serial" or not pairs:
+        _results = play(game, [get_player(_) for _ in strategies], pairs)
+    else:
+        chunk_size = settings.get("chunk_size", 0) or max(1, math.ceil(len(pairs) / (4 * workers)))
+        bounds = range(0, len(pairs) + chunk_size, chunk_size)
+        chunks = [pairs[start:end] for start, end in zip(bounds, bounds[1:])]
+        executor: concurrent.futures.Executor
+        if backend == "process":
+            assert all(isinstance(_, str) for _ in strategies), "Processes need the source"
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_initialise_worker, initargs=(game, strategies)
+            )
+            _map = executor.map(_play_in_worker, chunks)
+        else:
+            players = [get_player(_) for _ in strategies]
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            _map = executor.map(lambda _pairs: play(game, players, _pairs), chunks)
+
+        with executor:
+            _results = [result for _chunk_results in _map for result in _chunk_results]
+
+    for (i, j), result in zip(pairs, _results):
+        results[(i, j)] = result
+        if cache is not None and isinstance(strategies[i], str) and isinstance(strategies[j], str):
+            for player, payoff in zip((1, 2), result):
+                cache[get_game_key(game, strategies[i], strategies[j], player)] = payoff
+
+    payoffs = np.zeros((n_strategies, n_strategies))
+    for (i, j), (payoff_1, payoff_2) in results.items():
+        payoffs[i, j] += payoff_1 / 2
+        payoffs[j, i] += payoff_2 / 2
+
+    return payoffs
+
+
+def get_fitness_matrix(
+    payoffs: np.ndarray, minimize: bool = False, background_fitness: float = 1.0
+) -> np.ndarray:
+    """Return the fitness of each strategy against each strategy. Payoffs
+    are negated if they are minimized, and shifted so that the lowest
+    fitness is `background_fitness`.
+
+    :param payoffs: Tournament payoff matrix, see `get_tournament_payoffs`
+    :type payoffs: numpy.ndarray
+    :param minimize: Payoffs are minimized, see `GameTheoryGame.MINIMIZE`
+    :type minimize: bool
+    :param background_fitness: Lowest fitness, must be positive
+    :type background_fitness: float
+    :return: Fitness matrix
+    :rtype: numpy.ndarray
+    """
+    assert background_fitness > 0, background_fitness
+    utilities = -payoffs if minimize else payoffs
+    return utilities - utilities.min() + background_fitness
+
+
+def replicator_dynamics(fitness: np.ndarray, shares: np.ndarray, generations: int) -> np.ndarray:
+    """Return the population share of each strategy for each generation of
+    the discrete replicator dynamics. A share grows in proportion to the
+    expected fitness of the strategy against the population.
+
+    :param fitness: Fitness matrix, see `get_fitness_matrix`
+    :type fitness: numpy.ndarray
+    :param shares: Initial population shares, they sum to one
+    :type shares: numpy.ndarray
+    :param generations: Number of generations
+    :type generations: int
+    :return: Shares, shape (generations + 1, strategies)
+    :rtype: numpy.ndarray
+    """
+    assert np.isclose(np.sum(shares), 1), np.sum(shares)
+    trajectory = np.zeros((generations + 1, len(shares)))
+    trajectory[0] = shares
+    for generation in range(generations):
+        expected_fitness = fitness @ trajectory[generation]
+        trajectory[generation + 1] = trajectory[generation] * expected_fitness
+        trajectory[generation + 1] /= trajectory[generation + 1].sum()
+
+    return trajectory
+
+
+def moran_process(
+    fitness: np.ndarray,
+    counts: np.ndarray,
+    steps: int,
+    rng: np.random.Generator,
+    selection_intensity: float = 1.0,
+) -> np.ndarray:
+    """Return the population share of each strategy for each step of a
+    frequency dependent Moran process. Each step an individual is chosen to
+    reproduce in proportion to its fitness, and its offspring replaces a
+    uniformly chosen individual. The fitness of an individual is
+    `1 - selection_intensity + selection_intensity * payoff`, where payoff is
+    the mean fitness against the other individuals.
+
+    :param fitness: Fitness matrix, see `get_fitness_matrix`
+    :type fitness: numpy.ndarray
+    :param counts: Initial number of individuals of each strategy
+    :type counts: numpy.ndarray
+    :param steps: Number of steps
+    :type steps: int
+    :param rng: Random number generator
+    :type rng: numpy.random.Generator
+    :param selection_intensity: Weight of the payoff in the fitness, between 0 and 1
+    :type selection_intensity: float
+    :return: Shares, shape (steps + 1, strategies)
+    :rtype: numpy.ndarray
+    """
+    assert 0 <= selection_intensity <= 1, selection_intensity
+    counts = np.array(counts, dtype=np.int64)
+    size = counts.sum()
+    assert size > 1, size
+    trajectory = np.zeros((steps + 1, len(counts)))
+    trajectory[0] = counts / size
+    for step in range(steps):
+        # Individuals do not play themselves
+        payoffs = (fitness @ counts - np.diag(fitness)) / (size - 1)
+        weights = counts * (1 - selection_intensity + selection_intensity * payoffs)
+        parent = rng.choice(len(counts), p=weights / weights.sum())
+        dead = rng.choice(len(counts), p=counts / size)
+        counts[parent] += 1
+        counts[dead] -= 1
+        trajectory[step + 1] = counts / size
+
+    return trajectory
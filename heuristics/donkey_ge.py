@@ -3,18 +3,40 @@ import math
 import time
 import argparse
 import collections
+import concurrent.futures
 import copy
+import functools
+import hashlib
+import heapq
+import operator
 import os
 import random
 import re
-from typing import List, Tuple, Any, Dict, Optional, DefaultDict, Sequence, Union
+import threading
+from typing import (
+    List,
+    Tuple,
+    Any,
+    Dict,
+    Optional,
+    DefaultDict,
+    Sequence,
+    Union,
+    Callable,
+    Iterator,
+    cast,
+)
 from numbers import Number
 import json
 
+import numpy as np
+
+from heuristics.fitness_cache import FitnessCache, get_fitness_cache
 from util.utils import import_function
 
 # Lark library imports 
-from lark import Lark
+from lark import Lark, Tree, __version__ as lark_version
+from lark.exceptions import LarkError
 from lark.grammar import NonTerminal, Terminal, Rule
 from lark.lexer import TerminalDef# Updated grammar with a "NUMBER" placeholder for numbers
 
@@ -50,6 +72,36 @@ class Grammar(object):
         self.terminals: set = set()
         self.start_rule: Tuple[str, str] = ("", "")
         self.file_name: str = file_name
+        # Compiled integer tables for the mapper, see `compile_rules`
+        self.symbol_ids: Dict[Tuple[str, str], int] = {}
+        self.terminal_strings: List[str] = []
+        self.rule_arity: List[int] = []
+        self.production_offsets: List[int] = []
+        self.productions: List[Tuple[int, ...]] = []
+        self.start_symbol_id: int = 0
+        # Analysis of the compiled non-terminals and productions, see `analyse_rules`
+        self.min_depths: List[float] = []
+        self.productive: List[bool] = []
+        self.recursive: List[bool] = []
+        self.production_min_depths: List[float] = []
+        self.production_recursive: List[bool] = []
+        self.compiled: bool = False
+        # Optional cache of mapped genomes, see `map_input_with_grammar`
+        self.mapping_cache: Optional[MappingCache] = None
+        # Record derivation checkpoints, see `derive_incremental`
+        self.incremental: bool = False
+        # Record derivation trees, see `derive_tree`
+        self.trees: bool = False
+        # Maximum depth of structured genomes, see `derive_sge`, None maps codon lists
+        self.sge_max_depth: Optional[int] = None
+        # Parser of the compiled rules, see `reverse_map`
+        self.parser: Optional[Lark] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The parser is rebuilt when needed, workers only map
+        state = self.__dict__.copy()
+        state["parser"] = None
+        return state
 
     def read_bnf_file(self, file_name: str) -> None:
         """Read a grammar file in BNF format. Wrapper for file reading.
@@ -149,12 +201,476 @@ class Grammar(object):
                 # Remember the last character of the line
                 last_character = productions[-1]
 
+        # Rules changed, the compiled tables and mapped genomes are stale
+        self.compiled = False
+        if self.mapping_cache is not None:
+            self.mapping_cache = MappingCache(self.mapping_cache.max_entries)
+
     def __str__(self) -> str:
         return "T:{}\nNT:{}\nR:{}\nS:{}\n".format(
             self.terminals, self.non_terminals, self.rules, self.start_rule
         )
 
-    def generate_sentence(self, inputs: List[int]) -> Tuple[str, int]:
+    def compile_rules(self) -> None:
+        """Compile the rules into integer tables used by `generate_sentence`.
+
+        Non-terminals get ids `0..n-1` in rule order, terminals get negative
+        ids `~i` where `i` indexes `terminal_strings`. The productions of
+        non-terminal `nt` are `productions[production_offsets[nt] + k]` for
+        `k < rule_arity[nt]`. Productions are stored reversed, so they can be
+        pushed directly on the derivation stack.
+        """
+        self.symbol_ids = {}
+        self.terminal_strings = []
+        self.rule_arity = []
+        self.production_offsets = []
+        self.productions = []
+
+        # Non-terminals first, so the ids follow the rule order
+        for lhs in self.rules.keys():
+            self.symbol_ids[(lhs, Grammar.NT)] = len(self.symbol_ids)
+
+        def get_symbol_id(symbol: Tuple[str, str]) -> int:
+            if symbol not in self.symbol_ids:
+                if symbol[1] == Grammar.NT:
+                    # Undefined non-terminal, it has no productions
+                    self.symbol_ids[symbol] = len(self.rule_arity)
+                    self.rule_arity.append(0)
+                    self.production_offsets.append(len(self.productions))
+                else:
+                    self.symbol_ids[symbol] = ~len(self.terminal_strings)
+                    self.terminal_strings.append(symbol[0])
+
+            return self.symbol_ids[symbol]
+
+        self.rule_arity = [len(productions) for productions in self.rules.values()]
+        self.production_offsets = [0] * len(self.rule_arity)
+        for lhs, productions in self.rules.items():
+            self.production_offsets[self.symbol_ids[(lhs, Grammar.NT)]] = len(self.productions)
+            for production in productions:
+                symbol_ids = [get_symbol_id(tuple(symbol)) for symbol in production]
+                self.productions.append(tuple(reversed(symbol_ids)))
+
+        self.start_symbol_id = get_symbol_id(self.start_rule)
+        self.analyse_rules()
+        self.parser = None
+        self.compiled = True
+
+    def analyse_rules(self) -> None:
+        """Compute the minimum derivation depth, productivity and recursiveness of
+        each compiled non-terminal and production.
+
+        The depth of a derivation tree counts the non-terminals on its longest
+        path. A non-terminal is productive if it derives a sentence, i.e. its
+        minimum depth is finite. It is recursive if it can derive itself, and a
+        production is recursive if one of its symbols can derive its
+        non-terminal.
+        """
+        n_non_terminals = len(self.rule_arity)
+        owners = [0] * len(self.productions)
+        for symbol in range(n_non_terminals):
+            offset = self.production_offsets[symbol]
+            for production in range(offset, offset + self.rule_arity[symbol]):
+                owners[production] = symbol
+
+        def get_depth(production: Tuple[int, ...]) -> float:
+            return 1 + max([self.min_depths[_] for _ in production if _ >= 0], default=0)
+
+        # Fixed point of the minimum depths, undefined non-terminals are not productive
+        self.min_depths = [math.inf] * n_non_terminals
+        changed = True
+        while changed:
+            changed = False
+            for production, owner in zip(self.productions, owners):
+                depth = get_depth(production)
+                if depth < self.min_depths[owner]:
+                    self.min_depths[owner] = depth
+                    changed = True
+
+        self.production_min_depths = [get_depth(_) for _ in self.productions]
+        self.productive = [_ < math.inf for _ in self.min_depths]
+
+        # Non-terminals that each non-terminal derives, in one or more steps
+        children: List[set] = [set() for _ in range(n_non_terminals)]
+        for production, owner in zip(self.productions, owners):
+            children[owner].update(_ for _ in production if _ >= 0)
+
+        reachable: List[set] = []
+        for symbol in range(n_non_terminals):
+            seen: set = set()
+            frontier = list(children[symbol])
+            while frontier:
+                _symbol = frontier.pop()
+                if _symbol not in seen:
+                    seen.add(_symbol)
+                    frontier.extend(children[_symbol])
+            reachable.append(seen)
+
+        self.recursive = [symbol in reachable[symbol] for symbol in range(n_non_terminals)]
+        self.production_recursive = [
+            any(_ >= 0 and (_ == owner or owner in reachable[_]) for _ in production)
+            for production, owner in zip(self.productions, owners)
+        ]
+
+    def get_genome_length(self, used_input: int, steps: int) -> int:
+        """Return the shortest genome that `derive` maps completely, for a
+        derivation that uses `used_input` inputs in `steps` steps. `derive`
+        needs an unused input and stops after inputs times terminals steps.
+
+        :param used_input: Number of inputs used by the derivation
+        :type used_input: int
+        :param steps: Number of derivation steps
+        :type steps: int
+        :returns: Genome length
+        :rtype: int
+        """
+        return max(used_input + 1, -(-(steps + 1) // max(1, len(self.terminals))))
+
+    def generate_inputs(
+        self, max_depth: int, full: bool, rng: Any = random, symbol: Optional[int] = None
+    ) -> Tuple[List[int], int]:
+        """Return the inputs of a random derivation tree of at most `max_depth`,
+        and the number of derivation steps. Only productions that can finish
+        within the depth are chosen. Grow chooses among them uniformly, full
+        prefers recursive productions, so the tree is as deep as possible.
+
+        :param max_depth: Maximum derivation tree depth
+        :type max_depth: int
+        :param full: Prefer recursive productions
+        :type full: bool
+        :param rng: Random number generator
+        :type rng: random.Random
+        :param symbol: Compiled non-terminal at the root of the tree, default the start symbol
+        :type symbol: int
+        :returns: Inputs and number of derivation steps
+        :rtype: tuple of list of int and int
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        root = self.start_symbol_id if symbol is None else symbol
+        assert self.min_depths[root] <= max_depth, "max_depth {} < {}".format(
+            max_depth, self.min_depths[root]
+        )
+        inputs: List[int] = []
+        cnt = 0
+        # Unexpanded symbols with the depth left for them, derived leftmost first as `derive`
+        unexpanded_symbols: List[Tuple[int, int]] = [(root, max_depth)]
+        while unexpanded_symbols:
+            current_symbol, depth = unexpanded_symbols.pop()
+            cnt += 1
+            if current_symbol < 0:
+                continue
+
+            arity = self.rule_arity[current_symbol]
+            offset = self.production_offsets[current_symbol]
+            choices = [
+                _ for _ in range(arity) if self.production_min_depths[offset + _] <= depth
+            ]
+            if full and any(self.production_recursive[offset + _] for _ in choices):
+                choices = [_ for _ in choices if self.production_recursive[offset + _]]
+
+            choice = rng.choice(choices)
+            if arity > 1:
+                # Any codon with the same remainder selects the production
+                assert Individual.codon_size >= choice, Individual.codon_size
+                inputs.append(
+                    choice + arity * rng.randint(0, (Individual.codon_size - choice) // arity)
+                )
+
+            unexpanded_symbols.extend((_, depth - 1) for _ in self.productions[offset + choice])
+
+        return inputs, cnt
+
+    def get_symbol(self, symbol_id: int) -> Tuple[str, str]:
+        """Return the `(value, type)` symbol of a compiled symbol id.
+
+        :param symbol_id: Compiled symbol id
+        :type symbol_id: int
+        :returns: Symbol
+        :rtype: tuple of str and str
+        """
+        if symbol_id < 0:
+            return self.terminal_strings[~symbol_id], Grammar.T
+
+        for symbol, _id in self.symbol_ids.items():
+            if _id == symbol_id:
+                return symbol
+
+        raise KeyError(symbol_id)
+
+    def count_derivations(self) -> Optional[int]:
+        """Return the number of derivations of the start symbol, or None if
+        the language is infinite, i.e. a non-terminal reachable from the
+        start symbol is recursive. Counted with dynamic programming over the
+        non-terminals. Ambiguous grammars have fewer distinct phenotypes than
+        derivations.
+
+        :returns: Number of derivations
+        :rtype: int or None
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        counts: Dict[int, int] = {}
+        # Non-terminals that are being counted, reaching one again is recursion
+        visiting: set = set()
+
+        def count(symbol: int) -> Optional[int]:
+            if symbol < 0:
+                return 1
+            if symbol in counts:
+                return counts[symbol]
+            if symbol in visiting:
+                return None
+
+            visiting.add(symbol)
+            total = 0
+            offset = self.production_offsets[symbol]
+            for production in self.productions[offset : offset + self.rule_arity[symbol]]:
+                product = 1
+                for _symbol in production:
+                    _count = count(_symbol)
+                    if _count is None:
+                        return None
+                    product *= _count
+
+                total += product
+
+            visiting.remove(symbol)
+            counts[symbol] = total
+            return total
+
+        return count(self.start_symbol_id)
+
+    def enumerate_inputs(self) -> Iterator[List[int]]:
+        """Yield the inputs of every derivation of a finite language, see
+        `count_derivations`. The inputs are the production choices, in the
+        order `derive` uses them, padded with unused inputs so that `derive`
+        does not stop before the derivation is complete.
+
+        :returns: Inputs
+        :rtype: Iterator of list of int
+        """
+        assert self.count_derivations() is not None, "Language is infinite"
+        # Unexpanded symbols, top is the leftmost, inputs so far and derivation steps
+        derivations: List[Tuple[Tuple[int, ...], List[int], int]] = [
+            ((self.start_symbol_id,), [], 0)
+        ]
+        while derivations:
+            stack, inputs, cnt = derivations.pop()
+            unexpanded_symbols = list(stack)
+            while unexpanded_symbols:
+                current_symbol = unexpanded_symbols.pop()
+                cnt += 1
+                if current_symbol < 0:
+                    continue
+
+                arity = self.rule_arity[current_symbol]
+                offset = self.production_offsets[current_symbol]
+                if arity == 1:
+                    unexpanded_symbols.extend(self.productions[offset])
+                else:
+                    # Push the choices reversed, so the first choice is derived first
+                    for choice in reversed(range(arity)):
+                        derivations.append(
+                            (
+                                tuple(unexpanded_symbols) + self.productions[offset + choice],
+                                inputs + [choice],
+                                cnt,
+                            )
+                        )
+                    break
+            else:
+                yield inputs + [0] * (self.get_genome_length(len(inputs), cnt) - len(inputs))
+
+    def derive_sge(
+        self, genome: List[List[int]], max_depth: int, rng: Any = random
+    ) -> Tuple[str, List[int], int, List[List[int]]]:
+        """Map a structured genome (SGE) to output sentence (phenotype). The
+        genome has a gene list for each compiled non-terminal. Gene `i` of a
+        non-terminal is the production of its `i`th expansion, in the order
+        `derive` expands them, so a gene is a number below the arity of its
+        non-terminal and there is no modulo redundancy.
+
+        The derivation tree is at most `max_depth` deep. A gene for a
+        production that does not finish within the depth selects among the
+        productions that do, `choices[gene % len(choices)]`. When the genes of
+        a non-terminal are used up, random genes are added to a copy of the
+        genome, so any genome maps.
+
+        :param genome: Gene list of each non-terminal
+        :type genome: list of list of int
+        :param max_depth: Maximum derivation tree depth
+        :type max_depth: int
+        :param rng: Random number generator for added genes
+        :type rng: random.Random
+        :returns: Sentence, number of used genes of each non-terminal, number of derivation
+                  steps and genome, a new genome if genes were added
+        :rtype: tuple of str, list of int, int and list of list of int
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        assert len(genome) == len(self.rule_arity), len(genome)
+        assert self.min_depths[self.start_symbol_id] <= max_depth, "max_depth {} < {}".format(
+            max_depth, self.min_depths[self.start_symbol_id]
+        )
+        used_genes = [0] * len(self.rule_arity)
+        output: List[str] = []
+        cnt = 0
+        # Gene lists copied before genes are added to them
+        copied: set = set()
+        # Unexpanded symbols with the depth left for them, derived leftmost first as `derive`
+        unexpanded_symbols: List[Tuple[int, int]] = [(self.start_symbol_id, max_depth)]
+        while unexpanded_symbols:
+            current_symbol, depth = unexpanded_symbols.pop()
+            cnt += 1
+            if current_symbol < 0:
+                output.append(self.terminal_strings[~current_symbol])
+                continue
+
+            arity = self.rule_arity[current_symbol]
+            offset = self.production_offsets[current_symbol]
+            if arity == 1:
+                choice = 0
+            elif arity > 1:
+                genes = genome[current_symbol]
+                if used_genes[current_symbol] == len(genes):
+                    if not copied:
+                        genome = list(genome)
+                    if current_symbol not in copied:
+                        genes = genome[current_symbol] = list(genes)
+                        copied.add(current_symbol)
+                    genes.append(
+                        rng.choice(
+                            [
+                                _
+                                for _ in range(arity)
+                                if self.production_min_depths[offset + _] <= depth
+                            ]
+                        )
+                    )
+
+                choice = genes[used_genes[current_symbol]]
+                used_genes[current_symbol] += 1
+                if self.production_min_depths[offset + choice] > depth:
+                    choices = [
+                        _ for _ in range(arity) if self.production_min_depths[offset + _] <= depth
+                    ]
+                    choice = choices[choice % len(choices)]
+            else:
+                raise KeyError(self.get_symbol(current_symbol)[0])
+
+            unexpanded_symbols.extend((_, depth - 1) for _ in self.productions[offset + choice])
+
+        return "".join(output), used_genes, cnt, genome
+
+    def get_structured_genome(self, inputs: Sequence[int]) -> List[List[int]]:
+        """Return the structured genome of the derivation of inputs, see
+        `derive_sge`, e.g. of the inputs of `reverse_map`.
+
+        :param inputs: Inputs of a complete derivation
+        :type inputs: list of int
+        :returns: Gene list of each non-terminal
+        :rtype: list of list of int
+        """
+        tree = self.derive_tree(inputs)[3]
+        assert tree is not None, "Derivation is not complete: {}".format(inputs)
+        genome: List[List[int]] = [[] for _ in self.rule_arity]
+        for symbol, start in zip(tree.symbols, tree.starts):
+            arity = self.rule_arity[symbol]
+            if arity > 1:
+                genome[symbol].append(inputs[start] % arity)
+
+        return genome
+
+    def get_parser(self) -> Lark:
+        """Return an Earley parser of the compiled rules. Each production is a
+        rule alternative aliased `p_<non-terminal>_<choice>`, so the parse tree
+        gives the production choices. Unproductive non-terminals and
+        productions are left out.
+
+        :returns: Parser
+        :rtype: Lark
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        if self.parser is not None:
+            return self.parser
+
+        if not self.productive[self.start_symbol_id]:
+            raise ValueError("Grammar start symbol is not productive")
+
+        lines: List[str] = []
+        for symbol in range(len(self.rule_arity)):
+            if not self.productive[symbol]:
+                continue
+
+            alternatives = []
+            offset = self.production_offsets[symbol]
+            for choice in range(self.rule_arity[symbol]):
+                if self.production_min_depths[offset + choice] == math.inf:
+                    continue
+
+                symbols = [
+                    json.dumps(self.terminal_strings[~_], ensure_ascii=False)
+                    if _ < 0
+                    else "nt_{}".format(_)
+                    for _ in reversed(self.productions[offset + choice])
+                ]
+                alternatives.append("{} -> p_{}_{}".format(" ".join(symbols), symbol, choice))
+
+            lines.append("nt_{}: {}".format(symbol, "\n    | ".join(alternatives)))
+
+        self.parser = Lark(
+            "\n".join(lines),
+            start="nt_{}".format(self.start_symbol_id),
+            parser="earley",
+            lexer="dynamic",
+            ambiguity="resolve",
+            keep_all_tokens=True,
+        )
+        return self.parser
+
+    def reverse_map(self, phenotype: str) -> List[int]:
+        """Return the inputs of a derivation of a phenotype, i.e. the genome
+        that maps to it. The phenotype is parsed with `get_parser`, and the
+        production choices are read from the parse tree in the order `derive`
+        uses them. Ambiguous phenotypes get the inputs of one of their
+        derivations. The inputs are padded with unused inputs so that `derive`
+        does not stop before the derivation is complete.
+
+        :param phenotype: Sentence of the grammar
+        :type phenotype: str
+        :returns: Inputs
+        :rtype: list of int
+        """
+        try:
+            tree = self.get_parser().parse(phenotype)
+        except LarkError as e:
+            raise ValueError("Phenotype is not in the language: {}\n{}".format(phenotype, e))
+
+        inputs: List[int] = []
+        cnt = 0
+        # The top of the stack is the leftmost unexpanded node, as in `derive`
+        unexpanded_nodes: List[Any] = [tree]
+        while unexpanded_nodes:
+            node = unexpanded_nodes.pop()
+            cnt += 1
+            if not isinstance(node, Tree):
+                continue
+
+            _, symbol, choice = node.data.split("_")
+            if self.rule_arity[int(symbol)] > 1:
+                inputs.append(int(choice))
+
+            unexpanded_nodes.extend(reversed(node.children))
+
+        return inputs + [0] * (self.get_genome_length(len(inputs), cnt) - len(inputs))
+
+    def generate_sentence(self, inputs: Sequence[int]) -> Tuple[str, int]:
         """Map inputs via rules to output sentence (phenotype).
 
         :param inputs: Inputs used to generate sentence with grammar
@@ -162,50 +678,640 @@ class Grammar(object):
         :returns: Sentence and number of inputs used (phenotype)
         :rtype: tuple of str and int
         """
+        sentence, used_input, _ = self.derive(inputs)
+        return sentence, used_input
+
+    def derive(self, inputs: Sequence[int]) -> Tuple[str, int, int]:
+        """Map inputs via rules to output sentence (phenotype), and return
+        the number of derivation steps as well.
+
+        The derivation runs on the compiled rule tables, see `compile_rules`.
+
+        :param inputs: Inputs used to generate sentence with grammar
+        :type inputs: list of int
+        :returns: Sentence, number of inputs used and number of derivation steps
+        :rtype: tuple of str, int and int
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        rule_arity = self.rule_arity
+        production_offsets = self.production_offsets
+        productions = self.productions
+        terminal_strings = self.terminal_strings
+        n_inputs = len(inputs)
         used_input = 0
-        # TODO faster data structure? E.g. queue
         output: List[str] = []
         # Needed to avoid infinite loops with poorly specified
         # grammars
         cnt = 0
-        break_out = len(inputs) * len(self.terminals)
-        unexpanded_symbols: List[Tuple[str, str]] = [self.start_rule]
-        while unexpanded_symbols and used_input < len(inputs) and cnt < break_out:
+        break_out = n_inputs * len(self.terminals)
+        # Derivation order is left to right(depth-first), the top of
+        # the stack is the leftmost unexpanded symbol
+        unexpanded_symbols: List[int] = [self.start_symbol_id]
+        while unexpanded_symbols and used_input < n_inputs and cnt < break_out:
             # Expand a production
-            current_symbol: Tuple[str, str] = unexpanded_symbols.pop(0)
+            current_symbol = unexpanded_symbols.pop()
             # Set output if it is a terminal
-            if current_symbol is not None and current_symbol[1] != Grammar.NT:
-                output.append(current_symbol[0])
+            if current_symbol < 0:
+                output.append(terminal_strings[~current_symbol])
             else:
-                production_choices = self.rules[current_symbol[0]]
-                # Select a production
-                current_production = inputs[used_input] % len(production_choices)
-                # Use an inputs if there was more than 1 choice
-                if len(production_choices) > 1:
+                arity = rule_arity[current_symbol]
+                if arity == 1:
+                    current_production = production_offsets[current_symbol]
+                elif arity > 1:
+                    # Select a production and use an input, since there
+                    # was more than 1 choice
+                    current_production = (
+                        production_offsets[current_symbol] + inputs[used_input] % arity
+                    )
                     used_input += 1
+                else:
+                    raise KeyError(self.get_symbol(current_symbol)[0])
 
-                # Derivation order is left to right(depth-first)
-                unexpanded_symbols = production_choices[current_production] + unexpanded_symbols
+                unexpanded_symbols.extend(productions[current_production])
 
             cnt += 1
 
         # Not fully expanded
         if unexpanded_symbols:
-            return Individual.DEFAULT_PHENOTYPE, used_input
+            return Individual.DEFAULT_PHENOTYPE, used_input, cnt
         else:
             str_output: str = "".join(output)
-            return str_output, used_input
+            return str_output, used_input, cnt
+
+    def derive_incremental(
+        self, inputs: Sequence[int], derivation: Optional["Derivation"] = None
+    ) -> Tuple[str, int, int, Optional["Derivation"]]:
+        """Map inputs via rules to output sentence (phenotype), see `derive`,
+        and record a checkpoint for each used input.
+
+        When a derivation of an earlier genome is given, the mapping resumes
+        from its last checkpoint. The checkpoints must be for a genome with
+        the same codons before the last checkpoint, see `Derivation.truncate`.
+
+        :param inputs: Inputs used to generate sentence with grammar
+        :type inputs: list of int
+        :param derivation: Checkpoints to resume from
+        :type derivation: Derivation
+        :returns: Sentence, number of inputs used, number of derivation steps and checkpoints
+        :rtype: tuple of str, int, int and Derivation
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        rule_arity = self.rule_arity
+        production_offsets = self.production_offsets
+        productions = self.productions
+        terminal_strings = self.terminal_strings
+        n_inputs = len(inputs)
+        break_out = n_inputs * len(self.terminals)
+        checkpoints: List[Tuple[Tuple[int, ...], int, int]]
+        if derivation is not None and derivation.checkpoints:
+            # Resume from the state before the last checkpointed input is used
+            used_input = len(derivation.checkpoints) - 1
+            stack, n_characters, cnt = derivation.checkpoints[used_input]
+            unexpanded_symbols: List[int] = list(stack)
+            output: List[str] = [derivation.phenotype[:n_characters]]
+            checkpoints = derivation.checkpoints[:used_input]
+        else:
+            used_input = 0
+            n_characters = 0
+            cnt = 0
+            unexpanded_symbols = [self.start_symbol_id]
+            output = []
+            checkpoints = []
+
+        while unexpanded_symbols and used_input < n_inputs and cnt < break_out:
+            current_symbol = unexpanded_symbols.pop()
+            if current_symbol < 0:
+                terminal = terminal_strings[~current_symbol]
+                output.append(terminal)
+                n_characters += len(terminal)
+            else:
+                arity = rule_arity[current_symbol]
+                if arity == 1:
+                    current_production = production_offsets[current_symbol]
+                elif arity > 1:
+                    # The state before the symbol was expanded
+                    checkpoints.append(
+                        (tuple(unexpanded_symbols) + (current_symbol,), n_characters, cnt)
+                    )
+                    current_production = (
+                        production_offsets[current_symbol] + inputs[used_input] % arity
+                    )
+                    used_input += 1
+                else:
+                    raise KeyError(self.get_symbol(current_symbol)[0])
+
+                unexpanded_symbols.extend(productions[current_production])
+
+            cnt += 1
+
+        # Not fully expanded
+        if unexpanded_symbols:
+            return Individual.DEFAULT_PHENOTYPE, used_input, cnt, None
+
+        str_output: str = "".join(output)
+        return str_output, used_input, cnt, Derivation(str_output, checkpoints)
+
+    def derive_tree(
+        self, inputs: Sequence[int]
+    ) -> Tuple[str, int, int, Optional["DerivationTree"]]:
+        """Map inputs via rules to output sentence (phenotype), see `derive`,
+        and record the derivation tree.
+
+        :param inputs: Inputs used to generate sentence with grammar
+        :type inputs: list of int
+        :returns: Sentence, number of inputs used, number of derivation steps and tree
+        :rtype: tuple of str, int, int and DerivationTree
+        """
+        if not self.compiled:
+            self.compile_rules()
+
+        rule_arity = self.rule_arity
+        production_offsets = self.production_offsets
+        productions = self.productions
+        terminal_strings = self.terminal_strings
+        n_inputs = len(inputs)
+        used_input = 0
+        output: List[str] = []
+        cnt = 0
+        break_out = n_inputs * len(self.terminals)
+        tree = DerivationTree()
+        # Depth of each unexpanded symbol
+        unexpanded_symbols: List[int] = [self.start_symbol_id]
+        depths: List[int] = [1]
+        # Nodes with unexpanded children, and the stack size below their children
+        open_nodes: List[Tuple[int, int]] = []
+        while unexpanded_symbols and used_input < n_inputs and cnt < break_out:
+            current_symbol = unexpanded_symbols.pop()
+            depth = depths.pop()
+            if current_symbol < 0:
+                output.append(terminal_strings[~current_symbol])
+            else:
+                arity = rule_arity[current_symbol]
+                node = tree.add_node(
+                    current_symbol,
+                    used_input,
+                    cnt,
+                    depth,
+                    open_nodes[-1][0] if open_nodes else -1,
+                )
+                if arity == 1:
+                    current_production = production_offsets[current_symbol]
+                elif arity > 1:
+                    current_production = (
+                        production_offsets[current_symbol] + inputs[used_input] % arity
+                    )
+                    used_input += 1
+                else:
+                    raise KeyError(self.get_symbol(current_symbol)[0])
+
+                open_nodes.append((node, len(unexpanded_symbols)))
+                unexpanded_symbols.extend(productions[current_production])
+                depths.extend([depth + 1] * len(productions[current_production]))
+
+            cnt += 1
+            # Close the nodes whose children are all expanded
+            while open_nodes and len(unexpanded_symbols) == open_nodes[-1][1]:
+                tree.close_node(open_nodes.pop()[0], used_input, cnt)
+
+        # Not fully expanded
+        if unexpanded_symbols:
+            return Individual.DEFAULT_PHENOTYPE, used_input, cnt, None
+
+        return "".join(output), used_input, cnt, tree
+
+
+class Derivation(object):
+    """Checkpoints of the derivation of a genome, one per used input.
+
+    Checkpoint `i` is the state before input `i` is used: the unexpanded
+    symbols, with the symbol that uses the input on top, the length of the
+    output and the number of derivation steps. It only depends on the
+    inputs before `i`.
+
+    Attributes:
+        phenotype: Sentence of the derivation
+        checkpoints: Checkpoint for each used input
+    """
+
+    def __init__(self, phenotype: str, checkpoints: List[Tuple[Tuple[int, ...], int, int]]) -> None:
+        """
+        :param phenotype: Sentence of the derivation
+        :type phenotype: str
+        :param checkpoints: Checkpoint for each used input
+        :type checkpoints: list of tuple
+        """
+        self.phenotype = phenotype
+        self.checkpoints = checkpoints
+
+    def truncate(self, index: int) -> "Derivation":
+        """Return the checkpoints that are still valid when input `index`
+        changes, i.e. the checkpoints up to and including `index`.
+
+        :param index: Index of the first changed input
+        :type index: int
+        :returns: Valid checkpoints
+        :rtype: Derivation
+        """
+        if index + 1 >= len(self.checkpoints):
+            return self
+
+        return Derivation(self.phenotype, self.checkpoints[: index + 1])
+
+
+class DerivationTree(object):
+    """Derivation tree of a genome, see `Grammar.derive_tree`. The nodes are
+    the expanded non-terminals in derivation order, i.e. preorder.
+
+    The derivation is leftmost first, so the inputs used by the subtree of
+    a node are the contiguous inputs `starts[node]:ends[node]`. Replacing
+    them with the inputs of another subtree of the same non-terminal
+    replaces the subtree, the rest of the tree is unchanged. The tree is
+    stored as indices into the genome, so it converts back to codons by
+    slicing the genome.
+
+    Attributes:
+        symbols: Compiled non-terminal of each node
+        starts: Index of the first input used by the subtree of each node
+        ends: Index after the last input used by the subtree of each node
+        steps: Number of derivation steps of the subtree of each node
+        depths: Depth of each node, the root has depth 1
+        heights: Depth of the subtree of each node
+        parents: Parent of each node, -1 for the root
+    """
+
+    __slots__ = ("symbols", "starts", "ends", "steps", "depths", "heights", "parents")
+
+    def __init__(self) -> None:
+        self.symbols: List[int] = []
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.steps: List[int] = []
+        self.depths: List[int] = []
+        self.heights: List[int] = []
+        self.parents: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def add_node(self, symbol: int, start: int, cnt: int, depth: int, parent: int) -> int:
+        """Add a node for a non-terminal that is expanded.
+
+        :param symbol: Compiled non-terminal
+        :type symbol: int
+        :param start: Number of inputs used before the expansion
+        :type start: int
+        :param cnt: Number of derivation steps before the expansion
+        :type cnt: int
+        :param depth: Depth of the node
+        :type depth: int
+        :param parent: Parent node
+        :type parent: int
+        :returns: Node
+        :rtype: int
+        """
+        self.symbols.append(symbol)
+        self.starts.append(start)
+        self.ends.append(start)
+        # Steps before the expansion until the node is closed
+        self.steps.append(cnt)
+        self.depths.append(depth)
+        self.heights.append(1)
+        self.parents.append(parent)
+        return len(self.symbols) - 1
+
+    def close_node(self, node: int, end: int, cnt: int) -> None:
+        """Record the inputs and steps of a node when its subtree is derived.
+
+        :param node: Node
+        :type node: int
+        :param end: Number of inputs used after the subtree
+        :type end: int
+        :param cnt: Number of derivation steps after the subtree
+        :type cnt: int
+        """
+        self.ends[node] = end
+        self.steps[node] = cnt - self.steps[node]
+        parent = self.parents[node]
+        if parent >= 0:
+            self.heights[parent] = max(self.heights[parent], self.heights[node] + 1)
+
+
+class MappingCache(object):
+    """Phenotypes of mapped genomes, keyed on the codons used by the mapping.
+
+    Only the first `used_input` codons of a genome decide its phenotype, so a
+    genome that starts with a cached prefix has the cached phenotype. The
+    genome must also be longer than the prefix, since the mapping stops when
+    all inputs are used, and long enough for the derivation steps, since
+    the mapping breaks out after `len(inputs) * len(terminals)` steps.
+
+    The methods are guarded by a lock, so the cache can be shared by the
+    threads of the thread backend.
+
+    Attributes:
+        max_entries: Max number of entries, the least recently used are evicted
+        hits: Number of lookups that found a prefix
+        misses: Number of lookups that did not find a prefix
+    """
+
+    def __init__(self, max_entries: int = 100_000) -> None:
+        """
+        :param max_entries: Max number of entries
+        :type max_entries: int
+        """
+        assert max_entries > 0
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Trie of the cached prefixes, a node maps codons to nodes and None
+        # to the phenotype and number of derivation steps of its prefix
+        self._root: Dict[Optional[int], Any] = {}
+        # Cached prefixes in least recently used order
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Locks can not be pickled, e.g. when the grammar is sent to worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, genome: Sequence[int], n_terminals: int) -> Optional[Tuple[str, int]]:
+        """Return the phenotype and number of used inputs of genome, or None
+        if no prefix of the genome is cached. The genome is walked down the
+        trie once, so a lookup is linear in the length of the genome.
+
+        :param genome: Genome
+        :type genome: list of int
+        :param n_terminals: Number of terminals in the grammar
+        :type n_terminals: int
+        :returns: Phenotype and number of used inputs
+        :rtype: tuple of str and int
+        """
+        n_inputs = len(genome)
+        with self._lock:
+            node = self._root
+            for length, codon in enumerate(genome):
+                entry = node.get(None)
+                if entry is not None:
+                    # At most one prefix can match, since the mapping of the
+                    # genome uses exactly the codons of the matching prefix
+                    if entry[1] > n_inputs * n_terminals:
+                        break
+
+                    self._entries.move_to_end(tuple(genome[:length]))
+                    self.hits += 1
+                    return entry[0], length
+
+                node = node.get(codon)
+                if node is None:
+                    break
+
+            self.misses += 1
+            return None
+
+    def put(self, genome: Sequence[int], phenotype: str, used_input: int, steps: int) -> None:
+        """Cache the phenotype of a genome.
+
+        :param genome: Genome
+        :type genome: list of int
+        :param phenotype: Phenotype of genome
+        :type phenotype: str
+        :param used_input: Number of inputs used by the mapping
+        :type used_input: int
+        :param steps: Number of derivation steps
+        :type steps: int
+        """
+        prefix = tuple(genome[:used_input])
+        with self._lock:
+            node = self._root
+            for codon in prefix:
+                node = node.setdefault(codon, {})
+
+            node[None] = (phenotype, steps)
+            self._entries[prefix] = None
+            self._entries.move_to_end(prefix)
+            if len(self._entries) > self.max_entries:
+                self.remove(self._entries.popitem(last=False)[0])
+
+    def remove(self, prefix: Tuple[int, ...]) -> None:
+        """Remove a prefix from the trie, and the nodes that are left empty.
+
+        :param prefix: Cached prefix
+        :type prefix: tuple of int
+        """
+        with self._lock:
+            nodes = [self._root]
+            for codon in prefix:
+                nodes.append(nodes[-1][codon])
+
+            del nodes[-1][None]
+            for codon, node in zip(reversed(prefix), reversed(nodes[:-1])):
+                if node[codon]:
+                    break
+
+                del node[codon]
+
 
 class LarkGrammar(Grammar):
     """
-    Lark Context Free Grammar.
+    Context Free Grammar read from a Lark (EBNF) grammar file. Lark expands
+    the EBNF operators, e.g. `*`, `+`, `?` and `[]`, into plain rules, which
+    are converted into the rules of `Grammar`. Rule names are wrapped in `<>`
+    and string terminals become terminals. Regular expression terminals can
+    not be generated, so they are not allowed in the rules. Ignored
+    terminals, e.g. `%ignore WS`, are not generated either.
+
+    The converted rules are cached on disk, keyed by a hash of the grammar
+    file, so repeated runs do not parse the grammar again. Grammars that
+    `%import` other grammar files are not cached, since the key does not
+    cover the imported files. The grammars bundled with Lark, e.g.
+    `common`, are covered by the Lark version in the key.
     """
-    
-    def __init__(self, file_name: str):
-        """Initialize LarkGrammar with a lark grammar file."""
+
+    # Changes when the cached rules are no longer valid
+    CACHE_VERSION: int = 1
+    # Grammars bundled with Lark
+    LARK_GRAMMARS: Tuple[str, ...] = ("common", "lark", "python", "unicode")
+    IMPORT_PATTERN = re.compile(r"^\s*%import\s+(\.?\w+)", re.MULTILINE)
+    DEFAULT_CACHE_DIR: str = os.path.join(os.path.expanduser("~"), ".cache", "donkey_ge")
+
+    def __init__(
+        self, file_name: str, start: str = "start", cache_dir: Optional[str] = None
+    ) -> None:
+        """Context free grammar from a Lark grammar file.
+
+        :param file_name: grammar file
+        :type file_name: str
+        :param start: Name of the start rule
+        :type start: str
+        :param cache_dir: Directory of the cached rules, default `DEFAULT_CACHE_DIR`,
+                          empty turns the cache off
+        :type cache_dir: str
+        """
         super().__init__(file_name)
-        #self.lark_parser = None  
-        #self._initialize_lark_parser()
+        self.start: str = start
+        self.cache_dir: str = LarkGrammar.DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+
+    def read_lark_file(self, file_name: str) -> None:
+        """Read a grammar file in Lark format, or its cached rules.
+
+        :param file_name: Lark grammar file
+        :type file_name: str
+        """
+        assert file_name.endswith(".lark")
+
+        with open(file_name, "r") as in_file:
+            lines: str = in_file.read()
+
+        import_path = os.path.dirname(file_name)
+        key = json.dumps([lines, self.start, lark_version, LarkGrammar.CACHE_VERSION])
+        cache_file = ""
+        if self.cache_dir and not LarkGrammar.imports_files(lines, import_path):
+            cache_file = os.path.join(
+                self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".json"
+            )
+
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, "r") as in_file:
+                cached = json.load(in_file)
+
+            self.set_rules(
+                tuple(cached["start_rule"]),
+                [(lhs, productions) for lhs, productions in cached["rules"]],
+            )
+            return
+
+        self.parse_lark_string(lines, import_path)
+        if cache_file:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Written to a temporary file first, since other processes may read the cache
+            tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            with open(tmp_file, "w") as out_file:
+                json.dump(
+                    {"start_rule": self.start_rule, "rules": list(self.rules.items())}, out_file
+                )
+
+            os.replace(tmp_file, cache_file)
+
+    @staticmethod
+    def imports_files(all_lines: str, import_path: str = "") -> bool:
+        """Return True if the grammar imports grammar files that are not
+        bundled with Lark.
+
+        :param all_lines: Lark grammar
+        :type all_lines: str
+        :param import_path: Directory of the grammars imported with `%import`
+        :type import_path: str
+        :returns: True if the grammar imports grammar files
+        :rtype: bool
+        """
+        for module in LarkGrammar.IMPORT_PATTERN.findall(all_lines):
+            # Local grammars take precedence over the bundled grammars
+            if module not in LarkGrammar.LARK_GRAMMARS or os.path.exists(
+                os.path.join(import_path, module + ".lark")
+            ):
+                return True
+
+        return False
+
+    def parse_lark_string(self, all_lines: str, import_path: str = "") -> None:
+        """Parse a Lark grammar with Lark and convert its rules.
+
+        :param all_lines: Lark grammar
+        :type all_lines: str
+        :param import_path: Directory of the grammars imported with `%import`
+        :type import_path: str
+        """
+        assert all_lines != ""
+        parser = Lark(
+            all_lines, start=self.start, import_paths=[import_path] if import_path else []
+        )
+        terminal_definitions: Dict[str, TerminalDef] = {_.name: _ for _ in parser.terminals}
+        rules: List[Tuple[str, List[List[Tuple[str, str]]]]] = []
+        lhs_indices: Dict[str, int] = {}
+        for rule in parser.rules:
+            lhs = "<{}>".format(rule.origin.name)
+            production: List[Tuple[str, str]] = []
+            for symbol in rule.expansion:
+                if isinstance(symbol, Terminal):
+                    pattern = terminal_definitions[symbol.name].pattern
+                    if pattern.type != "str":
+                        raise ValueError(
+                            "Terminal {} of rule {} is a regular expression: {}".format(
+                                symbol.name, rule.origin.name, pattern.value
+                            )
+                        )
+                    production.append((pattern.value, Grammar.T))
+                else:
+                    production.append(("<{}>".format(symbol.name), Grammar.NT))
+
+            if lhs not in lhs_indices:
+                lhs_indices[lhs] = len(rules)
+                rules.append((lhs, []))
+            rules[lhs_indices[lhs]][1].append(production)
+
+        self.set_rules(("<{}>".format(self.start), Grammar.NT), rules)
+
+    def set_rules(
+        self, start_rule: Tuple[str, str], rules: Sequence[Tuple[str, List[List[Tuple[str, str]]]]]
+    ) -> None:
+        """Set the start rule and the rules, the symbols are read from the rules.
+
+        :param start_rule: Start symbol
+        :type start_rule: tuple of str and str
+        :param rules: Productions of each non-terminal, in rule order
+        :type rules: list of tuple
+        """
+        self.start_rule = (start_rule[0], start_rule[1])
+        self.rules = collections.OrderedDict()
+        self.non_terminals = set()
+        self.terminals = set()
+        for lhs, productions in rules:
+            self.non_terminals.add(lhs)
+            self.rules[lhs] = [[(value, _type) for value, _type in _] for _ in productions]
+            for production in self.rules[lhs]:
+                self.terminals.update(value for value, _type in production if _type == Grammar.T)
+
+        # Rules changed, the compiled tables and mapped genomes are stale
+        self.compiled = False
+        if self.mapping_cache is not None:
+            self.mapping_cache = MappingCache(self.mapping_cache.max_entries)
+
+
+def read_grammar(file_name: str, cache_dir: Optional[str] = None) -> Grammar:
+    """Return the grammar of a file, Lark grammars end with `.lark` and BNF
+    grammars with `.bnf`.
+
+    :param file_name: Grammar file
+    :type file_name: str
+    :param cache_dir: Directory of the cached Lark rules, see `LarkGrammar`
+    :type cache_dir: str
+    :returns: Grammar
+    :rtype: Grammar
+    """
+    grammar: Grammar
+    if file_name.endswith(".lark"):
+        lark_grammar = LarkGrammar(file_name, cache_dir=cache_dir)
+        lark_grammar.read_lark_file(file_name)
+        grammar = lark_grammar
+    else:
+        grammar = Grammar(file_name)
+        grammar.read_bnf_file(grammar.file_name)
+
+    return grammar
+
 
 class Individual(object):
     """A GE individual
@@ -215,33 +1321,96 @@ class Individual(object):
         max_length: Length of inputs
         DEFAULT_PHENOTYPE:
 
+    Copies share the genome until one of them writes to it. Read the
+    genome with `codons`, `genome` makes a private copy first if the
+    genome is shared.
     """
 
     codon_size: int = -1
     max_length: int = -1
     DEFAULT_PHENOTYPE = ""
 
-    def __init__(self, genome: Optional[List[int]]) -> None:
+    __slots__ = (
+        "_genome",
+        "_shared",
+        "fitness",
+        "phenotype",
+        "used_input",
+        "dirty",
+        "derivation",
+        "tree",
+        "remaps",
+    )
+
+    def __init__(self, genome: Optional[List[int]], rng: Any = random) -> None:
         """
 
         :param genome: Input representation
         :type genome: list of int or None
+        :param rng: Random number generator used for a random genome
+        :type rng: random.Random
         """
         assert Individual.max_length > 0, "max_length {}".format(Individual.max_length)
         assert Individual.codon_size > 0, "codon_size {}".format(Individual.codon_size)
 
+        self._shared: bool = False
         if genome is None:
-            self.genome: List[int] = [
-                random.randint(0, Individual.codon_size) for _ in range(Individual.max_length)
+            self._genome: List[int] = [
+                rng.randint(0, Individual.codon_size) for _ in range(Individual.max_length)
                 #0 for _ in range(Individual.max_length)
             ]
             #self.genome = [867, 821, 782, 64, 261, 120, 507, 779, 460, 483]
         else:
-            self.genome = genome
+            self._genome = genome
 
         self.fitness: float = DEFAULT_FITNESS
         self.phenotype: str = Individual.DEFAULT_PHENOTYPE
         self.used_input: int = 0
+        # True when phenotype, used_input and fitness are not from the genome
+        self.dirty: bool = True
+        # Checkpoints for incremental mapping, see `Grammar.derive_incremental`
+        self.derivation: Optional[Derivation] = None
+        # Derivation tree for subtree variation, see `Grammar.derive_tree`
+        self.tree: Optional[DerivationTree] = None
+        # Random genomes drawn by the last mapping, see `map_input_with_grammar`
+        self.remaps: int = 0
+
+    @property
+    def codons(self) -> List[int]:
+        """Genome for reading, it can be shared with copies of the individual."""
+        return self._genome
+
+    @property
+    def genome(self) -> List[int]:
+        """Genome for reading and writing, copied if it is shared."""
+        if self._shared:
+            self._genome = copy.copy(self._genome)
+            self._shared = False
+
+        return self._genome
+
+    @genome.setter
+    def genome(self, genome: List[int]) -> None:
+        self._genome = genome
+        self._shared = False
+
+    def copy(self) -> "Individual":
+        """Return a copy that shares the genome until either of them
+        changes it. Phenotype and fitness are kept.
+
+        :returns: Copy of the individual
+        :rtype: Individual
+        """
+        individual = Individual(self._genome)
+        self._shared = True
+        individual._shared = True
+        individual.fitness = self.fitness
+        individual.phenotype = self.phenotype
+        individual.used_input = self.used_input
+        individual.dirty = self.dirty
+        individual.derivation = self.derivation
+        individual.tree = self.tree
+        return individual
 
     def get_fitness(self) -> float:
         """
@@ -285,7 +1454,89 @@ class Population(object):
         return _str
 
 
-def map_input_with_grammar(individual: Individual, grammar: Grammar) -> Individual:
+class GenomeMatrix(object):
+    """Array-backed genomes of a population, used for batched variation.
+
+    Genomes have variable length, so row `i` of `genomes` holds the genome
+    of individual `i` in its first `lengths[i]` columns and zeros after.
+
+    Attributes:
+        genomes: Integer matrix of shape (population size, max length)
+        lengths: Genome length of each row
+        fitness: Fitness of each row
+        used_input: Number of inputs used when mapping each row
+    """
+
+    def __init__(self, genomes: np.ndarray, lengths: np.ndarray) -> None:
+        """
+        :param genomes: Integer matrix, one genome per row
+        :type genomes: np.ndarray
+        :param lengths: Genome length of each row
+        :type lengths: np.ndarray
+        """
+        assert genomes.ndim == 2 and genomes.shape[0] == lengths.shape[0]
+        self.genomes = genomes
+        self.lengths = lengths
+        self.fitness: np.ndarray = np.full(genomes.shape[0], DEFAULT_FITNESS)
+        self.used_input: np.ndarray = np.zeros(genomes.shape[0], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.genomes.shape[0]
+
+    @classmethod
+    def from_individuals(cls, individuals: Sequence[Individual]) -> "GenomeMatrix":
+        """Return the genomes, fitness and used inputs of individuals as arrays.
+
+        :param individuals: Individuals to copy
+        :type individuals: list of Individual
+        :returns: Array-backed genomes
+        :rtype: GenomeMatrix
+        """
+        lengths = np.array([len(_.codons) for _ in individuals], dtype=np.int64)
+        genomes = np.zeros((len(individuals), max(lengths)), dtype=np.int64)
+        for i, individual in enumerate(individuals):
+            genomes[i, : len(individual.codons)] = individual.codons
+
+        matrix = cls(genomes, lengths)
+        matrix.fitness[:] = [_.fitness for _ in individuals]
+        matrix.used_input[:] = [_.used_input for _ in individuals]
+        return matrix
+
+    @classmethod
+    def random(cls, size: int, rng: np.random.Generator) -> "GenomeMatrix":
+        """Return `size` random genomes of `Individual.max_length` codons.
+
+        :param size: Number of genomes
+        :type size: int
+        :param rng: Random number generator
+        :type rng: np.random.Generator
+        :returns: Array-backed genomes
+        :rtype: GenomeMatrix
+        """
+        assert Individual.max_length > 0, "max_length {}".format(Individual.max_length)
+        assert Individual.codon_size > 0, "codon_size {}".format(Individual.codon_size)
+        genomes = rng.integers(
+            0, Individual.codon_size, size=(size, Individual.max_length), endpoint=True
+        )
+        lengths = np.full(size, Individual.max_length, dtype=np.int64)
+        return cls(genomes, lengths)
+
+    def to_individuals(self) -> List[Individual]:
+        """Return one unevaluated Individual per row, with the row copied to a
+        list genome.
+
+        :returns: Individuals
+        :rtype: list of Individual
+        """
+        return [
+            Individual(self.genomes[i, :length].tolist())
+            for i, length in enumerate(self.lengths.tolist())
+        ]
+
+
+def map_input_with_grammar(
+    individual: Individual, grammar: Grammar, rng: Any = random
+) -> Individual:
     """ Generate a sentence from inputs and set the sentence and number of used
     inputs.
 
@@ -293,25 +1544,64 @@ def map_input_with_grammar(individual: Individual, grammar: Grammar) -> Individu
     :type individual: Individual
     :param grammar: Grammar used to generate output sentence from inputs
     :type grammar: Grammar
+    :param rng: Random number generator used for new genomes of invalid individuals
+    :type rng: random.Random
     :return: individual
     :rtype: Individual
 
     """
+    if grammar.sge_max_depth is not None:
+        # Structured genomes always map, see `Grammar.derive_sge`
+        genome = cast(List[List[int]], individual.codons)
+        phenotype, used_genes, _, _genome = grammar.derive_sge(genome, grammar.sge_max_depth, rng)
+        if _genome is not genome:
+            individual.genome = cast(List[int], _genome)
+        individual.phenotype = phenotype
+        individual.used_input = sum(used_genes)
+        individual.remaps = 0
+        return individual
+
     break_out = 100
     cnt = 0
     phenotype: str = Individual.DEFAULT_PHENOTYPE
     n_inputs_used: int = 0
+    mapping_cache = grammar.mapping_cache
     while phenotype is Individual.DEFAULT_PHENOTYPE and cnt < break_out:
-        phenotype, n_inputs_used = grammar.generate_sentence(individual.genome)
+        cached = None
+        # Resuming from checkpoints is cheaper than a cache lookup
+        if mapping_cache is not None and individual.derivation is None:
+            cached = mapping_cache.get(individual.codons, len(grammar.terminals))
+
+        if cached is not None:
+            phenotype, n_inputs_used = cached
+            # The tree is derived again when it is needed, see `get_derivation_tree`
+            individual.tree = None
+        else:
+            if grammar.trees:
+                phenotype, n_inputs_used, steps, individual.tree = grammar.derive_tree(
+                    individual.codons
+                )
+            elif grammar.incremental:
+                phenotype, n_inputs_used, steps, individual.derivation = grammar.derive_incremental(
+                    individual.codons, individual.derivation
+                )
+            else:
+                phenotype, n_inputs_used, steps = grammar.derive(individual.codons)
+
+            if mapping_cache is not None and phenotype is not Individual.DEFAULT_PHENOTYPE:
+                mapping_cache.put(individual.codons, phenotype, n_inputs_used, steps)
+
         if phenotype is Individual.DEFAULT_PHENOTYPE:
-            _individual = Individual(None)
-            individual.genome = _individual.genome
+            _individual = Individual(None, rng)
+            individual.genome = _individual.codons
+            individual.derivation = None
+            individual.tree = None
             cnt += 1
 
     # None phenotype causes stochastic behavior. Can happen since we
     # use a break out counter to avoid infinite loop
-    # TODO count number of remappings
     individual.phenotype = phenotype
+    individual.remaps = cnt
 
     # TODO better solution, this handles testing when insensible
     # grammars are passed through. Thus the grammar correctness need
@@ -371,11 +1661,86 @@ def initialise_population(size: int) -> List[Individual]:
     return individuals
 
 
+def initialise_population_sensible(
+    size: int, grammar: Grammar, max_depth: int, rng: Any = random
+) -> List[Individual]:
+    """Create a population of Individuals of the given size with sensible
+    initialisation, i.e. ramped half-and-half. The depths are ramped from the
+    minimum depth of the grammar to `max_depth`, and half of the derivation
+    trees of each depth are grown and half are full, see
+    `Grammar.generate_inputs`. The genomes map without remapping, and are
+    filled with random codons up to `Individual.max_length`.
+
+    :param size: Number of individuals to generate
+    :type size: int
+    :param grammar: Grammar to derive with
+    :type grammar: Grammar
+    :param max_depth: Maximum derivation tree depth
+    :type max_depth: int
+    :param rng: Random number generator
+    :type rng: random.Random
+    :return: Individuals with valid genomes
+    :rtype: list of Individual
+    """
+    assert size > 0
+    if not grammar.compiled:
+        grammar.compile_rules()
+
+    min_depth = grammar.min_depths[grammar.start_symbol_id]
+    assert min_depth < math.inf, "Grammar start symbol is not productive"
+    depths = list(range(int(min_depth), max(int(min_depth), max_depth) + 1))
+    individuals = []
+    for i in range(size):
+        inputs, steps = grammar.generate_inputs(depths[(i // 2) % len(depths)], i % 2 == 1, rng)
+        length = max(Individual.max_length, grammar.get_genome_length(len(inputs), steps))
+        tail = [rng.randint(0, Individual.codon_size) for _ in range(length - len(inputs))]
+        individuals.append(Individual(inputs + tail))
+
+    return individuals
+
+
+def initialise_population_sge(
+    size: int, grammar: Grammar, max_depth: int, rng: Any = random
+) -> List[Individual]:
+    """Create a population of Individuals of the given size with structured
+    genomes (SGE), see `Grammar.derive_sge`. The genes are drawn by deriving
+    random trees from empty genomes, with the depths ramped from the minimum
+    depth of the grammar to `max_depth`.
+
+    :param size: Number of individuals to generate
+    :type size: int
+    :param grammar: Grammar to derive with
+    :type grammar: Grammar
+    :param max_depth: Maximum derivation tree depth
+    :type max_depth: int
+    :param rng: Random number generator
+    :type rng: random.Random
+    :return: Individuals with structured genomes
+    :rtype: list of Individual
+    """
+    assert size > 0
+    if not grammar.compiled:
+        grammar.compile_rules()
+
+    min_depth = grammar.min_depths[grammar.start_symbol_id]
+    assert min_depth < math.inf, "Grammar start symbol is not productive"
+    depths = list(range(int(min_depth), max(int(min_depth), max_depth) + 1))
+    individuals = []
+    for i in range(size):
+        genome = grammar.derive_sge(
+            [[] for _ in grammar.rule_arity], depths[i % len(depths)], rng
+        )[3]
+        individuals.append(Individual(cast(List[int], genome)))
+
+    return individuals
+
+
 def evaluate_fitness(
     individuals: List[Individual],
     grammar: Grammar,
     fitness_function: FitnessFunction,
     param: Dict[str, Any],
+    evaluator: Optional["ParallelEvaluator"] = None,
 ) -> List[Individual]:
     """Perform the fitness evaluation for each individual of the population.
 
@@ -387,67 +1752,709 @@ def evaluate_fitness(
     :type fitness_function: function
     :param param: Other parameters
     :type param: dict
+    :param evaluator: Worker pool for the evaluation, if None evaluate in this process
+    :type evaluator: ParallelEvaluator
     :return: Evaluated individuals
     :rtype: list of Individuals
 
     """
-    cache = param["cache"]
-    n_individuals = len(individuals)
-    # Iterate over all the individual solutions
-    for ind in individuals:
-        map_input_with_grammar(ind, grammar) # Calculate both ind.phenotype and ind.used_input 
-        # Execute the fitness function
-        evaluate(ind, fitness_function, cache) # Calculate the fitness of ind.phenotype (i.e. ind.fitness)
+    cache = param["cache"]
+    n_individuals = len(individuals)
+    if evaluator is not None:
+        return evaluator.evaluate(individuals, cache)
+
+    # Iterate over all the individual solutions
+    for ind in individuals:
+        # Unchanged individuals keep their phenotype and fitness
+        if not ind.dirty:
+            continue
+
+        map_input_with_grammar(ind, grammar) # Calculate both ind.phenotype and ind.used_input 
+        # Execute the fitness function
+        evaluate(ind, fitness_function, cache) # Calculate the fitness of ind.phenotype (i.e. ind.fitness)
+        ind.dirty = False
+
+    assert n_individuals == len(individuals), "{} != {}".format(n_individuals, len(individuals))
+
+    return individuals
+
+
+# Worker process state, set once per worker by `_initialise_worker`
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _initialise_worker(
+    grammar: Grammar,
+    fitness_function_param: Dict[str, Any],
+    cache_settings: Dict[str, Any],
+    max_length: int,
+    codon_size: int,
+) -> None:
+    """Set up the grammar, fitness function and cache of a worker process.
+
+    :param grammar: Grammar used for mapping
+    :type grammar: Grammar
+    :param fitness_function_param: Fitness function parameters
+    :type fitness_function_param: dict
+    :param cache_settings: Fitness cache settings
+    :type cache_settings: dict
+    :param max_length: Individual max length
+    :type max_length: int
+    :param codon_size: Individual codon size
+    :type codon_size: int
+    """
+    Individual.max_length = max_length
+    Individual.codon_size = codon_size
+    _WORKER_STATE["grammar"] = grammar
+    _WORKER_STATE["fitness_function"] = get_fitness_function(fitness_function_param)
+    # Workers read the persistent store, their new entries are written by the main process
+    _WORKER_STATE["cache"] = get_fitness_cache(
+        cache_settings,
+        track_new_entries=True,
+        namespace=get_cache_namespace(grammar, fitness_function_param),
+        read_only=True,
+    )
+
+
+def _map_and_evaluate(
+    tasks: List[Tuple[Sequence[int], int]],
+    grammar: Grammar,
+    fitness_function: FitnessFunction,
+    cache: Dict[str, float],
+) -> List[Tuple[Optional[Sequence[int]], str, int, float, int]]:
+    """Map and evaluate genomes. Each genome has its own seed for the
+    random genomes of invalid individuals, so the results do not depend on
+    which worker evaluates the genome.
+
+    :param tasks: Genomes and seeds
+    :type tasks: list of tuple
+    :param grammar: Grammar used for mapping
+    :type grammar: Grammar
+    :param fitness_function: Fitness function
+    :type fitness_function: FitnessFunction
+    :param cache: Cache for evaluation speed-up
+    :type cache: dict
+    :return: New genome (None if unchanged), phenotype, used input, fitness and remaps
+    :rtype: list of tuple
+    """
+    results: List[Tuple[Optional[Sequence[int]], str, int, float, int]] = []
+    for genome, seed in tasks:
+        individual = Individual(genome)
+        map_input_with_grammar(individual, grammar, random.Random(seed))
+        evaluate(individual, fitness_function, cache)
+        new_genome = individual.codons if individual.codons is not genome else None
+        results.append(
+            (
+                new_genome,
+                individual.phenotype,
+                individual.used_input,
+                individual.fitness,
+                individual.remaps,
+            )
+        )
+
+    return results
+
+
+def _evaluate_in_worker(
+    tasks: List[Tuple[Sequence[int], int]]
+) -> Tuple[
+    List[Tuple[Optional[Sequence[int]], str, int, float, int]], List[Tuple[str, float]], int, int
+]:
+    """Map and evaluate genomes in a worker process.
+
+    :param tasks: Genomes and seeds
+    :type tasks: list of tuple
+    :return: Results, see `_map_and_evaluate`, the new cache entries of the
+             worker and the number of cache hits and misses
+    :rtype: tuple
+    """
+    cache: FitnessCache = _WORKER_STATE["cache"]
+    hits, misses = cache.hits, cache.misses
+    results = _map_and_evaluate(
+        tasks, _WORKER_STATE["grammar"], _WORKER_STATE["fitness_function"], cache
+    )
+    return results, cache.pop_new_entries(), cache.hits - hits, cache.misses - misses
+
+
+class ParallelEvaluator(object):
+    """Map and evaluate individuals on a pool of workers. The grammar and
+    fitness function are set up once per worker. Results are returned in
+    order and do not depend on the number of workers.
+
+    Attributes:
+        BACKENDS: Supported worker pools
+    """
+
+    BACKENDS: Tuple[str, ...] = ("process", "thread", "serial")
+
+    def __init__(
+        self,
+        settings: Dict[str, Any],
+        grammar: Grammar,
+        fitness_function: FitnessFunction,
+        fitness_function_param: Dict[str, Any],
+        cache_settings: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        :param settings: `parallel` settings, `workers`, `chunk_size` and `backend`
+        :type settings: dict
+        :param grammar: Grammar used for mapping
+        :type grammar: Grammar
+        :param fitness_function: Fitness function
+        :type fitness_function: FitnessFunction
+        :param fitness_function_param: Fitness function parameters, used by worker processes
+        :type fitness_function_param: dict
+        :param cache_settings: Fitness cache settings, used by worker processes
+        :type cache_settings: dict
+        """
+        self.backend: str = settings.get("backend", "process")
+        self.workers: int = settings.get("workers", os.cpu_count() or 1)
+        # Chunk size 0 splits the tasks in a few chunks per worker
+        self.chunk_size: int = settings.get("chunk_size", 0)
+        assert self.backend in ParallelEvaluator.BACKENDS, self.backend
+        assert self.workers > 0, self.workers
+        assert self.chunk_size >= 0, self.chunk_size
+
+        self.grammar = grammar
+        self.fitness_function = fitness_function
+        self.executor: Optional[concurrent.futures.Executor] = None
+        if self.backend == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_initialise_worker,
+                initargs=(
+                    grammar,
+                    fitness_function_param,
+                    cache_settings or {},
+                    Individual.max_length,
+                    Individual.codon_size,
+                ),
+            )
+        elif self.backend == "thread":
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def get_chunks(self, tasks: List[Any]) -> List[List[Any]]:
+        """Split tasks into chunks for the workers.
+
+        :param tasks: Tasks
+        :type tasks: list
+        :return: Chunks of tasks
+        :rtype: list of list
+        """
+        chunk_size = self.chunk_size
+        if chunk_size == 0:
+            chunk_size = max(1, math.ceil(len(tasks) / (4 * self.workers)))
+
+        return [tasks[i : i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+    def evaluate(self, individuals: List[Individual], cache: Dict[str, float]) -> List[Individual]:
+        """Map and evaluate individuals, and set their phenotype, used input and fitness.
+
+        :param individuals: Individuals to evaluate
+        :type individuals: list of Individual
+        :param cache: Cache for evaluation speed-up. New entries from worker
+                      processes are added to it
+        :type cache: dict
+        :return: Evaluated individuals
+        :rtype: list of Individuals
+        """
+        # Unchanged individuals keep their phenotype and fitness
+        dirty_individuals = [ind for ind in individuals if ind.dirty]
+        chunks = self.get_chunks(self.get_tasks(dirty_individuals))
+        results: List[Tuple[Optional[Sequence[int]], str, int, float, int]] = []
+        if self.backend == "process":
+            assert self.executor is not None
+            for result in self.executor.map(_evaluate_in_worker, chunks):
+                results.extend(self.merge_result(result, cache))
+        else:
+            evaluate_chunk = functools.partial(
+                _map_and_evaluate,
+                grammar=self.grammar,
+                fitness_function=self.fitness_function,
+                cache=cache,
+            )
+            _map = self.executor.map if self.executor is not None else map
+            for _results in _map(evaluate_chunk, chunks):
+                results.extend(_results)
+
+        self.set_results(dirty_individuals, results)
+        return individuals
+
+    def submit(
+        self, individuals: List[Individual], cache: Dict[str, float]
+    ) -> concurrent.futures.Future:
+        """Start mapping and evaluating individuals, without waiting for the
+        results. The serial backend evaluates them before returning.
+
+        :param individuals: Individuals to evaluate
+        :type individuals: list of Individual
+        :param cache: Cache for evaluation speed-up, used by the serial and thread backends
+        :type cache: dict
+        :return: Result, pass it to `set_results` with `merge_result`
+        :rtype: Future
+        """
+        tasks = self.get_tasks(individuals)
+        if self.backend == "process":
+            assert self.executor is not None
+            return self.executor.submit(_evaluate_in_worker, tasks)
+
+        if self.executor is not None:
+            return self.executor.submit(
+                _map_and_evaluate, tasks, self.grammar, self.fitness_function, cache
+            )
+
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.set_result(_map_and_evaluate(tasks, self.grammar, self.fitness_function, cache))
+        return future
+
+    @staticmethod
+    def get_tasks(individuals: List[Individual]) -> List[Tuple[Sequence[int], int]]:
+        """Return genomes and seeds to evaluate. Seeds are drawn in order, so
+        the run is reproducible from the seed.
+
+        :param individuals: Individuals to evaluate
+        :type individuals: list of Individual
+        :return: Genomes and seeds
+        :rtype: list of tuple
+        """
+        return [(ind.codons, random.getrandbits(32)) for ind in individuals]
+
+    def merge_result(
+        self, result: Any, cache: Dict[str, float]
+    ) -> List[Tuple[Optional[Sequence[int]], str, int, float, int]]:
+        """Return the results of evaluated tasks. New cache entries and
+        cache counts from a worker process are added to the cache.
+
+        :param result: Result of `_evaluate_in_worker` or `_map_and_evaluate`
+        :type result: tuple or list
+        :param cache: Cache for evaluation speed-up
+        :type cache: dict
+        :return: Results, see `_map_and_evaluate`
+        :rtype: list of tuple
+        """
+        if self.backend != "process":
+            return result
+
+        results, new_entries, hits, misses = result
+        cache.update(new_entries)
+        if isinstance(cache, FitnessCache):
+            cache.add_counts(hits, misses)
+
+        return results
+
+    @staticmethod
+    def set_results(
+        individuals: List[Individual],
+        results: List[Tuple[Optional[Sequence[int]], str, int, float, int]],
+    ) -> None:
+        """Set the genome, phenotype, used input, fitness and remaps of evaluated individuals.
+
+        :param individuals: Evaluated individuals
+        :type individuals: list of Individual
+        :param results: Results, see `_map_and_evaluate`
+        :type results: list of tuple
+        """
+        assert len(results) == len(individuals)
+        for individual, (genome, phenotype, used_input, fitness, remaps) in zip(
+            individuals, results
+        ):
+            if genome is not None:
+                individual.genome = genome
+                individual.derivation = None
+            # Workers do not return trees, they are derived again when needed
+            individual.tree = None
+            individual.phenotype = phenotype
+            individual.used_input = used_input
+            individual.fitness = fitness
+            individual.remaps = remaps
+            individual.dirty = False
+
+    def shutdown(self) -> None:
+        """Stop the workers."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def get_evaluator(param: Dict[str, Any], population: Population) -> Optional[ParallelEvaluator]:
+    """Return a worker pool for the `parallel` settings, or None when the
+    evaluation is done in this process.
+
+    :param param: Parameters
+    :type param: dict
+    :param population: Population to evaluate
+    :type population: Population
+    :return: Worker pool
+    :rtype: ParallelEvaluator
+    """
+    if not param.get("parallel"):
+        return None
+
+    return ParallelEvaluator(
+        param["parallel"],
+        population.grammar,
+        population.fitness_function,
+        param["fitness_function"],
+        param.get("fitness_cache", {}),
+    )
+
+
+def variation(
+    parents: List[Individual], param: Dict[str, Any], grammar: Optional[Grammar] = None
+) -> List[Individual]:
+    """
+    Vary individual solutions with crossover and mutation operations. Drive the
+    search by generating variation of the parent solutions.
+
+    With `variation: subtree` the derivation trees of the parents are varied
+    with `subtree_crossover` and `subtree_mutation`, instead of the codons.
+    With `representation: sge` the structured genomes of the parents are
+    varied with `sge_crossover` and `sge_mutation`.
+
+    :param parents: Collection of individual solutions
+    :type parents: list of Individuals
+    :param param: Parameters
+    :type param: dict
+    :param grammar: Grammar of the parents, needed by subtree variation
+    :type grammar: Grammar
+    :return: Collection of individual solutions
+    :rtype: list of Individuals
+    """
+
+    assert len(parents) > 1, "{} < 1".format(len(parents))
+    if param.get("representation", "ge") == "sge":
+        assert grammar is not None, "Structured genomes need the grammar"
+        return variation_sge(parents, param, grammar)
+    if param.get("variation", "onepoint") == "subtree":
+        assert grammar is not None, "Subtree variation needs the grammar"
+        return variation_subtree(parents, param, grammar)
+
+    ###################
+    # Crossover
+    ###################
+    new_individuals: List[Individual] = []
+    while len(new_individuals) < param["population_size"] and len(parents) > 1:
+        # Select parents
+        _parents = random.sample(parents, 2)
+        # Generate children by crossing over the parents
+        children = onepoint_crossover(_parents[0], _parents[1], param["crossover_probability"])
+        # Append the children to the new populations
+        for child in children:
+            new_individuals.append(child)
+
+    # Select populations size individuals. Handles uneven populations
+    # sizes, since crossover returns 2 offspring
+    assert len(new_individuals) >= param["population_size"]
+    new_individuals = new_individuals[: param["population_size"]]
+
+    ###################
+    # Mutation
+    ###################
+    for i, _ in enumerate(new_individuals):
+        new_individuals[i] = int_flip_mutation(new_individuals[i], param["mutation_probability"])
+
+    assert param["population_size"] == len(new_individuals)
+
+    return new_individuals
+
+
+def variation_subtree(
+    parents: List[Individual], param: Dict[str, Any], grammar: Grammar
+) -> List[Individual]:
+    """Vary individual solutions with subtree crossover and subtree mutation,
+    see `variation`. The depth limit is `max_depth` (default 10).
+
+    :param parents: Collection of mapped individual solutions
+    :type parents: list of Individuals
+    :param param: Parameters
+    :type param: dict
+    :param grammar: Grammar of the parents
+    :type grammar: Grammar
+    :return: Collection of individual solutions
+    :rtype: list of Individuals
+    """
+    max_depth: int = param.get("max_depth", 10)
+    new_individuals: List[Individual] = []
+    while len(new_individuals) < param["population_size"]:
+        _parents = random.sample(parents, 2)
+        new_individuals.extend(
+            subtree_crossover(
+                _parents[0], _parents[1], param["crossover_probability"], grammar, max_depth
+            )
+        )
+
+    # Handles uneven populations sizes, since crossover returns 2 offspring
+    new_individuals = new_individuals[: param["population_size"]]
+    for i, _ in enumerate(new_individuals):
+        new_individuals[i] = subtree_mutation(
+            new_individuals[i], param["mutation_probability"], grammar, max_depth
+        )
+
+    return new_individuals
+
+
+def variation_sge(
+    parents: List[Individual], param: Dict[str, Any], grammar: Grammar
+) -> List[Individual]:
+    """Vary individual solutions with structured genomes, see `variation`.
+
+    :param parents: Collection of individual solutions
+    :type parents: list of Individuals
+    :param param: Parameters
+    :type param: dict
+    :param grammar: Grammar of the parents
+    :type grammar: Grammar
+    :return: Collection of individual solutions
+    :rtype: list of Individuals
+    """
+    new_individuals: List[Individual] = []
+    while len(new_individuals) < param["population_size"]:
+        _parents = random.sample(parents, 2)
+        new_individuals.extend(
+            sge_crossover(_parents[0], _parents[1], param["crossover_probability"])
+        )
+
+    # Handles uneven populations sizes, since crossover returns 2 offspring
+    new_individuals = new_individuals[: param["population_size"]]
+    for i, _ in enumerate(new_individuals):
+        new_individuals[i] = sge_mutation(
+            new_individuals[i], param["mutation_probability"], grammar
+        )
+
+    return new_individuals
+
+
+def get_numpy_rng() -> np.random.Generator:
+    """Return a NumPy random number generator seeded from `random`, so runs
+    are reproducible from the `seed` parameter.
+
+    :returns: Random number generator
+    :rtype: np.random.Generator
+    """
+    return np.random.default_rng(random.getrandbits(64))
+
+
+def initialise_population_vectorized(size: int, rng: np.random.Generator) -> List[Individual]:
+    """Create a population of Individuals of the given size. The genomes are
+    drawn as one matrix.
+
+    :param size: Number of individuals to generate
+    :type size: int
+    :param rng: Random number generator
+    :type rng: np.random.Generator
+    :return: Randomly generated individuals
+    :rtype: list of Individual
+    """
+    assert size > 0
+
+    return GenomeMatrix.random(size, rng).to_individuals()
+
+
+def batch_onepoint_crossover(
+    parents: GenomeMatrix,
+    parent_indices: np.ndarray,
+    crossover_probability: float,
+    rng: np.random.Generator,
+) -> GenomeMatrix:
+    """One-point crossover of all parent pairs at once, see `onepoint_crossover`.
+
+    :param parents: Parent genomes
+    :type parents: GenomeMatrix
+    :param parent_indices: Row indices of the parent pairs, shape (n pairs, 2)
+    :type parent_indices: np.ndarray
+    :param crossover_probability: Probability of crossover
+    :type crossover_probability: float
+    :param rng: Random number generator
+    :type rng: np.random.Generator
+    :return: Two children per pair, the children of pair `i` are rows `2i` and `2i+1`
+    :rtype: GenomeMatrix
+    """
+    # Children of the same pair are interleaved, the second child
+    # swaps the roles of the parents
+    first = parent_indices.reshape(-1)
+    second = parent_indices[:, ::-1].reshape(-1)
+    used_input = parents.used_input
+    assert np.all(used_input[first] > 0)
+    # Only within used codons
+    points = rng.integers(1, used_input[first], endpoint=True)
+    other_points = points.reshape(-1, 2)[:, ::-1].reshape(-1)
+    crossed = np.repeat(rng.random(parent_indices.shape[0]) < crossover_probability, 2)
+
+    # Head of the first parent followed by the tail of the second parent
+    lengths = np.where(
+        crossed, points + parents.lengths[second] - other_points, parents.lengths[first]
+    )
+    columns = np.arange(max(lengths))[np.newaxis, :]
+    from_head = ~crossed[:, np.newaxis] | (columns < points[:, np.newaxis])
+    rows = np.where(from_head, first[:, np.newaxis], second[:, np.newaxis])
+    source_columns = np.where(
+        from_head, columns, other_points[:, np.newaxis] + columns - points[:, np.newaxis]
+    )
+    in_genome = columns < lengths[:, np.newaxis]
+    source_columns = np.where(in_genome, source_columns, 0)
+    np.clip(source_columns, 0, parents.genomes.shape[1] - 1, out=source_columns)
+    genomes = np.where(in_genome, parents.genomes[rows, source_columns], 0)
+
+    return GenomeMatrix(genomes, lengths)
+
+
+def batch_int_flip_mutation(
+    matrix: GenomeMatrix, mutation_probability: float, rng: np.random.Generator
+) -> GenomeMatrix:
+    """Mutate all genomes in place with one random mask, see `int_flip_mutation`.
+
+    :param matrix: Genomes to mutate
+    :type matrix: GenomeMatrix
+    :param mutation_probability: Probability of changing value
+    :type mutation_probability: float
+    :param rng: Random number generator
+    :type rng: np.random.Generator
+    :return: Mutated genomes
+    :rtype: GenomeMatrix
+    """
+    assert Individual.codon_size > 0
+    assert 0 <= mutation_probability <= 1.0
 
-    assert n_individuals == len(individuals), "{} != {}".format(n_individuals, len(individuals))
+    columns = np.arange(matrix.genomes.shape[1])[np.newaxis, :]
+    mask = rng.random(matrix.genomes.shape) < mutation_probability
+    mask &= columns < matrix.lengths[:, np.newaxis]
+    matrix.genomes[mask] = rng.integers(
+        0, Individual.codon_size, size=np.count_nonzero(mask), endpoint=True
+    )
+    mutated = mask.any(axis=1)
+    matrix.fitness[mutated] = DEFAULT_FITNESS
+    matrix.used_input[mutated] = 0
 
-    return individuals
+    return matrix
 
 
-def variation(parents: List[Individual], param: Dict[str, Any]) -> List[Individual]:
-    """
-    Vary individual solutions with crossover and mutation operations. Drive the
-    search by generating variation of the parent solutions.
+def variation_vectorized(
+    parents: List[Individual], param: Dict[str, Any], rng: np.random.Generator
+) -> List[Individual]:
+    """Vary individual solutions with crossover and mutation operations, see
+    `variation`. The operators are applied to the whole generation at once
+    on a `GenomeMatrix`.
 
     :param parents: Collection of individual solutions
     :type parents: list of Individuals
     :param param: Parameters
     :type param: dict
+    :param rng: Random number generator
+    :type rng: np.random.Generator
     :return: Collection of individual solutions
     :rtype: list of Individuals
     """
-
     assert len(parents) > 1, "{} < 1".format(len(parents))
 
-    ###################
-    # Crossover
-    ###################
-    new_individuals: List[Individual] = []
-    while len(new_individuals) < param["population_size"] and len(parents) > 1:
-        # Select parents
-        _parents = random.sample(parents, 2)
-        # Generate children by crossing over the parents
-        children = onepoint_crossover(_parents[0], _parents[1], param["crossover_probability"])
-        # Append the children to the new populations
-        for child in children:
-            new_individuals.append(child)
-
-    # Select populations size individuals. Handles uneven populations
-    # sizes, since crossover returns 2 offspring
-    assert len(new_individuals) >= param["population_size"]
-    new_individuals = new_individuals[: param["population_size"]]
-
-    ###################
-    # Mutation
-    ###################
-    for i, _ in enumerate(new_individuals):
-        new_individuals[i] = int_flip_mutation(new_individuals[i], param["mutation_probability"])
+    matrix = GenomeMatrix.from_individuals(parents)
+    # Select two different parents for each pair
+    n_pairs = (param["population_size"] + 1) // 2
+    first = rng.integers(0, len(parents), size=n_pairs)
+    second = (first + rng.integers(1, len(parents), size=n_pairs)) % len(parents)
+    children = batch_onepoint_crossover(
+        matrix, np.stack((first, second), axis=1), param["crossover_probability"], rng
+    )
+    children = batch_int_flip_mutation(children, param["mutation_probability"], rng)
+    # Handles uneven populations sizes, since crossover returns 2 offspring
+    new_individuals = children.to_individuals()[: param["population_size"]]
 
     assert param["population_size"] == len(new_individuals)
 
     return new_individuals
 
 
+def setup_search(population: Population, param: Dict[str, Any]) -> Optional[ParallelEvaluator]:
+    """Set up the fitness cache, `param["cache"]`, and the mapping of the
+    population grammar from the parameters.
+
+    :param population: Population to search with
+    :type population: Population
+    :param param: Parameters for search
+    :type param: dict
+    :return: Worker pool, see `get_evaluator`
+    :rtype: ParallelEvaluator
+    """
+    param["cache"] = get_fitness_cache(
+        param.get("fitness_cache", {}),
+        namespace=get_cache_namespace(population.grammar, param["fitness_function"]),
+    )
+    # Cache of mapped genomes, 0 entries turns it off
+    if param.get("mapping_cache_size", 100_000) > 0:
+        population.grammar.mapping_cache = MappingCache(param.get("mapping_cache_size", 100_000))
+    # Resume mapping of varied genomes from derivation checkpoints
+    population.grammar.incremental = param.get("incremental_mapping", False)
+    # Record the derivation trees of the individuals for subtree variation
+    population.grammar.trees = param.get("variation", "onepoint") == "subtree"
+    # Map structured genomes
+    if param.get("representation", "ge") == "sge":
+        population.grammar.sge_max_depth = param.get("max_depth", 10)
+    return get_evaluator(param, population)
+
+
+def evolve_generation(
+    population: Population,
+    param: Dict[str, Any],
+    rng: Optional[np.random.Generator] = None,
+    evaluator: Optional[ParallelEvaluator] = None,
+) -> None:
+    """Replace the individuals of an evaluated population with the next
+    generation, sorted by fitness.
+
+    :param population: Evaluated population
+    :type population: Population
+    :param param: Parameters for search
+    :type param: dict
+    :param rng: Random number generator for vectorized variation and batched selection
+    :type rng: numpy.random.Generator
+    :param evaluator: Worker pool, see `get_evaluator`
+    :type evaluator: ParallelEvaluator
+    """
+    ##################
+    # Selection
+    ##################
+
+    # tournament_selection basicamente es un remuestreo de "population.individuals" con un sesgo hacia los mejores individuos de la generación para que sean los padres de la nueva generación
+    selection = param.get("selection", "tournament")
+    if selection == "batch_tournament":
+        assert rng is not None
+        parents = batch_tournament_selection(
+            population.individuals, param["population_size"], param["tournament_size"], rng
+        )
+    else:
+        parents = SELECTION_OPERATORS[selection](
+            population.individuals, param["population_size"], param["tournament_size"]
+        )
+
+    ##################
+    # Variation. Generate new individual solutions
+    ##################
+    # Donde se generan la nueva generación a través de crossover y mutación
+    if param.get("vectorized", False):
+        assert rng is not None
+        new_individuals = variation_vectorized(parents, param, rng)
+    else:
+        new_individuals = variation(parents, param, population.grammar)
+
+    ##################
+    # Evaluate fitness
+    ##################
+    new_individuals = evaluate_fitness(
+        new_individuals, population.grammar, population.fitness_function, param, evaluator
+    )
+
+    ##################
+    # Replacement. Replace individual solutions in the population
+    ##################
+    # The replacement operators return the population sorted by fitness
+    population.individuals = REPLACEMENT_OPERATORS[param.get("replacement", "generational")](
+        new_individuals,
+        population.individuals,
+        population_size=param["population_size"],
+        elite_size=param["elite_size"],
+    )
+
+
 def search_loop(population: Population, param: Dict[str, Any]) -> Individual:
     """Return the best individual from the evolutionary search loop. Assumes
     the population is initially not evaluated.
@@ -463,88 +2470,90 @@ def search_loop(population: Population, param: Dict[str, Any]) -> Individual:
 
     # Defines param["cache"] and initialize the variable stats
     start_time = time.time()
-    param["cache"] = collections.OrderedDict() # Intialize and empty OrderedDict()
+    evaluator = setup_search(population, param)
     stats: DefaultDict[str, List[Number]] = collections.defaultdict(list) # Intialize and empty defaultdict with a  "list factory function"
-
-    ######################
-    # Evaluate fitness for the first generation (generation 0)
-    ######################
-    population.individuals = evaluate_fitness(
-        population.individuals, population.grammar, population.fitness_function, param
-    )
-    # Set best solution
-    population.individuals = sort_population(population.individuals)
-    best_ever = population.individuals[0] # The best individual in the original (first) generation 
-
-    # Print the stats of the populations
-    print_stats(0, population.individuals, stats, start_time)
-
-    ######################
-    # Generation loop: Evaluate fitness for the following (child generations)
-    ######################
-    generation = 1
-    while generation < param["generations"]:
-        start_time = time.time()
-
-        ##################
-        # Selection
-        ##################
-        
-        # tournament_selection basicamente es un remuestreo de "population.individuals" con un sesgo hacia los mejores individuos de la generación para que sean los padres de la nueva generación
-        parents = tournament_selection(
-            population.individuals, param["population_size"], param["tournament_size"]
-        )
-
-        ##################
-        # Variation. Generate new individual solutions
-        ##################
-        # Donde se generan la nueva generación a través de crossover y mutación
-        new_individuals = variation(parents, param)
-
-        ##################
-        # Evaluate fitness
-        ##################
-        new_individuals = evaluate_fitness(
-            new_individuals, population.grammar, population.fitness_function, param
-        )
-
-        ##################
-        # Replacement. Replace individual solutions in the population
-        ##################
-        population.individuals = generational_replacement(
-            new_individuals,
+    # Batched variation on a genome matrix and batched selection
+    rng = get_search_rng(param)
+
+    try:
+        ######################
+        # Evaluate fitness for the first generation (generation 0)
+        ######################
+        population.individuals = evaluate_fitness(
             population.individuals,
-            population_size=param["population_size"],
-            elite_size=param["elite_size"],
+            population.grammar,
+            population.fitness_function,
+            param,
+            evaluator,
         )
-
-        # Set best solution. Replacement does not guarantee sorted solutions
+        # Set best solution
         population.individuals = sort_population(population.individuals)
-        best_ever = population.individuals[0]
+        best_ever = population.individuals[0] # The best individual in the original (first) generation 
 
         # Print the stats of the populations
-        print_stats(generation, population.individuals, stats, start_time)
-
-        # Increase the generation counter
-        generation += 1
+        print_stats(0, population.individuals, stats, start_time, is_sorted=True)
+
+        ######################
+        # Generation loop: Evaluate fitness for the following (child generations)
+        ######################
+        generation = 1
+        while generation < param["generations"]:
+            start_time = time.time()
+            param["cache"].new_generation(generation)
+
+            # Selection, variation, evaluation and replacement
+            evolve_generation(population, param, rng, evaluator)
+            best_ever = population.individuals[0]
+
+            # Print the stats of the populations
+            print_stats(generation, population.individuals, stats, start_time, is_sorted=True)
+
+            # Increase the generation counter
+            generation += 1
+    finally:
+        # Stop the workers and close the cache also when the search fails
+        if evaluator is not None:
+            evaluator.shutdown()
+        param["cache"].close()
 
     write_run_output(generation, stats, param)
 
     return best_ever
 
 
+def get_cache_namespace(grammar: Grammar, fitness_function_param: Dict[str, Any]) -> str:
+    """Return a hash of the grammar rules and the fitness function settings.
+    Fitness values are only valid for the same grammar and fitness function,
+    so the persistent fitness cache stores them under this namespace.
+
+    :param grammar: Grammar
+    :type grammar: Grammar
+    :param fitness_function_param: Fitness function settings
+    :type fitness_function_param: dict
+    :return: Namespace
+    :rtype: str
+    """
+    key = json.dumps(
+        [str(grammar.start_rule), str(grammar.rules), fitness_function_param],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
 def print_cache_stats(generation: int, param: Dict[str, Any]) -> None:
+    cache: FitnessCache = param["cache"]
     _hist: DefaultDict[str, int] = collections.defaultdict(int)
-    for v in param["cache"].values():
+    for v in cache.values():
         _hist[str(v)] += 1
 
     print(
-        "Cache entries:{} Total Fitness Evaluations:{} Fitness Values:{}".format(
-            len(param["cache"].keys()),
-            generation * param["population_size"] ** 2,
-            len(_hist.keys()),
+        "Cache entries:{} Hits:{} Misses:{} Hit rate:{:.3f} Evictions:{} Fitness Values:{}".format(
+            len(cache), cache.hits, cache.misses, cache.hit_rate, cache.evictions, len(_hist.keys())
         )
     )
+    if cache.store is not None:
+        print("Persistent cache:{} Hits:{}".format(cache.store.file_name, cache.store_hits))
 
 
 def get_out_file_name(out_file_name: str, param: Dict[str, Any]) -> str:
@@ -586,7 +2595,11 @@ def write_run_output(
 
 
 def print_stats(
-    generation: int, individuals: List[Individual], stats: Dict[str, List[Any]], start_time: float
+    generation: int,
+    individuals: List[Individual],
+    stats: Dict[str, List[Any]],
+    start_time: float,
+    is_sorted: bool = False,
 ) -> None:
     """
     Print the statistics for the generation and population.
@@ -599,6 +2612,8 @@ def print_stats(
     :type stats: dict
     :param start_time: Start time
     :type start_time: float
+    :param is_sorted: The individuals are already sorted by fitness
+    :type is_sorted: bool
     """
 
     def get_ave_and_std(values: Sequence[float]) -> Tuple[float, float]:
@@ -615,13 +2630,14 @@ def print_stats(
         return _ave, _std
 
     # Make sure individuals are sorted
-    individuals = sort_population(individuals)
+    if not is_sorted:
+        individuals = sort_population(individuals)
     # Get the fitness values
     fitness_values: Sequence[float] = [i.get_fitness() for i in individuals]
     # Get the number of nodes
     size_values: Sequence[float] = [float(i.used_input) for i in individuals]
     # Get the max length
-    length_values: Sequence[float] = [float(len(i.genome)) for i in individuals]
+    length_values: Sequence[float] = [float(get_genome_size(i.codons)) for i in individuals]
     # Get average and standard deviation of fitness
     ave_fit, std_fit = get_ave_and_std(fitness_values)
     # Get average and standard deviation of size
@@ -631,7 +2647,7 @@ def print_stats(
     # Print the statistics
     print(
         "Gen:{} t:{:.3f} fit_ave:{:.2f}+-{:.3f} size_ave:{:.2f}+-{:.3f} "
-        "length_ave:{:.2f}+-{:.3f} {}".format(
+        "length_ave:{:.2f}+-{:.3f} remaps:{} {}".format(
             generation,
             time.time() - start_time,
             ave_fit,
@@ -640,6 +2656,7 @@ def print_stats(
             std_size,
             ave_length,
             std_length,
+            sum(_.remaps for _ in individuals),
             individuals[0],
         )
     )
@@ -648,6 +2665,15 @@ def print_stats(
     stats["size_values"].append(size_values)
     stats["length_values"].append(length_values)
     stats["solution_values"].append([_.phenotype for _ in individuals])
+    stats["remap_values"].append([_.remaps for _ in individuals])
+
+
+def get_genome_size(genome: Sequence[Any]) -> int:
+    """Return the number of codons of a genome, or of genes of a structured genome."""
+    if len(genome) > 0 and isinstance(genome[0], list):
+        return sum(len(_) for _ in genome)
+
+    return len(genome)
 
 
 def int_flip_mutation(individual: Individual, mutation_probability: float) -> Individual:
@@ -666,12 +2692,20 @@ def int_flip_mutation(individual: Individual, mutation_probability: float) -> In
     assert Individual.codon_size > 0
     assert 0 <= mutation_probability <= 1.0
 
-    for i in range(len(individual.genome)):
+    # The genome is only copied if it is shared and mutated
+    for i in range(len(individual.codons)):
         if random.random() < mutation_probability:
             individual.genome[i] = random.randint(0, Individual.codon_size)
-            individual.phenotype = Individual.DEFAULT_PHENOTYPE
-            individual.used_input = 0
-            individual.fitness = DEFAULT_FITNESS
+            # Codons after the used inputs do not change the phenotype
+            if individual.dirty or i < individual.used_input:
+                individual.phenotype = Individual.DEFAULT_PHENOTYPE
+                individual.used_input = 0
+                individual.fitness = DEFAULT_FITNESS
+                individual.dirty = True
+                individual.tree = None
+
+            if individual.derivation is not None:
+                individual.derivation = individual.derivation.truncate(i)
 
     return individual
 
@@ -703,10 +2737,8 @@ def tournament_selection(
         # Randomly select tournament size individual solutions
         # from the population.
         competitors = random.sample(population, tournament_size)
-        # Rank the selected solutions
-        competitors = sort_population(competitors)
-        # Append the best solution to the winners
-        winners.append(competitors[0])
+        # Append the best solution to the winners, the first one on ties
+        winners.append(max(competitors, key=FITNESS_KEY))
 
     assert len(winners) == population_size
 
@@ -731,8 +2763,8 @@ def onepoint_crossover(
     """
     assert p_0.used_input > 0 and p_1.used_input > 0
     # Get the chromosomes
-    c_p_0 = p_0.genome
-    c_p_1 = p_1.genome
+    c_p_0 = p_0.codons
+    c_p_1 = p_1.codons
     # Only within used codons
     max_p_0 = p_0.used_input
     max_p_1 = p_1.used_input
@@ -742,15 +2774,266 @@ def onepoint_crossover(
     if random.random() < crossover_probability:
         c_0 = c_p_0[:pt_p_0] + c_p_1[pt_p_1:]
         c_1 = c_p_1[:pt_p_1] + c_p_0[pt_p_0:]
+        individuals = [Individual(c_0), Individual(c_1)]
+        # The children keep the derivation of the head of their genome
+        for individual, parent, point in zip(individuals, (p_0, p_1), (pt_p_0, pt_p_1)):
+            if parent.derivation is not None and not parent.dirty:
+                individual.derivation = parent.derivation.truncate(point)
     else:
-        c_0 = c_p_0[:]
-        c_1 = c_p_1[:]
-
-    individuals = [Individual(c_0), Individual(c_1)]
+        # The copies keep the phenotype and fitness of the parents
+        individuals = [p_0.copy(), p_1.copy()]
 
     return individuals
 
 
+def get_derivation_tree(individual: Individual, grammar: Grammar) -> DerivationTree:
+    """Return the derivation tree of a mapped individual. The tree is
+    recorded by the mapping when `Grammar.trees` is set, otherwise, e.g. for
+    mapping cache hits and parallel workers, the genome is derived again.
+
+    :param individual: Mapped individual
+    :type individual: Individual
+    :param grammar: Grammar of the individual
+    :type grammar: Grammar
+    :return: Derivation tree
+    :rtype: DerivationTree
+    """
+    if individual.tree is None:
+        tree = grammar.derive_tree(individual.codons)[3]
+        assert tree is not None, "Individual is not mapped: {}".format(individual.codons)
+        individual.tree = tree
+
+    return individual.tree
+
+
+def replace_subtree(
+    individual: Individual,
+    grammar: Grammar,
+    node: int,
+    inputs: Sequence[int],
+    steps: int,
+    rng: Any = random,
+) -> Individual:
+    """Return a new individual where the subtree of a node is replaced by the
+    subtree with the given inputs. The genome is padded with random codons
+    if it is too short for the new derivation, see `Grammar.get_genome_length`.
+
+    :param individual: Mapped individual
+    :type individual: Individual
+    :param grammar: Grammar of the individual
+    :type grammar: Grammar
+    :param node: Node of the derivation tree of the individual
+    :type node: int
+    :param inputs: Inputs of the new subtree, it has the same non-terminal as the node
+    :type inputs: list of int
+    :param steps: Number of derivation steps of the new subtree
+    :type steps: int
+    :param rng: Random number generator for the padding
+    :type rng: random.Random
+    :return: New individual
+    :rtype: Individual
+    """
+    tree = get_derivation_tree(individual, grammar)
+    start, end = tree.starts[node], tree.ends[node]
+    genome = individual.codons[:start] + list(inputs) + individual.codons[end:]
+    used_input = tree.ends[0] - (end - start) + len(inputs)
+    length = grammar.get_genome_length(used_input, tree.steps[0] - tree.steps[node] + steps)
+    genome.extend(rng.randint(0, Individual.codon_size) for _ in range(length - len(genome)))
+    child = Individual(genome)
+    # The checkpoints before the subtree are unchanged
+    if individual.derivation is not None and not individual.dirty:
+        child.derivation = individual.derivation.truncate(start)
+
+    return child
+
+
+def subtree_crossover(
+    p_0: Individual,
+    p_1: Individual,
+    crossover_probability: float,
+    grammar: Grammar,
+    max_depth: int,
+) -> List[Individual]:
+    """Given two mapped individuals, create two children by swapping
+    subtrees of the same non-terminal, and return them. The children keep the
+    rest of the derivation trees of the parents, see `DerivationTree`.
+
+    The subtrees are chosen so that the children are at most `max_depth`
+    deep, or as deep as the deepest parent. If no subtrees can be swapped the
+    children are copies of the parents.
+
+    :param p_0: A parent
+    :type p_0: Individual
+    :param p_1: Another parent
+    :type p_1: Individual
+    :param crossover_probability: Probability of crossover
+    :type crossover_probability: float
+    :param grammar: Grammar of the parents
+    :type grammar: Grammar
+    :param max_depth: Maximum derivation tree depth
+    :type max_depth: int
+    :return: A pair of new individual solutions
+    :rtype: list of Individuals
+    """
+    if random.random() < crossover_probability:
+        tree_0 = get_derivation_tree(p_0, grammar)
+        tree_1 = get_derivation_tree(p_1, grammar)
+        max_depth = max(max_depth, tree_0.heights[0], tree_1.heights[0])
+        nodes_1: DefaultDict[int, List[int]] = collections.defaultdict(list)
+        for node, symbol in enumerate(tree_1.symbols):
+            nodes_1[symbol].append(node)
+
+        nodes_0 = list(range(len(tree_0)))
+        random.shuffle(nodes_0)
+        for node_0 in nodes_0:
+            # Subtrees that fit in the other tree
+            nodes = [
+                _
+                for _ in nodes_1[tree_0.symbols[node_0]]
+                if tree_0.depths[node_0] + tree_1.heights[_] - 1 <= max_depth
+                and tree_1.depths[_] + tree_0.heights[node_0] - 1 <= max_depth
+            ]
+            if nodes:
+                node_1 = random.choice(nodes)
+                inputs_0 = p_0.codons[tree_0.starts[node_0] : tree_0.ends[node_0]]
+                inputs_1 = p_1.codons[tree_1.starts[node_1] : tree_1.ends[node_1]]
+                return [
+                    replace_subtree(p_0, grammar, node_0, inputs_1, tree_1.steps[node_1]),
+                    replace_subtree(p_1, grammar, node_1, inputs_0, tree_0.steps[node_0]),
+                ]
+
+    # The copies keep the phenotype and fitness of the parents
+    return [p_0.copy(), p_1.copy()]
+
+
+def subtree_mutation(
+    individual: Individual, mutation_probability: float, grammar: Grammar, max_depth: int
+) -> Individual:
+    """With probability, replace a random subtree of a mapped individual with
+    a new random subtree of the same non-terminal, see `Grammar.generate_inputs`.
+    Only subtrees of non-terminals with more than one production are
+    replaced. The new subtree fits within `max_depth`, or the depth of the
+    tree if it is deeper.
+
+    :param individual: Mapped individual
+    :type individual: Individual
+    :param mutation_probability: Probability of replacing a subtree
+    :type mutation_probability: float
+    :param grammar: Grammar of the individual
+    :type grammar: Grammar
+    :param max_depth: Maximum derivation tree depth
+    :type max_depth: int
+    :return: Mutated individual, or the individual if it is not mutated
+    :rtype: Individual
+    """
+    assert 0 <= mutation_probability <= 1.0
+    if random.random() >= mutation_probability:
+        return individual
+
+    tree = get_derivation_tree(individual, grammar)
+    nodes = [_ for _ in range(len(tree)) if grammar.rule_arity[tree.symbols[_]] > 1]
+    if not nodes:
+        return individual
+
+    node = random.choice(nodes)
+    symbol = tree.symbols[node]
+    depth = max(max_depth, tree.heights[0]) - tree.depths[node] + 1
+    inputs, steps = grammar.generate_inputs(
+        max(depth, int(grammar.min_depths[symbol])), random.random() < 0.5, random, symbol
+    )
+    return replace_subtree(individual, grammar, node, inputs, steps)
+
+
+def sge_crossover(
+    p_0: Individual, p_1: Individual, crossover_probability: float
+) -> List[Individual]:
+    """Given two individuals with structured genomes, create two children
+    with uniform crossover of the gene lists, i.e. each child gets the whole
+    gene list of each non-terminal from one of the parents, and return them.
+
+    The children share the gene lists with the parents, gene lists are
+    copied before they are changed, see `sge_mutation`.
+
+    :param p_0: A parent
+    :type p_0: Individual
+    :param p_1: Another parent
+    :type p_1: Individual
+    :param crossover_probability: Probability of crossover
+    :type crossover_probability: float
+    :return: A pair of new individual solutions
+    :rtype: list of Individuals
+    """
+    if random.random() < crossover_probability:
+        c_0: List[Any] = []
+        c_1: List[Any] = []
+        for genes_0, genes_1 in zip(p_0.codons, p_1.codons):
+            if random.random() < 0.5:
+                genes_0, genes_1 = genes_1, genes_0
+            c_0.append(genes_0)
+            c_1.append(genes_1)
+
+        return [Individual(c_0), Individual(c_1)]
+
+    # The copies keep the phenotype and fitness of the parents
+    return [p_0.copy(), p_1.copy()]
+
+
+def sge_mutation(
+    individual: Individual, mutation_probability: float, grammar: Grammar
+) -> Individual:
+    """Mutate an individual with a structured genome by changing each gene
+    with probability to another production of its non-terminal. Genes of
+    non-terminals with one production are not mutated.
+
+    :param individual: Individual with a structured genome
+    :type individual: Individual
+    :param mutation_probability: Probability of changing a gene
+    :type mutation_probability: float
+    :param grammar: Grammar of the individual
+    :type grammar: Grammar
+    :return: Mutated individual
+    :rtype: Individual
+    """
+    assert 0 <= mutation_probability <= 1.0
+    assert grammar.sge_max_depth is not None
+    genome = cast(List[List[int]], individual.codons)
+    mutated: Optional[List[List[int]]] = None
+    # First mutated gene of each non-terminal
+    first_genes: Dict[int, int] = {}
+    for symbol, genes in enumerate(genome):
+        arity = grammar.rule_arity[symbol]
+        if arity < 2:
+            continue
+
+        for i, gene in enumerate(genes):
+            if random.random() < mutation_probability:
+                if mutated is None:
+                    mutated = list(genome)
+                if symbol not in first_genes:
+                    # The gene lists can be shared with other individuals
+                    mutated[symbol] = list(genes)
+                    first_genes[symbol] = i
+                mutated[symbol][i] = (gene + random.randint(1, arity - 1)) % arity
+
+    if mutated is None:
+        return individual
+
+    # Genes after the used genes do not change the phenotype
+    if not individual.dirty:
+        used_genes = grammar.derive_sge(genome, grammar.sge_max_depth)[1]
+        if all(first_genes[_] >= used_genes[_] for _ in first_genes):
+            individual.genome = cast(List[int], mutated)
+            return individual
+
+    individual.genome = cast(List[int], mutated)
+    individual.phenotype = Individual.DEFAULT_PHENOTYPE
+    individual.used_input = 0
+    individual.fitness = DEFAULT_FITNESS
+    individual.dirty = True
+    individual.tree = None
+    return individual
+
+
 def sort_population(individuals: List[Individual]) -> List[Individual]:
     """
     Return a list sorted on the fitness value of the individuals in
@@ -764,7 +3047,7 @@ def sort_population(individuals: List[Individual]) -> List[Individual]:
     """
 
     # Sort the individual elements on the fitness
-    individuals = sorted(individuals, key=lambda x: x.fitness, reverse=True)
+    individuals = sorted(individuals, key=FITNESS_KEY, reverse=True)
 
     return individuals
 
@@ -779,8 +3062,6 @@ def generational_replacement(
     Return a new population. The `elite_size` best old_population
     are appended to the new population.
 
-    # TODO the number of calls to sort_population can be reduced
-
     :param new_population: the new population
     :type new_population: list
     :param old_population: the old population
@@ -795,13 +3076,10 @@ def generational_replacement(
     assert len(old_population) == len(new_population) == population_size
     assert 0 <= elite_size < population_size
 
-    # Sort the population
-    old_population = sort_population(old_population)
     # Append a copy of the elite_size of the old population to
-    # the new population.
-    for ind in old_population[:elite_size]:
-        # TODO is this deep copy redundant
-        new_population.append(copy.deepcopy(ind))
+    # the new population. Same order as sorting the population
+    for ind in heapq.nlargest(elite_size, old_population, key=FITNESS_KEY):
+        new_population.append(ind.copy())
 
     # Sort the new population
     new_population = sort_population(new_population)
@@ -813,6 +3091,113 @@ def generational_replacement(
     return new_population
 
 
+def get_fitness_array(individuals: Sequence[Individual]) -> np.ndarray:
+    """Return the fitness of the individuals as an array.
+
+    :param individuals: Individuals
+    :type individuals: list of Individual
+    :return: Fitness values
+    :rtype: numpy.ndarray
+    """
+    return np.fromiter(
+        (individual.fitness for individual in individuals), dtype=float, count=len(individuals)
+    )
+
+
+def batch_tournament_selection(
+    population: List[Individual],
+    population_size: int,
+    tournament_size: int,
+    rng: np.random.Generator,
+) -> List[Individual]:
+    """Return individuals from a population by holding `population_size`
+    tournaments at once. The competitors are drawn as one matrix of
+    indices, with replacement, and the winner of each row is the first
+    competitor with the highest fitness.
+
+    :param population: Individuals to draw from
+    :type population: list of Individual
+    :param population_size: Number of individuals to select
+    :type population_size: int
+    :param tournament_size: Number of competing individuals
+    :type tournament_size: int
+    :param rng: Random number generator
+    :type rng: numpy.random.Generator
+    :return: Selected individuals
+    :rtype: list of Individuals
+    """
+    assert tournament_size > 0
+    assert tournament_size <= len(population), "{} > {}".format(tournament_size, len(population))
+
+    fitness = get_fitness_array(population)
+    competitors = rng.integers(0, len(population), size=(population_size, tournament_size))
+    best = np.argmax(fitness[competitors], axis=1)
+    winners = competitors[np.arange(population_size), best]
+    return [population[i] for i in winners.tolist()]
+
+
+def array_generational_replacement(
+    new_population: List[Individual],
+    old_population: List[Individual],
+    elite_size: int,
+    population_size: int,
+) -> List[Individual]:
+    """
+    Return a new population sorted by fitness, see
+    `generational_replacement`. The elites are found with a stable sort
+    of the fitness array, so ties are broken by position as in
+    `generational_replacement`, and the new population is sorted once.
+
+    :param new_population: the new population
+    :type new_population: list
+    :param old_population: the old population
+    :type old_population: list
+    :param elite_size: Number of individuals to keep for new population
+    :type elite_size: int
+    :param population_size: Number of solutions in new population
+    :type population_size: int
+    :returns: the new population with the best from the old population
+    :rtype: list
+    """
+    assert len(old_population) == len(new_population) == population_size
+    assert 0 <= elite_size < population_size
+
+    if elite_size > 0:
+        old_fitness = get_fitness_array(old_population)
+        elites = np.argsort(-old_fitness, kind="stable")[:elite_size]
+        new_population = new_population + [old_population[i].copy() for i in elites.tolist()]
+
+    # Stable, so ties keep their order
+    order = np.argsort(-get_fitness_array(new_population), kind="stable")[:population_size]
+    return [new_population[i] for i in order.tolist()]
+
+
+# Operators selected with the `selection` and `replacement` parameters
+SELECTION_OPERATORS: Dict[str, Callable[..., List[Individual]]] = {
+    "tournament": tournament_selection,
+    "batch_tournament": batch_tournament_selection,
+}
+REPLACEMENT_OPERATORS: Dict[str, Callable[..., List[Individual]]] = {
+    "generational": generational_replacement,
+    "array_generational": array_generational_replacement,
+}
+
+
+def get_search_rng(param: Dict[str, Any]) -> Optional[np.random.Generator]:
+    """Return a NumPy random number generator when the parameters use
+    vectorized variation or batched selection, otherwise None.
+
+    :param param: Parameters for search
+    :type param: dict
+    :returns: Random number generator
+    :rtype: numpy.random.Generator
+    """
+    if param.get("vectorized", False) or param.get("selection") == "batch_tournament":
+        return get_numpy_rng()
+
+    return None
+
+
 def parse_arguments() -> Dict[str, Union[str, bool, Number]]:
     """
     Returns a dictionary of the default parameters, or the ones set by
@@ -926,13 +3311,18 @@ def parse_arguments() -> Dict[str, Union[str, bool, Number]]:
     return vars(options)
 
 
-def run(param: Dict[str, Any]) -> Individual:
+def run(
+    param: Dict[str, Any],
+    search: Callable[[Population, Dict[str, Any]], Individual] = search_loop,
+) -> Individual:
     """
     Return the best solution. Create an initial
     population. Perform an evolutionary search.
 
     :param param: parameters for pony gp
     :type param: dict
+    :param search: Evolutionary search loop
+    :type search: function
     :returns: Best solution
     """
 
@@ -948,6 +3338,30 @@ def run(param: Dict[str, Any]) -> Individual:
     # Print settings
     #print("donkey_ge settings:", param)
 
+    check_param(param)
+
+    ###########################
+    # Create initial population
+    ###########################
+    population = create_population(param)
+
+    ###########################
+    # Evolutionary search
+    ###########################
+    best_ever = search(population, param) # This is the important part, where the actual evolutionary algorithm takes place
+
+    # Display results
+    print("Time: {:.3f} Best solution:{}".format(time.time() - start_time, best_ever))
+
+    return best_ever
+
+
+def check_param(param: Dict[str, Any]) -> None:
+    """Assert that the search parameters are valid.
+
+    :param param: Parameters
+    :type param: dict
+    """
     assert param["population_size"] > 1
     assert param["generations"] > 0
     assert param["max_length"] > 0
@@ -957,33 +3371,69 @@ def run(param: Dict[str, Any]) -> Individual:
     assert param["elite_size"] < param["population_size"]
     assert 0.0 <= param["crossover_probability"] <= 1.0
     assert 0.0 <= param["mutation_probability"] <= 1.0
+    assert param.get("variation", "onepoint") in ("onepoint", "subtree"), param["variation"]
+    assert not (param.get("variation") == "subtree" and param.get("vectorized", False))
+    # The steady-state search breeds pairs of children one at a time
+    assert not (param.get("steady_state") and param.get("vectorized", False))
+    assert param.get("representation", "ge") in ("ge", "sge"), param["representation"]
+    if param.get("representation", "ge") == "sge":
+        # Structured genomes have their own initialisation and variation
+        assert param.get("variation", "onepoint") == "onepoint", param["variation"]
+        assert param.get("initialisation", "random") == "random", param["initialisation"]
+        assert not param.get("vectorized", False)
+        # The exhaustive search enumerates codon genomes
+        assert not param.get("exhaustive")
+
+
+def create_population(param: Dict[str, Any]) -> Population:
+    """Return a random initial population with the grammar and fitness
+    function of the parameters.
 
-    ###########################
-    # Create initial population
-    ###########################
-    grammar = Grammar(param["bnf_grammar"])
-    grammar.read_bnf_file(grammar.file_name)
+    :param param: Parameters
+    :type param: dict
+    :returns: Initial population, not evaluated
+    :rtype: Population
+    """
+    grammar = read_grammar(param["bnf_grammar"])
     fitness_function = get_fitness_function(param["fitness_function"])
     # These are parameters since defaults are dangerous
     # TODO make clearer
     Individual.max_length = param["max_length"]
     Individual.codon_size = param["integer_input_element_max"]
-    individuals = initialise_population(param["population_size"])
-
-    population = Population(fitness_function, grammar, individuals)
+    if param.get("representation", "ge") == "sge":
+        individuals = initialise_population_sge(
+            param["population_size"], grammar, param.get("max_depth", 10)
+        )
+    elif param.get("initialisation", "random") == "sensible":
+        individuals = initialise_population_sensible(
+            param["population_size"], grammar, param.get("max_depth", 10)
+        )
+    elif param.get("vectorized", False):
+        individuals = initialise_population_vectorized(param["population_size"], get_numpy_rng())
+    else:
+        individuals = initialise_population(param["population_size"])
 
-    ###########################
-    # Evolutionary search
-    ###########################
-    best_ever = search_loop(population, param) # This is the important part, where the actual evolutionary algorithm takes place
+    # Known phenotypes replace the first individuals
+    seed_phenotypes: List[str] = param.get("seed_phenotypes", [])
+    assert len(seed_phenotypes) <= len(individuals), len(seed_phenotypes)
+    for i, phenotype in enumerate(seed_phenotypes):
+        inputs = grammar.reverse_map(phenotype)
+        if param.get("representation", "ge") == "sge":
+            individuals[i] = Individual(cast(List[int], grammar.get_structured_genome(inputs)))
+            continue
 
-    # Display results
-    print("Time: {:.3f} Best solution:{}".format(time.time() - start_time, best_ever))
+        tail = [
+            random.randint(0, Individual.codon_size)
+            for _ in range(Individual.max_length - len(inputs))
+        ]
+        individuals[i] = Individual(inputs + tail)
 
-    return best_ever
+    return Population(fitness_function, grammar, individuals)
 
 
 DEFAULT_FITNESS: float = -float("inf")
+# Sort key of individuals
+FITNESS_KEY = operator.attrgetter("fitness")
 
 
 def get_fitness_function(param: Dict[str, str]) -> FitnessFunction:
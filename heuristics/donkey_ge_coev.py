@@ -1,11 +1,13 @@
-from collections import OrderedDict, defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque
 import time
 
 import json
 import random
-from typing import Any, List, Dict
+from typing import Any, Deque, List, Dict, Optional, Sequence, Tuple
 from numbers import Number
 
+import numpy as np
+
 import heuristics.donkey_ge
 from heuristics.donkey_ge import (
     map_input_with_grammar,
@@ -17,19 +19,96 @@ from heuristics.donkey_ge import (
     generational_replacement,
     Grammar,
     initialise_population,
+    initialise_population_sge,
     parse_arguments,
     Population,
     print_cache_stats,
     get_out_file_name,
+    get_cache_namespace,
+    FitnessFunction,
+    MappingCache,
+    read_grammar,
 )
+from heuristics.fitness_cache import get_fitness_cache
 
 __author__ = "Erik Hemberg"
 """
 Alternating Coevolutionary Algorithm
 """
 
-# TODO better way of setting cache max size
+# Default cache max size, use the `fitness_cache` settings to change it
 CACHE_MAX_SIZE = 100_000
+# Opponents of the individuals, see `get_opponents`
+OPPONENT_SAMPLING: Tuple[str, ...] = ("all", "random", "best")
+
+
+class HallOfFame(object):
+    """Bounded archive of the best individuals of past generations. The
+    oldest individual is evicted when the archive is full.
+
+    Attributes:
+        max_size: Max number of individuals, 0 turns the archive off
+        entries: Generation and copy of the archived individuals, oldest first
+    """
+
+    def __init__(self, max_size: int = 0) -> None:
+        """
+        :param max_size: Max number of individuals, 0 turns the archive off
+        :type max_size: int
+        """
+        assert max_size >= 0, max_size
+        self.max_size = max_size
+        self.entries: Deque[Tuple[int, Individual]] = deque()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def individuals(self) -> List[Individual]:
+        """Archived individuals, oldest first."""
+        return [individual for _, individual in self.entries]
+
+    def update(self, generation: int, individual: Individual) -> bool:
+        """Archive a copy of the individual, unless its phenotype is already archived.
+
+        :param generation: Generation of the individual
+        :type generation: int
+        :param individual: Best individual of the generation
+        :type individual: Individual
+        :return: True if the individual was archived
+        :rtype: bool
+        """
+        if self.max_size == 0:
+            return False
+
+        if any(_.phenotype == individual.phenotype for _ in self.individuals):
+            return False
+
+        self.entries.append((generation, individual.copy()))
+        if len(self.entries) > self.max_size:
+            self.entries.popleft()
+
+        return True
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        """Return the archive for the output files.
+
+        :return: Generation, phenotype, fitness and genome of the archived individuals
+        :rtype: list of dict
+        """
+        return [
+            {
+                "generation": generation,
+                "phenotype": individual.phenotype,
+                "fitness": individual.fitness,
+                # Structured genomes have a gene list per non-terminal
+                "genome": [
+                    [int(gene) for gene in _] if isinstance(_, list) else int(_)
+                    for _ in individual.codons
+                ],
+            }
+            for generation, individual in self.entries
+        ]
 
 
 class CoevPopulation(Population):
@@ -58,6 +137,17 @@ class CoevPopulation(Population):
         super(CoevPopulation, self).__init__(fitness_function, grammar, individuals)
         self.adversary = adversary
         self.name = name
+        # Best individuals of past generations, see `search_loop_coevolution`
+        self.hall_of_fame = HallOfFame()
+
+    def map_individuals(self) -> int:
+        """Map the individuals that changed since they were last mapped,
+        see `map_individuals`.
+
+        :return: Number of mapped individuals
+        :rtype: int
+        """
+        return map_individuals(self.individuals, self.grammar)
 
     def clone(self) -> Population:
         clone = CoevPopulation(
@@ -78,6 +168,202 @@ class CoevPopulation(Population):
         return _str
 
 
+class CoevFitnessFunction(FitnessFunction):
+    """
+    Coevolutionary fitness function abstract class. Evaluates all the
+    phenotypes of a population against all the adversary phenotypes at
+    once, see `coev_matrix`. The fitness of an individual is its mean
+    payoff against the adversary individuals.
+    """
+
+    def coev_matrix(
+        self, phenotypes: Sequence[str], adversary_phenotypes: Sequence[str]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Return the payoff matrices of phenotypes (rows) against adversary
+        phenotypes (columns).
+
+        :param phenotypes: Phenotypes of the population
+        :type phenotypes: list of str
+        :param adversary_phenotypes: Phenotypes of the adversary population
+        :type adversary_phenotypes: list of str
+        :return: Payoffs of the phenotypes, and payoffs of the adversary
+                 phenotypes or None if the adversaries have another fitness function
+        :rtype: tuple of numpy.ndarray
+        """
+        raise NotImplementedError("Define in subclass")
+
+    def coev(self, fcn_str: str, inds: List[Individual], cache: Dict[str, float]) -> float:
+        """Return the mean payoff of a phenotype against the individuals.
+
+        :param fcn_str: Phenotype
+        :type fcn_str: str
+        :param inds: Adversary individuals
+        :type inds: list of Individual
+        :param cache: Cache of payoffs
+        :type cache: dict
+        :return: Fitness
+        :rtype: float
+        """
+        adversary_phenotypes, counts = get_phenotype_counts(inds)
+        payoffs = get_payoff_matrix(self, [fcn_str], adversary_phenotypes, cache, "", "")
+        return float(payoffs[0] @ (counts / counts.sum()))
+
+
+def get_phenotype_counts(individuals: List[Individual]) -> Tuple[List[str], np.ndarray]:
+    """Return the unique phenotypes of the individuals, in order, and the
+    number of individuals with each phenotype.
+
+    :param individuals: Individuals
+    :type individuals: list of Individual
+    :return: Unique phenotypes and their counts
+    :rtype: tuple of list of str and numpy.ndarray
+    """
+    counts = Counter(ind.phenotype for ind in individuals)
+    return list(counts.keys()), np.array(list(counts.values()), dtype=float)
+
+
+def get_payoff_key(name: str, phenotype: str, adversary_phenotype: str) -> str:
+    """Return the cache key of the payoff of a phenotype of a population
+    against an adversary phenotype.
+
+    :param name: Population name
+    :type name: str
+    :param phenotype: Phenotype
+    :type phenotype: str
+    :param adversary_phenotype: Adversary phenotype
+    :type adversary_phenotype: str
+    :return: Cache key
+    :rtype: str
+    """
+    return json.dumps([name, phenotype, adversary_phenotype])
+
+
+def get_payoff_matrix(
+    fitness_function: CoevFitnessFunction,
+    phenotypes: Sequence[str],
+    adversary_phenotypes: Sequence[str],
+    cache: Dict[str, float],
+    name: str,
+    adversary_name: str,
+) -> np.ndarray:
+    """Return the payoffs of phenotypes against adversary phenotypes. Only
+    the rows and columns with payoffs missing from the cache are computed.
+    The payoffs of the adversaries are cached as well, so the matrix also
+    serves the evaluation of the adversary population.
+
+    :param fitness_function: Fitness function
+    :type fitness_function: CoevFitnessFunction
+    :param phenotypes: Unique phenotypes of the population
+    :type phenotypes: list of str
+    :param adversary_phenotypes: Unique phenotypes of the adversary population
+    :type adversary_phenotypes: list of str
+    :param cache: Cache of payoffs
+    :type cache: dict
+    :param name: Population name
+    :type name: str
+    :param adversary_name: Adversary population name
+    :type adversary_name: str
+    :return: Payoff matrix
+    :rtype: numpy.ndarray
+    """
+    payoffs = np.zeros((len(phenotypes), len(adversary_phenotypes)))
+    missing = np.zeros(payoffs.shape, dtype=bool)
+    for i, phenotype in enumerate(phenotypes):
+        for j, adversary_phenotype in enumerate(adversary_phenotypes):
+            key = get_payoff_key(name, phenotype, adversary_phenotype)
+            if key in cache:
+                payoffs[i, j] = cache[key]
+            else:
+                missing[i, j] = True
+
+    rows = np.flatnonzero(missing.any(axis=1))
+    if rows.size == 0:
+        return payoffs
+
+    columns = np.flatnonzero(missing.any(axis=0))
+    _phenotypes = [phenotypes[i] for i in rows.tolist()]
+    _adversary_phenotypes = [adversary_phenotypes[j] for j in columns.tolist()]
+    row_payoffs, column_payoffs = fitness_function.coev_matrix(_phenotypes, _adversary_phenotypes)
+    payoffs[np.ix_(rows, columns)] = row_payoffs
+    for i, phenotype in enumerate(_phenotypes):
+        for j, adversary_phenotype in enumerate(_adversary_phenotypes):
+            cache[get_payoff_key(name, phenotype, adversary_phenotype)] = float(row_payoffs[i, j])
+            if column_payoffs is not None:
+                key = get_payoff_key(adversary_name, adversary_phenotype, phenotype)
+                cache[key] = float(column_payoffs[i, j])
+
+    return payoffs
+
+
+def evaluate_fitness_matrix(
+    individuals: List[Individual],
+    grammar: Grammar,
+    fitness_function: CoevFitnessFunction,
+    adversaries: List[Individual],
+    param: Dict[str, Any],
+    name: str,
+    adversary_name: str,
+) -> List[Individual]:
+    """Perform the fitness evaluation of the population against the
+    adversaries with one payoff matrix of the unique phenotypes.
+
+    :param individuals: Individuals to evaluate
+    :type individuals: list of Individual
+    :param grammar: Grammar of the individuals
+    :type grammar: Grammar
+    :param fitness_function: Fitness function
+    :type fitness_function: CoevFitnessFunction
+    :param adversaries: Mapped competitors (or collaborators) of the individuals
+    :type adversaries: list of Individuals
+    :param param: Other parameters
+    :type param: dict
+    :param name: Population name
+    :type name: str
+    :param adversary_name: Adversary population name
+    :type adversary_name: str
+    :return: Evaluated individuals
+    :rtype: list of Individuals
+    """
+    map_individuals(individuals, grammar)
+    assert all(ind.phenotype for ind in individuals)
+
+    # Unique phenotypes, in order
+    phenotypes, _ = get_phenotype_counts(individuals)
+    adversary_phenotypes, counts = get_phenotype_counts(adversaries)
+    payoffs = get_payoff_matrix(
+        fitness_function, phenotypes, adversary_phenotypes, param["cache"], name, adversary_name
+    )
+    # Mean payoff against the adversary individuals
+    fitness_values = payoffs @ (counts / counts.sum())
+    rows = {phenotype: i for i, phenotype in enumerate(phenotypes)}
+    for ind in individuals:
+        ind.fitness = float(fitness_values[rows[ind.phenotype]])
+
+    return individuals
+
+
+def map_individuals(individuals: List[Individual], grammar: Grammar) -> int:
+    """Map the individuals that changed since they were last mapped. In
+    coevolution fitness is relative to the adversaries and is evaluated
+    every generation, so `dirty` only tracks the phenotype. Variation sets it.
+
+    :param individuals: Individuals
+    :type individuals: list of Individual
+    :param grammar: Grammar of the individuals
+    :type grammar: Grammar
+    :return: Number of mapped individuals
+    :rtype: int
+    """
+    n_mapped = 0
+    for ind in individuals:
+        if ind.dirty:
+            map_input_with_grammar(ind, grammar)
+            ind.dirty = False
+            n_mapped += 1
+
+    return n_mapped
+
+
 def evaluate(
     individual: Individual, fitness_function: Any, inds: List[Individual], cache: Dict[str, float]
 ) -> Individual:
@@ -127,21 +413,106 @@ def evaluate_fitness(
     cache = param["cache"]
 
     n_individuals = len(individuals)
+    map_individuals(individuals, grammar)
+    # Each unique adversary is played once, its payoff is weighted by its number of individuals
+    adversary_phenotypes, counts = get_phenotype_counts(adversaries)
+    unique_adversaries: Dict[str, Individual] = {}
+    for adversary in adversaries:
+        unique_adversaries.setdefault(adversary.phenotype, adversary)
+    weights = counts / counts.sum()
+    # Individuals with the same phenotype are evaluated once
+    fitness_values: Dict[str, float] = {}
     # Iterate over all the individual solutions
     for ind in individuals:
-        # TODO map only once
-        map_input_with_grammar(ind, grammar)
         assert ind.phenotype
-        if ind.phenotype != "":
+        if ind.phenotype in fitness_values:
+            ind.fitness = fitness_values[ind.phenotype]
+        elif ind.phenotype != "":
             # Execute the fitness function
-            evaluate(ind, fitness_function, adversaries, cache)
-            assert ind.fitness is not None
+            payoffs = np.array(
+                [
+                    fitness_function.coev(ind.phenotype, [unique_adversaries[_]], cache)
+                    for _ in adversary_phenotypes
+                ]
+            )
+            ind.fitness = float(payoffs @ weights)
+            fitness_values[ind.phenotype] = ind.fitness
 
     assert n_individuals == len(individuals), "%d != %d" % (n_individuals, len(individuals))
 
     return individuals
 
 
+def get_opponents(adversary: CoevPopulation, settings: Dict[str, Any]) -> List[Individual]:
+    """Return the opponents of the individuals of a population, from the
+    `opponents` settings:
+
+    - `sampling: all` the adversary population (default),
+    - `sampling: random` `size` random adversaries,
+    - `sampling: best` the `size` best adversaries,
+
+    and the hall of fame of the adversary population. All individuals of
+    the population play the same opponents.
+
+    :param adversary: Adversary population, mapped and sorted by fitness
+    :type adversary: CoevPopulation
+    :param settings: `opponents` settings
+    :type settings: dict
+    :return: Opponents
+    :rtype: list of Individual
+    """
+    sampling = settings.get("sampling", "all")
+    assert sampling in OPPONENT_SAMPLING, sampling
+    size = min(settings.get("size", len(adversary.individuals)), len(adversary.individuals))
+    assert size > 0, size
+    if sampling == "random":
+        opponents = random.sample(adversary.individuals, size)
+    elif sampling == "best":
+        opponents = sort_population(adversary.individuals)[:size]
+    else:
+        opponents = list(adversary.individuals)
+
+    return opponents + adversary.hall_of_fame.individuals
+
+
+def evaluate_population(
+    population: CoevPopulation,
+    adversary: CoevPopulation,
+    individuals: List[Individual],
+    param: Dict[str, Any],
+) -> List[Individual]:
+    """Evaluate individuals of a population against opponents from the
+    adversary population, see `get_opponents`. Fitness functions that are a
+    `CoevFitnessFunction` evaluate all the individuals with one payoff matrix.
+
+    :param population: Population of the individuals
+    :type population: CoevPopulation
+    :param adversary: Adversary population, mapped
+    :type adversary: CoevPopulation
+    :param individuals: Individuals to evaluate
+    :type individuals: list of Individual
+    :param param: Other parameters
+    :type param: dict
+    :return: Evaluated individuals
+    :rtype: list of Individuals
+    """
+    opponents = get_opponents(adversary, param.get("opponents", {}))
+    if isinstance(population.fitness_function, CoevFitnessFunction):
+        return evaluate_fitness_matrix(
+            individuals,
+            population.grammar,
+            population.fitness_function,
+            opponents,
+            param,
+            population.name,
+            adversary.name,
+        )
+
+    return evaluate_fitness(
+        individuals, population.grammar, population.fitness_function, opponents, param
+    )
+
+
 def search_loop_coevolution(
     populations: Dict[str, CoevPopulation], param: Dict[str, Any]
 ) -> Dict[str, Individual]:
@@ -155,8 +526,31 @@ def search_loop_coevolution(
     :rtype: dict
     """
 
-    # Evaluate fitness
-    param["cache"] = OrderedDict()
+    # Evaluate fitness. The populations share the cache
+    namespace = ",".join(
+        get_cache_namespace(population.grammar, param["populations"][key]["fitness_function"])
+        for key, population in populations.items()
+    )
+    param["cache"] = get_fitness_cache(
+        param.get("fitness_cache", {"max_entries": CACHE_MAX_SIZE}), namespace=namespace
+    )
+    # Individuals are mapped each generation, cache the mapped genomes
+    if param.get("mapping_cache_size", 100_000) > 0:
+        for population in populations.values():
+            population.grammar.mapping_cache = MappingCache(
+                param.get("mapping_cache_size", 100_000)
+            )
+
+    # Record the derivation trees of the individuals for subtree variation
+    for population in populations.values():
+        population.grammar.trees = param.get("variation", "onepoint") == "subtree"
+        # Map structured genomes
+        if param.get("representation", "ge") == "sge":
+            population.grammar.sge_max_depth = param.get("max_depth", 10)
+
+    # Archive of past bests, played by the adversaries
+    for population in populations.values():
+        population.hall_of_fame = HallOfFame(param.get("opponents", {}).get("hall_of_fame", 0))
 
     stats_dict: OrderedDict[str, Any] = OrderedDict()  # pylint: disable=unsubscriptable-object
     _best: OrderedDict[str, Individual] = OrderedDict()  # pylint: disable=unsubscriptable-object
@@ -165,60 +559,54 @@ def search_loop_coevolution(
         start_time = time.time()
         stats_dict[key] = defaultdict(list)
         stats = stats_dict[key]
-        grammar = population.grammar
-        fitness_function = population.fitness_function
         adversary = populations[population.adversary]
-        for ind in adversary.individuals:
-            map_input_with_grammar(ind, adversary.grammar)
+        adversary.map_individuals()
 
-        population.individuals = evaluate_fitness(
-            population.individuals, grammar, fitness_function, adversary.individuals, param
+        population.individuals = evaluate_population(
+            population, adversary, population.individuals, param
         )
         # Set best solution
         population.individuals = sort_population(population.individuals)
         _best[key] = population.individuals[0]
+        population.hall_of_fame.update(0, _best[key])
 
         # Print the stats of the populations
         print(key, len(param["cache"]))
-        print_stats(0, population.individuals, stats, start_time)
+        print_stats(0, population.individuals, stats, start_time, is_sorted=True)
 
     # Generation loop
     generation = 1
     while generation < param["generations"]:
-        if len(param["cache"]) > CACHE_MAX_SIZE:
-            param["cache"].clear()
+        param["cache"].new_generation(generation)
 
         for key, population in populations.items():
             start_time = time.time()
             stats = stats_dict[key]
-            grammar = population.grammar
-            fitness_function = population.fitness_function
+            # Only the individuals that changed since the last half-step are mapped
             adversary = populations[population.adversary]
-            for ind in adversary.individuals:
-                map_input_with_grammar(ind, adversary.grammar)
+            adversary.map_individuals()
 
             # Selection
             parents = tournament_selection(
                 population.individuals, param["population_size"], param["tournament_size"]
             )
 
-            elites = [Individual(_.genome) for _ in population.individuals[: param["elite_size"]]]
+            # The elites keep their phenotype
+            elites = [_.copy() for _ in population.individuals[: param["elite_size"]]]
 
             # TODO do not bother with elite_number of variations
-            new_individuals = variation(parents, param)
+            new_individuals = variation(parents, param, population.grammar)
 
             for i, _ in enumerate(elites):
                 new_individuals[i] = elites[i]
 
             # Evaluate fitness
-            new_individuals = evaluate_fitness(
-                new_individuals, grammar, fitness_function, adversary.individuals, param
-            )
+            new_individuals = evaluate_population(population, adversary, new_individuals, param)
 
             # Replace populations
 
             # Fitness is relative the adversaries, thus an elite must
-            # always be re-evaluated
+            # always be re-evaluated. The replacement sorts by fitness
             population.individuals = generational_replacement(
                 new_individuals,
                 population.individuals,
@@ -227,16 +615,17 @@ def search_loop_coevolution(
             )
 
             # Set best solution
-            population.individuals = sort_population(population.individuals)
             _best[key] = population.individuals[0]
+            population.hall_of_fame.update(generation, _best[key])
 
             # Print the stats of the populations
             print(key, len(param["cache"]))
-            print_stats(generation, population.individuals, stats, start_time)
+            print_stats(generation, population.individuals, stats, start_time, is_sorted=True)
 
         # Increase the generation counter
         generation += 1
 
+    param["cache"].close()
     write_run_output(generation, stats_dict, populations, param)
 
     best_solution_str = ["%s: %s" % (k, v) for k, v in _best.items()]
@@ -276,6 +665,12 @@ def write_run_output(
             with open(_out_file_name, "w") as out_file:
                 json.dump({k: v}, out_file, indent=1)
 
+        hall_of_fame = populations[key].hall_of_fame
+        if hall_of_fame.max_size > 0:
+            _out_file_name = "%s_%s_hall_of_fame.json" % (out_file_name, key)
+            with open(_out_file_name, "w") as out_file:
+                json.dump({"hall_of_fame": hall_of_fame.to_json()}, out_file, indent=1)
+
 
 def run(param: Dict[str, Any]) -> Dict[str, Individual]:
     """
@@ -316,13 +711,17 @@ def run(param: Dict[str, Any]) -> Dict[str, Individual]:
     populations: OrderedDict = OrderedDict()
     for key in param["populations"].keys():
         p_dict = param["populations"][key]
-        grammar = Grammar(p_dict["bnf_grammar"])
-        grammar.read_bnf_file(grammar.file_name)
+        grammar = read_grammar(p_dict["bnf_grammar"])
         fitness_function = heuristics.donkey_ge.get_fitness_function(p_dict["fitness_function"])
         adversary = p_dict["adversary"]
         Individual.max_length = param["max_length"]
         Individual.codon_size = param["integer_input_element_max"]
-        individuals = initialise_population(param["population_size"])
+        if param.get("representation", "ge") == "sge":
+            individuals = initialise_population_sge(
+                param["population_size"], grammar, param.get("max_depth", 10)
+            )
+        else:
+            individuals = initialise_population(param["population_size"])
         population = CoevPopulation(fitness_function, grammar, adversary, key, individuals)
         populations[key] = population
 
@@ -0,0 +1,97 @@
+import collections
+import itertools
+import time
+from numbers import Number
+from typing import Any, DefaultDict, Dict, List, Optional
+
+import heuristics.donkey_ge
+from heuristics.donkey_ge import (
+    Individual,
+    Population,
+    evaluate_fitness,
+    print_stats,
+    search_loop,
+    setup_search,
+    sort_population,
+    write_run_output,
+)
+
+"""
+Exhaustive search. Grammars with a small finite language are searched by
+evaluating the phenotype of every derivation, which gives the exact
+optimum.
+"""
+
+
+def search_exhaustive(population: Population, param: Dict[str, Any]) -> Individual:
+    """Return the best individual of the language of the population grammar.
+
+    Every derivation is evaluated once, in batches of `exhaustive: batch_size`
+    individuals (default `population_size`), with the `parallel` workers.
+    Each batch is reported as a generation. Phenotypes of ambiguous grammars
+    that were already evaluated are found in the fitness cache. If the
+    language is infinite or has more than `exhaustive: max_size` derivations
+    (default 100000) the evolutionary search loop is used instead.
+
+    :param population: Population with the grammar to search, the individuals are not used
+    :type population: Population
+    :param param: Parameters for search
+    :type param: dict
+    :return: Best individual
+    :rtype: Individual
+    """
+    settings = param["exhaustive"] if isinstance(param.get("exhaustive"), dict) else {}
+    max_size: int = settings.get("max_size", 100_000)
+    batch_size: int = settings.get("batch_size", param["population_size"])
+    assert batch_size > 0, batch_size
+    n_derivations = population.grammar.count_derivations()
+    if n_derivations is None or n_derivations > max_size:
+        print(
+            "Derivations:{} max_size:{}, using the evolutionary search".format(
+                "infinite" if n_derivations is None else n_derivations, max_size
+            )
+        )
+        return search_loop(population, param)
+
+    print("Derivations:{}".format(n_derivations))
+    evaluator = setup_search(population, param)
+    stats: DefaultDict[str, List[Number]] = collections.defaultdict(list)
+    best_ever: Optional[Individual] = None
+    inputs = population.grammar.enumerate_inputs()
+    generation = 0
+    try:
+        while True:
+            start_time = time.time()
+            individuals = [Individual(_) for _ in itertools.islice(inputs, batch_size)]
+            if not individuals:
+                break
+
+            param["cache"].new_generation(generation)
+            individuals = evaluate_fitness(
+                individuals, population.grammar, population.fitness_function, param, evaluator
+            )
+            print_stats(generation, individuals, stats, start_time)
+            best_ever = sort_population(individuals + ([best_ever] if best_ever else []))[0]
+            generation += 1
+    finally:
+        # Stop the workers and close the cache also when the search fails
+        if evaluator is not None:
+            evaluator.shutdown()
+        param["cache"].close()
+
+    write_run_output(generation, stats, param)
+
+    assert best_ever is not None
+    return best_ever
+
+
+def run(param: Dict[str, Any]) -> Individual:
+    """
+    Return the best solution of an exhaustive search.
+
+    :param param: Parameters
+    :type param: dict
+    :returns: Best solution
+    :rtype: Individual
+    """
+    return heuristics.donkey_ge.run(param, search=search_exhaustive)
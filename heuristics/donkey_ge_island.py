@@ -0,0 +1,353 @@
+import collections
+import multiprocessing
+import queue
+import random
+import time
+from numbers import Number
+from typing import Any, DefaultDict, Dict, List, Tuple
+
+from heuristics.donkey_ge import (
+    Individual,
+    Population,
+    check_param,
+    create_population,
+    evaluate_fitness,
+    evolve_generation,
+    get_cache_namespace,
+    get_search_rng,
+    print_stats,
+    read_grammar,
+    setup_search,
+    sort_population,
+    write_run_output,
+)
+from heuristics.fitness_cache import get_fitness_cache
+
+"""
+Island model. Populations evolve in separate processes and periodically
+send copies of some of their individuals to other islands.
+"""
+
+TOPOLOGIES: Tuple[str, ...] = ("ring", "fully_connected", "random")
+EMIGRANT_POLICIES: Tuple[str, ...] = ("best", "random")
+REPLACEMENT_POLICIES: Tuple[str, ...] = ("worst", "random")
+
+# Genome, phenotype, used input and fitness of a migrating individual
+Emigrant = Tuple[List[int], str, int, float]
+
+
+def get_destinations(
+    island: int, n_islands: int, topology: str, seed: int, migration: int
+) -> List[int]:
+    """Return the islands an island sends emigrants to.
+
+    :param island: Island index
+    :type island: int
+    :param n_islands: Number of islands
+    :type n_islands: int
+    :param topology: Migration topology, see `TOPOLOGIES`
+    :type topology: str
+    :param seed: Run seed, the random topology is the same on all islands
+    :type seed: int
+    :param migration: Migration number, the random topology changes each migration
+    :type migration: int
+    :return: Destination islands
+    :rtype: list of int
+    """
+    assert topology in TOPOLOGIES, topology
+    if n_islands < 2:
+        return []
+
+    if topology == "ring":
+        return [(island + 1) % n_islands]
+
+    if topology == "fully_connected":
+        return [_ for _ in range(n_islands) if _ != island]
+
+    # Each island sends to one random other island
+    rng = random.Random("{}:{}".format(seed, migration))
+    destinations = [
+        rng.choice([_ for _ in range(n_islands) if _ != source]) for source in range(n_islands)
+    ]
+    return [destinations[island]]
+
+
+def get_sources(island: int, n_islands: int, topology: str, seed: int, migration: int) -> List[int]:
+    """Return the islands an island receives emigrants from, see `get_destinations`.
+
+    :return: Source islands
+    :rtype: list of int
+    """
+    return [
+        source
+        for source in range(n_islands)
+        if island in get_destinations(source, n_islands, topology, seed, migration)
+    ]
+
+
+def select_emigrants(individuals: List[Individual], size: int, policy: str) -> List[Emigrant]:
+    """Return copies of the individuals to send to other islands.
+
+    :param individuals: Population sorted by fitness
+    :type individuals: list of Individual
+    :param size: Number of emigrants
+    :type size: int
+    :param policy: Emigrant policy, see `EMIGRANT_POLICIES`
+    :type policy: str
+    :return: Emigrants
+    :rtype: list of tuple
+    """
+    assert policy in EMIGRANT_POLICIES, policy
+    size = min(size, len(individuals))
+    if policy == "best":
+        emigrants = individuals[:size]
+    else:
+        emigrants = random.sample(individuals, size)
+
+    return [(list(_.codons), _.phenotype, _.used_input, _.fitness) for _ in emigrants]
+
+
+def insert_immigrants(
+    individuals: List[Individual], immigrants: List[Emigrant], policy: str
+) -> List[Individual]:
+    """Return the population with immigrants replacing individuals. The
+    immigrants are evaluated and are not evaluated again.
+
+    :param individuals: Population
+    :type individuals: list of Individual
+    :param immigrants: Immigrants
+    :type immigrants: list of tuple
+    :param policy: Replacement policy, see `REPLACEMENT_POLICIES`
+    :type policy: str
+    :return: Population sorted by fitness
+    :rtype: list of Individual
+    """
+    assert policy in REPLACEMENT_POLICIES, policy
+    individuals = sort_population(individuals)
+    if policy == "worst":
+        indices = list(range(len(individuals) - 1, -1, -1))
+    else:
+        indices = random.sample(range(len(individuals)), len(individuals))
+
+    for index, (genome, phenotype, used_input, fitness) in zip(indices, immigrants):
+        immigrant = Individual(genome)
+        immigrant.phenotype = phenotype
+        immigrant.used_input = used_input
+        immigrant.fitness = fitness
+        immigrant.dirty = False
+        individuals[index] = immigrant
+
+    return sort_population(individuals)
+
+
+def migrate(
+    island: int,
+    population: Population,
+    settings: Dict[str, Any],
+    inboxes: List[Any],
+    received: DefaultDict[int, List[Tuple[int, List[Emigrant]]]],
+    seed: int,
+    migration: int,
+) -> None:
+    """Send emigrants to the destination islands and wait for the
+    immigrants from the source islands.
+
+    :param island: Island index
+    :type island: int
+    :param population: Population of the island
+    :type population: Population
+    :param settings: `island` settings
+    :type settings: dict
+    :param inboxes: Queue of emigrants for each island
+    :type inboxes: list of multiprocessing.Queue
+    :param received: Emigrants received early, by migration number
+    :type received: dict
+    :param seed: Run seed
+    :type seed: int
+    :param migration: Migration number
+    :type migration: int
+    """
+    n_islands = len(inboxes)
+    topology = settings.get("topology", "ring")
+    emigrants = select_emigrants(
+        population.individuals,
+        settings.get("migration_size", 1),
+        settings.get("emigrant_policy", "best"),
+    )
+    for destination in get_destinations(island, n_islands, topology, seed, migration):
+        inboxes[destination].put((migration, island, emigrants))
+
+    n_sources = len(get_sources(island, n_islands, topology, seed, migration))
+    # Faster islands can already have sent the emigrants of the next migration
+    while len(received[migration]) < n_sources:
+        _migration, source, _emigrants = inboxes[island].get()
+        received[_migration].append((source, _emigrants))
+
+    # Insert in source order, so the run is reproducible from the seed
+    immigrants: List[Emigrant] = []
+    for _, _emigrants in sorted(received.pop(migration), key=lambda x: x[0]):
+        immigrants.extend(_emigrants)
+
+    population.individuals = insert_immigrants(
+        population.individuals, immigrants, settings.get("replacement_policy", "worst")
+    )
+
+
+def run_island(island: int, param: Dict[str, Any], inboxes: List[Any], results: Any) -> None:
+    """Evolve the population of an island and put the stats, best
+    individual and fitness cache entries on the results queue.
+
+    :param island: Island index
+    :type island: int
+    :param param: Parameters, with the `seed` of the island
+    :type param: dict
+    :param inboxes: Queue of emigrants for each island
+    :type inboxes: list of multiprocessing.Queue
+    :param results: Queue for the results
+    :type results: multiprocessing.Queue
+    """
+    settings: Dict[str, Any] = param["island"]
+    interval: int = settings.get("migration_interval", 1)
+    random.seed(param["seed"])
+    population = create_population(param)
+    evaluator = setup_search(population, param)
+    rng = get_search_rng(param)
+    stats: DefaultDict[str, List[Number]] = collections.defaultdict(list)
+    received: DefaultDict[int, List[Tuple[int, List[Emigrant]]]] = collections.defaultdict(list)
+
+    try:
+        start_time = time.time()
+        population.individuals = sort_population(
+            evaluate_fitness(
+                population.individuals,
+                population.grammar,
+                population.fitness_function,
+                param,
+                evaluator,
+            )
+        )
+        print_stats(0, population.individuals, stats, start_time, is_sorted=True)
+        for generation in range(1, param["generations"]):
+            start_time = time.time()
+            param["cache"].new_generation(generation)
+            evolve_generation(population, param, rng, evaluator)
+            if generation % interval == 0:
+                migrate(
+                    island,
+                    population,
+                    settings,
+                    inboxes,
+                    received,
+                    param["run_seed"],
+                    generation // interval,
+                )
+
+            print_stats(generation, population.individuals, stats, start_time, is_sorted=True)
+
+        cache = param["cache"]
+        results.put(
+            (
+                island,
+                dict(stats),
+                population.individuals[0],
+                list(cache.items()),
+                cache.hits,
+                cache.misses,
+            )
+        )
+    finally:
+        # Stop the workers and close the cache also when the search fails
+        if evaluator is not None:
+            evaluator.shutdown()
+        param["cache"].close()
+
+
+def run(param: Dict[str, Any]) -> Individual:
+    """Return the best solution of an island model search. The islands are
+    set up with the `island` settings, e.g.
+
+        island:
+            islands: 4
+            topology: ring # ring, fully_connected or random
+            migration_interval: 5 # Generations between migrations
+            migration_size: 2 # Emigrants sent to each destination
+            emigrant_policy: best # best or random
+            replacement_policy: worst # worst or random
+            seeds: [1, 2, 3, 4] # Optional, default is seed + island index
+
+    The stats of the islands are merged for each generation.
+
+    :param param: Parameters
+    :type param: dict
+    :returns: Best solution
+    :rtype: Individual
+    """
+    start_time = time.time()
+    if "seed" not in param.keys():
+        param["seed"] = int(time.time())
+
+    check_param(param)
+    settings: Dict[str, Any] = param["island"]
+    n_islands: int = settings.get("islands", multiprocessing.cpu_count())
+    seeds: List[int] = settings.get("seeds", [param["seed"] + _ for _ in range(n_islands)])
+    assert n_islands > 0, n_islands
+    assert len(seeds) == n_islands, "{} != {}".format(len(seeds), n_islands)
+    assert settings.get("migration_interval", 1) > 0
+    assert settings.get("topology", "ring") in TOPOLOGIES
+    assert settings.get("emigrant_policy", "best") in EMIGRANT_POLICIES
+    assert settings.get("replacement_policy", "worst") in REPLACEMENT_POLICIES
+
+    inboxes = [multiprocessing.Queue() for _ in range(n_islands)]
+    results: Any = multiprocessing.Queue()
+    processes = []
+    for island, seed in enumerate(seeds):
+        # Islands are processes, they evaluate their population themselves
+        _param = dict(param, seed=seed, run_seed=param["seed"], parallel=None)
+        process = multiprocessing.Process(
+            target=run_island, args=(island, _param, inboxes, results)
+        )
+        process.start()
+        processes.append(process)
+
+    island_results: List[Any] = []
+    while len(island_results) < n_islands:
+        try:
+            island_results.append(results.get(timeout=1))
+        except queue.Empty:
+            # Do not wait for islands that failed
+            failed = [_.exitcode for _ in processes if _.exitcode not in (None, 0)]
+            if failed:
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError("Island process failed with exit code {}".format(failed[0]))
+
+    island_results.sort(key=lambda x: x[0])
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0, process.exitcode
+
+    # Merge the stats and fitness caches of the islands
+    grammar = read_grammar(param["bnf_grammar"])
+    cache_settings = dict(param.get("fitness_cache", {}))
+    cache_settings.pop("persistent", None)
+    param["cache"] = get_fitness_cache(
+        cache_settings, namespace=get_cache_namespace(grammar, param["fitness_function"])
+    )
+    stats: DefaultDict[str, List[List[Any]]] = collections.defaultdict(list)
+    best_individuals: List[Individual] = []
+    for _, island_stats, best, entries, hits, misses in island_results:
+        for key, values in island_stats.items():
+            for generation, generation_values in enumerate(values):
+                if generation == len(stats[key]):
+                    stats[key].append([])
+                stats[key][generation].extend(generation_values)
+
+        best_individuals.append(best)
+        param["cache"].update(entries)
+        param["cache"].add_counts(hits, misses)
+
+    write_run_output(param["generations"], stats, param)
+    best_ever = sort_population(best_individuals)[0]
+    print("Time: {:.3f} Best solution:{}".format(time.time() - start_time, best_ever))
+
+    return best_ever
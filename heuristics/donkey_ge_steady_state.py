@@ -0,0 +1,192 @@
+import collections
+import concurrent.futures
+import time
+from numbers import Number
+from typing import Any, DefaultDict, Dict, List, Optional
+
+import heuristics.donkey_ge
+from heuristics.donkey_ge import (
+    Grammar,
+    Individual,
+    ParallelEvaluator,
+    Population,
+    evaluate_fitness,
+    int_flip_mutation,
+    onepoint_crossover,
+    print_stats,
+    setup_search,
+    sge_crossover,
+    sge_mutation,
+    sort_population,
+    subtree_crossover,
+    subtree_mutation,
+    tournament_selection,
+    write_run_output,
+)
+
+"""
+Steady-state evolutionary search. Children are evaluated asynchronously
+and inserted into the population as soon as their fitness is known, so
+the workers are not idle while waiting for the slowest evaluation of a
+generation.
+"""
+
+
+def breed(
+    individuals: List[Individual], param: Dict[str, Any], grammar: Optional[Grammar] = None
+) -> List[Individual]:
+    """Return two children of parents selected by tournament. With
+    `variation: subtree` the children are bred with the subtree operators,
+    and with `representation: sge` with the structured genome operators.
+
+    :param individuals: Population to select parents from
+    :type individuals: list of Individual
+    :param param: Parameters
+    :type param: dict
+    :param grammar: Grammar of the individuals, needed by subtree variation
+    :type grammar: Grammar
+    :return: Children
+    :rtype: list of Individual
+    """
+    parents = tournament_selection(individuals, 2, param["tournament_size"])
+    if param.get("representation", "ge") == "sge":
+        assert grammar is not None, "Structured genomes need the grammar"
+        children = sge_crossover(parents[0], parents[1], param["crossover_probability"])
+        return [sge_mutation(child, param["mutation_probability"], grammar) for child in children]
+
+    if param.get("variation", "onepoint") == "subtree":
+        assert grammar is not None, "Subtree variation needs the grammar"
+        max_depth: int = param.get("max_depth", 10)
+        children = subtree_crossover(
+            parents[0], parents[1], param["crossover_probability"], grammar, max_depth
+        )
+        return [
+            subtree_mutation(child, param["mutation_probability"], grammar, max_depth)
+            for child in children
+        ]
+
+    children = onepoint_crossover(parents[0], parents[1], param["crossover_probability"])
+    return [int_flip_mutation(child, param["mutation_probability"]) for child in children]
+
+
+def replace_worst(individuals: List[Individual], individual: Individual) -> bool:
+    """Replace the worst individual of the population if the new
+    individual is at least as fit.
+
+    :param individuals: Population
+    :type individuals: list of Individual
+    :param individual: New individual
+    :type individual: Individual
+    :return: True if the individual was inserted
+    :rtype: bool
+    """
+    worst = min(range(len(individuals)), key=lambda i: individuals[i].fitness)
+    if individual.fitness < individuals[worst].fitness:
+        return False
+
+    individuals[worst] = individual
+    return True
+
+
+def search_loop_steady_state(population: Population, param: Dict[str, Any]) -> Individual:
+    """Return the best individual from the steady-state search loop. Assumes
+    the population is initially not evaluated.
+
+    Children are submitted to the evaluator while fewer than
+    `steady_state: max_pending` evaluations are running (default twice the
+    number of workers), and replace the worst individual when they are
+    evaluated. Each `population_size` children count as a generation for the
+    stats. With more than one worker, children are inserted in the order
+    they finish, so runs are not reproducible from the seed.
+
+    :param population: Initial population for search
+    :type population: Population
+    :param param: Parameters for search
+    :type param: dict
+    :return: Best individual
+    :rtype: Individual
+    """
+    start_time = time.time()
+    stats: DefaultDict[str, List[Number]] = collections.defaultdict(list)
+    evaluator = setup_search(population, param) or ParallelEvaluator(
+        {"backend": "serial", "workers": 1},
+        population.grammar,
+        population.fitness_function,
+        param["fitness_function"],
+    )
+    settings = param["steady_state"] if isinstance(param.get("steady_state"), dict) else {}
+    max_pending: int = settings.get("max_pending", 2 * evaluator.workers)
+    assert max_pending > 0, max_pending
+
+    try:
+        population.individuals = evaluate_fitness(
+            population.individuals,
+            population.grammar,
+            population.fitness_function,
+            param,
+            evaluator,
+        )
+        print_stats(0, population.individuals, stats, start_time)
+
+        # The same number of children as the generational search loop
+        n_children = (param["generations"] - 1) * param["population_size"]
+        n_born = 0
+        n_done = 0
+        generation = 1
+        start_time = time.time()
+        pending: Dict[concurrent.futures.Future, List[Individual]] = {}
+        while n_done < n_children:
+            # Keep the evaluator busy
+            while n_born < n_children and len(pending) < max_pending:
+                children = breed(population.individuals, param, population.grammar)[
+                    : n_children - n_born
+                ]
+                n_born += len(children)
+                # Unchanged copies of the parents are not evaluated again
+                dirty_children = [child for child in children if child.dirty]
+                for child in children:
+                    if not child.dirty:
+                        replace_worst(population.individuals, child)
+                        n_done += 1
+
+                if dirty_children:
+                    pending[evaluator.submit(dirty_children, param["cache"])] = dirty_children
+
+            if pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    children = pending.pop(future)
+                    evaluator.set_results(
+                        children, evaluator.merge_result(future.result(), param["cache"])
+                    )
+                    for child in children:
+                        replace_worst(population.individuals, child)
+                        n_done += 1
+
+            while n_done >= generation * param["population_size"]:
+                param["cache"].new_generation(generation)
+                print_stats(generation, population.individuals, stats, start_time)
+                start_time = time.time()
+                generation += 1
+    finally:
+        # Stop the workers and close the cache also when the search fails
+        evaluator.shutdown()
+        param["cache"].close()
+
+    write_run_output(generation, stats, param)
+
+    return sort_population(population.individuals)[0]
+
+
+def run(param: Dict[str, Any]) -> Individual:
+    """
+    Return the best solution of a steady-state search.
+
+    :param param: Parameters
+    :type param: dict
+    :returns: Best solution
+    :rtype: Individual
+    """
+    return heuristics.donkey_ge.run(param, search=search_loop_steady_state)
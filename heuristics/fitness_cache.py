@@ -0,0 +1,532 @@
+"""Fitness caches. A cache maps a key chosen by the fitness function, e.g.
+the phenotype, to a fitness value. The caches implement the mapping
+protocol, so fitness functions use them as a `dict`.
+
+"""
+
+import collections
+import collections.abc
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+__author__ = "Erik Hemberg"
+
+# Marks a key that is not in the store
+_MISSING = object()
+
+
+class SQLiteFitnessStore(object):
+    """Fitness values in an SQLite file, shared by runs and by concurrent
+    processes. Entries are grouped by a namespace, e.g. a hash of the
+    grammar and fitness function settings, since a key is only valid for
+    one fitness function.
+
+    Writes are buffered and flushed every `flush_size` entries. The file
+    uses write-ahead logging, so readers do not block the writer. A read
+    only store ignores writes, e.g. in worker processes that send their new
+    entries to the main process, which stays the only writer.
+
+    Attributes:
+        file_name: SQLite file
+        namespace: Namespace of the keys
+        flush_size: Number of buffered writes before a flush
+        read_only: Ignore writes
+    """
+
+    def __init__(
+        self, file_name: str, namespace: str = "", flush_size: int = 100, read_only: bool = False
+    ) -> None:
+        """
+        :param file_name: SQLite file
+        :type file_name: str
+        :param namespace: Namespace of the keys
+        :type namespace: str
+        :param flush_size: Number of buffered writes before a flush
+        :type flush_size: int
+        :param read_only: Ignore writes
+        :type read_only: bool
+        """
+        assert flush_size > 0
+        self.file_name = file_name
+        self.namespace = namespace
+        self.flush_size = flush_size
+        self.read_only = read_only
+        self._pending: Dict[str, str] = {}
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid = -1
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Return the connection of this process, connections are not shared
+        with forked processes.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            # Threads share the connection, the fitness cache serialises its use
+            self._connection = sqlite3.connect(self.file_name, timeout=60, check_same_thread=False)
+            self._pid = os.getpid()
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fitness ("
+                "namespace TEXT, key TEXT, value TEXT, PRIMARY KEY (namespace, key)"
+                ") WITHOUT ROWID"
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    @staticmethod
+    def encode_key(key: Hashable) -> str:
+        return repr(key)
+
+    def get(self, key: Hashable) -> Any:
+        """Return the value of key, or `_MISSING` if it is not stored."""
+        _key = SQLiteFitnessStore.encode_key(key)
+        if _key in self._pending:
+            return json.loads(self._pending[_key])
+
+        row = (
+            self.get_connection()
+            .execute(
+                "SELECT value FROM fitness WHERE namespace = ? AND key = ?", (self.namespace, _key)
+            )
+            .fetchone()
+        )
+        if row is None:
+            return _MISSING
+
+        return json.loads(row[0])
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store the value of key. The first stored value of a key is kept."""
+        if self.read_only:
+            return
+
+        self._pending[SQLiteFitnessStore.encode_key(key)] = json.dumps(value)
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered entries."""
+        if not self._pending:
+            return
+
+        connection = self.get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO fitness (namespace, key, value) VALUES (?, ?, ?)",
+                [(self.namespace, key, value) for key, value in self._pending.items()],
+            )
+        self._pending = {}
+
+    def close(self) -> None:
+        """Flush and close the connection."""
+        self.flush()
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+
+        self._connection = None
+
+
+class FitnessCache(collections.abc.MutableMapping):
+    """Bounded fitness cache with hit, miss and eviction counters. Evicts
+    the oldest entry when the entry or byte budget is exceeded. An entry
+    larger than the byte budget is kept until the next insert.
+
+    A lookup with `in` or `get` counts as a hit or a miss. Reading a value
+    with `cache[key]` only counts misses, so reading the value of a key that
+    was just checked with `in` is not counted again. Threads sharing a cache
+    should look up values with `get`, since another thread may evict the key
+    between `in` and `cache[key]`.
+
+    The methods are guarded by a lock, so the cache can be shared by the
+    threads of the thread backend. Iterating over the keys, values or items
+    is not guarded.
+
+    Attributes:
+        max_entries: Max number of entries, 0 is unbounded
+        max_bytes: Max estimated size of keys and values in bytes, 0 is unbounded
+        hits: Number of lookups that found the key
+        misses: Number of lookups that did not find the key
+        evictions: Number of entries removed to stay within budget
+    """
+
+    def __init__(
+        self, max_entries: int = 0, max_bytes: int = 0, track_new_entries: bool = False
+    ) -> None:
+        """
+        :param max_entries: Max number of entries, 0 is unbounded
+        :type max_entries: int
+        :param max_bytes: Max estimated size in bytes, 0 is unbounded
+        :type max_bytes: int
+        :param track_new_entries: Remember inserted keys, see `pop_new_entries`
+        :type track_new_entries: bool
+        """
+        assert max_entries >= 0 and max_bytes >= 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.n_bytes = 0
+        self.generation = 0
+        self._data: collections.OrderedDict = collections.OrderedDict()
+        # Size of the entries when they were inserted, values may change size later
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+        self._new_keys: Optional[List[Hashable]] = [] if track_new_entries else None
+        # Optional persistent store behind the cache
+        self.store: Optional[SQLiteFitnessStore] = None
+        self.store_hits = 0
+
+    @staticmethod
+    def get_size(key: Hashable, value: Any) -> int:
+        """Return the estimated size of an entry in bytes."""
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def touch(self, key: Hashable) -> None:
+        """Update the eviction order when an entry is used."""
+
+    def evict(self) -> None:
+        """Remove one entry."""
+        with self._lock:
+            key = next(iter(self._data))
+            del self[key]
+            self.evictions += 1
+
+    def new_generation(self, generation: int) -> None:
+        """Called by the search loop at the start of each generation.
+
+        :param generation: Generation number
+        :type generation: int
+        """
+        with self._lock:
+            self.generation = generation
+            if self.store is not None:
+                self.store.flush()
+
+    def close(self) -> None:
+        """Called by the search loop at the end of the run."""
+        with self._lock:
+            if self.store is not None:
+                self.store.close()
+
+    def load(self, key: Hashable) -> bool:
+        """Copy key from the persistent store into the cache, if it is stored.
+
+        :param key: Key
+        :type key: Hashable
+        :return: True if the key was stored
+        :rtype: bool
+        """
+        with self._lock:
+            if self.store is None:
+                return False
+
+            value = self.store.get(key)
+            if value is _MISSING:
+                return False
+
+            self.store_hits += 1
+            self.insert(key, value)
+            return True
+
+    def _lookup(self, key: Hashable) -> Any:
+        """Return the value of key, or `_MISSING`, and count the lookup.
+
+        :param key: Key
+        :type key: Hashable
+        :return: Value
+        :rtype: object
+        """
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self.touch(key)
+                return self._data[key]
+
+            if self.load(key):
+                self.hits += 1
+                return self._data[key]
+
+            self.misses += 1
+            return _MISSING
+
+    def __contains__(self, key: object) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._data and not self.load(key):
+                self.misses += 1
+                raise KeyError(key)
+
+            return self._data[key]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self.insert(key, value)
+            if self.store is not None:
+                self.store.put(key, value)
+
+    def insert(self, key: Hashable, value: Any) -> None:
+        """Insert an entry in memory."""
+        with self._lock:
+            if key in self._data:
+                del self[key]
+
+            # Make room before inserting, so a new entry is never evicted by itself
+            size = FitnessCache.get_size(key, value)
+            while self._data and (
+                (self.max_entries and len(self._data) >= self.max_entries)
+                or (self.max_bytes and self.n_bytes + size > self.max_bytes)
+            ):
+                self.evict()
+
+            self._data[key] = value
+            self._sizes[key] = size
+            self.n_bytes += size
+            self.inserted(key)
+            if self._new_keys is not None:
+                self._new_keys.append(key)
+
+    def inserted(self, key: Hashable) -> None:
+        """Update the eviction order when an entry is inserted."""
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            del self._data[key]
+            self.n_bytes -= self._sizes.pop(key)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> collections.abc.KeysView:
+        return self._data.keys()
+
+    def values(self) -> collections.abc.ValuesView:
+        # Reading all values is not counted as lookups
+        return self._data.values()
+
+    def items(self) -> collections.abc.ItemsView:
+        return self._data.items()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.n_bytes = 0
+
+    def add_counts(self, hits: int, misses: int) -> None:
+        """Add lookups done on another cache, e.g. in a worker process."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def pop_new_entries(self) -> List[Tuple[Hashable, Any]]:
+        """Return the entries inserted since the last call, if they are still cached.
+
+        :return: New entries
+        :rtype: list of tuple
+        """
+        assert self._new_keys is not None, "Cache does not track new entries"
+        with self._lock:
+            new_entries = [(key, self._data[key]) for key in self._new_keys if key in self._data]
+            self._new_keys = []
+            return new_entries
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that found the key."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the cache counters.
+
+        :return: Counters
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "entries": len(self),
+                "bytes": self.n_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "evictions": self.evictions,
+                "store_hits": self.store_hits,
+            }
+
+
+class LRUFitnessCache(FitnessCache):
+    """Evicts the least recently used entry."""
+
+    def touch(self, key: Hashable) -> None:
+        self._data.move_to_end(key)
+
+
+class LFUFitnessCache(FitnessCache):
+    """Evicts the least frequently used entry, ties are broken by the least
+    recently used.
+    """
+
+    def __init__(
+        self, max_entries: int = 0, max_bytes: int = 0, track_new_entries: bool = False
+    ) -> None:
+        super(LFUFitnessCache, self).__init__(max_entries, max_bytes, track_new_entries)
+        self._frequency: Dict[Hashable, int] = {}
+        # Keys by frequency, in least recently used order
+        self._buckets: Dict[int, collections.OrderedDict] = collections.defaultdict(
+            collections.OrderedDict
+        )
+        self._min_frequency = 0
+
+    def touch(self, key: Hashable) -> None:
+        frequency = self._frequency[key]
+        bucket = self._buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[frequency]
+            if self._min_frequency == frequency:
+                self._min_frequency = frequency + 1
+
+        self._frequency[key] = frequency + 1
+        self._buckets[frequency + 1][key] = None
+
+    def inserted(self, key: Hashable) -> None:
+        self._frequency[key] = 1
+        self._buckets[1][key] = None
+        self._min_frequency = 1
+
+    def evict(self) -> None:
+        with self._lock:
+            while self._min_frequency not in self._buckets:
+                self._min_frequency += 1
+
+            key = next(iter(self._buckets[self._min_frequency]))
+            del self[key]
+            self.evictions += 1
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            super(LFUFitnessCache, self).__delitem__(key)
+            frequency = self._frequency.pop(key)
+            bucket = self._buckets[frequency]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[frequency]
+
+    def clear(self) -> None:
+        with self._lock:
+            super(LFUFitnessCache, self).clear()
+            self._frequency.clear()
+            self._buckets.clear()
+            self._min_frequency = 0
+
+
+class TTLFitnessCache(FitnessCache):
+    """Entries expire `ttl_generations` generations after they were inserted.
+
+    Attributes:
+        ttl_generations: Number of generations an entry is kept
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        track_new_entries: bool = False,
+        ttl_generations: int = 1,
+    ) -> None:
+        super(TTLFitnessCache, self).__init__(max_entries, max_bytes, track_new_entries)
+        assert ttl_generations > 0
+        self.ttl_generations = ttl_generations
+        # Insertion generation of the entries, in insertion order
+        self._inserted: Dict[Hashable, int] = {}
+
+    def inserted(self, key: Hashable) -> None:
+        self._inserted[key] = self.generation
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            super(TTLFitnessCache, self).__delitem__(key)
+            del self._inserted[key]
+
+    def new_generation(self, generation: int) -> None:
+        with self._lock:
+            super(TTLFitnessCache, self).new_generation(generation)
+            # Entries are in insertion order, so the oldest are first
+            while self._data:
+                key = next(iter(self._data))
+                if generation - self._inserted[key] < self.ttl_generations:
+                    break
+
+                del self[key]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            super(TTLFitnessCache, self).clear()
+            self._inserted.clear()
+
+
+CACHE_POLICIES: Dict[str, Any] = {
+    "fifo": FitnessCache,
+    "lru": LRUFitnessCache,
+    "lfu": LFUFitnessCache,
+    "ttl": TTLFitnessCache,
+}
+
+
+def get_fitness_cache(
+    settings: Dict[str, Any],
+    track_new_entries: bool = False,
+    namespace: str = "",
+    read_only: bool = False,
+) -> FitnessCache:
+    """Returns a fitness cache from the `fitness_cache` settings.
+
+    The settings are `policy` (fifo, lru, lfu or ttl, default lru),
+    `max_entries`, `max_bytes` and, for ttl, `ttl_generations`. With
+    `persistent` set to an SQLite file name the cache is backed by a
+    `SQLiteFitnessStore`, `flush_size` sets its write buffer size.
+
+    :param settings: Cache settings
+    :type settings: dict
+    :param track_new_entries: Remember inserted keys
+    :type track_new_entries: bool
+    :param namespace: Namespace of the keys in the persistent store
+    :type namespace: str
+    :param read_only: Do not write to the persistent store
+    :type read_only: bool
+    :return: Fitness cache
+    :rtype: FitnessCache
+    """
+    policy = settings.get("policy", "lru")
+    assert policy in CACHE_POLICIES, "Unknown cache policy {}".format(policy)
+    kwargs: Dict[str, Any] = {
+        "max_entries": settings.get("max_entries", 0),
+        "max_bytes": settings.get("max_bytes", 0),
+        "track_new_entries": track_new_entries,
+    }
+    if policy == "ttl":
+        kwargs["ttl_generations"] = settings.get("ttl_generations", 1)
+
+    cache: FitnessCache = CACHE_POLICIES[policy](**kwargs)
+    if settings.get("persistent"):
+        cache.store = SQLiteFitnessStore(
+            settings["persistent"], namespace, settings.get("flush_size", 100), read_only
+        )
+
+    return cache
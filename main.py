@@ -4,7 +4,13 @@ from typing import Any, Dict, List
 
 import yaml
 
-from heuristics import donkey_ge, donkey_ge_coev
+from heuristics import (
+    donkey_ge,
+    donkey_ge_coev,
+    donkey_ge_exhaustive,
+    donkey_ge_island,
+    donkey_ge_steady_state,
+)
 
 
 __author__ = "Erik Hemberg"
@@ -61,6 +67,12 @@ def main(args: List[str]) -> Dict[str, Any]:
     # Run heuristic search
     if args["coev"]:
         donkey_ge_coev.run(args)
+    elif args.get("island"):
+        donkey_ge_island.run(args)
+    elif args.get("steady_state"):
+        donkey_ge_steady_state.run(args)
+    elif args.get("exhaustive"):
+        donkey_ge_exhaustive.run(args)
     else:
         donkey_ge.run(args)
 
@@ -0,0 +1,585 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+from typing import Any, Dict, List
+
+import numpy as np
+
+from heuristics import donkey_ge
+from tests.test_grammar import RECURSIVE_BNF
+
+ZONA_FRANCA_CONFIGURATION: Dict[str, Any] = {
+    "population_size": 10,
+    "max_length": 5,
+    "elite_size": 1,
+    "generations": 3,
+    "tournament_size": 2,
+    "seed": 1,
+    "crossover_probability": 0.8,
+    "mutation_probability": 0.1,
+    "integer_input_element_max": 1000,
+    "bnf_grammar": "tests/grammars/zona_franca/zona_franca_simple_first_example.bnf",
+    "fitness_function": {"name": "fitness.fitness.SimpleSum"},
+    "output_dir": os.path.join(tempfile.gettempdir(), "donkey_ge_test"),
+}
+
+
+class PhenotypeLength(donkey_ge.FitnessFunction):
+    """Fitness function for any grammar."""
+
+    def __init__(self, param: Dict[str, Any]) -> None:
+        pass
+
+    def __call__(self, fcn_str: str, cache: Dict[str, float]) -> float:
+        return float(len(fcn_str))
+
+
+def get_param(**kwargs: Any) -> Dict[str, Any]:
+    param = dict(ZONA_FRANCA_CONFIGURATION)
+    param.update(kwargs)
+    return param
+
+
+def get_individuals(n: int, max_length: int, codon_size: int) -> List[donkey_ge.Individual]:
+    donkey_ge.Individual.max_length = max_length
+    donkey_ge.Individual.codon_size = codon_size
+    individuals = donkey_ge.initialise_population(n)
+    for individual in individuals:
+        individual.used_input = random.randint(1, max_length)
+        individual.fitness = random.random()
+
+    return individuals
+
+
+class TestGenomeMatrix(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(1)
+        self.rng = np.random.default_rng(1)
+
+    def test_from_and_to_individuals(self) -> None:
+        individuals = get_individuals(5, 7, 20)
+        individuals[0].genome = individuals[0].genome[:3]
+        matrix = donkey_ge.GenomeMatrix.from_individuals(individuals)
+        self.assertEqual(matrix.genomes.shape, (5, 7))
+        self.assertEqual(matrix.lengths.tolist(), [3, 7, 7, 7, 7])
+        self.assertEqual(matrix.used_input.tolist(), [_.used_input for _ in individuals])
+        for individual, _individual in zip(individuals, matrix.to_individuals()):
+            self.assertIsInstance(_individual.genome, list)
+            self.assertEqual(individual.genome, _individual.genome)
+            self.assertEqual(_individual.fitness, donkey_ge.DEFAULT_FITNESS)
+
+    def test_random(self) -> None:
+        donkey_ge.Individual.max_length = 6
+        donkey_ge.Individual.codon_size = 3
+        matrix = donkey_ge.GenomeMatrix.random(100, self.rng)
+        self.assertEqual(matrix.genomes.shape, (100, 6))
+        self.assertTrue(np.all((matrix.genomes >= 0) & (matrix.genomes <= 3)))
+
+    def test_batch_onepoint_crossover(self) -> None:
+        individuals = get_individuals(6, 8, 1000)
+        matrix = donkey_ge.GenomeMatrix.from_individuals(individuals)
+        pairs = np.array([[0, 1], [2, 3], [4, 5]])
+        children = donkey_ge.batch_onepoint_crossover(matrix, pairs, 1.0, self.rng)
+        self.assertEqual(len(children), 6)
+        for i, (p_0, p_1) in enumerate(pairs.tolist()):
+            c_0 = children.genomes[2 * i, : children.lengths[2 * i]].tolist()
+            c_1 = children.genomes[2 * i + 1, : children.lengths[2 * i + 1]].tolist()
+            g_0, g_1 = individuals[p_0].genome, individuals[p_1].genome
+            # Some crossover point within the used codons gives the children
+            matches = [
+                (pt_0, pt_1)
+                for pt_0 in range(1, individuals[p_0].used_input + 1)
+                for pt_1 in range(1, individuals[p_1].used_input + 1)
+                if c_0 == g_0[:pt_0] + g_1[pt_1:] and c_1 == g_1[:pt_1] + g_0[pt_0:]
+            ]
+            self.assertTrue(matches)
+
+    def test_batch_onepoint_crossover_no_crossover(self) -> None:
+        individuals = get_individuals(2, 8, 1000)
+        matrix = donkey_ge.GenomeMatrix.from_individuals(individuals)
+        children = donkey_ge.batch_onepoint_crossover(matrix, np.array([[1, 0]]), 0.0, self.rng)
+        self.assertEqual(children.genomes.tolist(), [individuals[1].genome, individuals[0].genome])
+
+    def test_batch_int_flip_mutation(self) -> None:
+        individuals = get_individuals(50, 10, 5)
+        individuals[0].genome = individuals[0].genome[:4]
+        matrix = donkey_ge.GenomeMatrix.from_individuals(individuals)
+        original = matrix.genomes.copy()
+        donkey_ge.batch_int_flip_mutation(matrix, 0.0, self.rng)
+        self.assertTrue(np.array_equal(matrix.genomes, original))
+        donkey_ge.batch_int_flip_mutation(matrix, 1.0, self.rng)
+        # Padding is never mutated
+        self.assertEqual(matrix.genomes[0, 4:].tolist(), [0] * 6)
+        self.assertTrue(np.all(matrix.fitness == donkey_ge.DEFAULT_FITNESS))
+        self.assertTrue(np.all(matrix.genomes <= 5))
+
+    def test_variation_vectorized(self) -> None:
+        parents = get_individuals(7, 10, 100)
+        param = get_param(population_size=7)
+        new_individuals = donkey_ge.variation_vectorized(parents, param, self.rng)
+        self.assertEqual(len(new_individuals), 7)
+        for individual in new_individuals:
+            self.assertNotIn(individual, parents)
+            self.assertEqual(individual.used_input, 0)
+
+    def test_run_vectorized(self) -> None:
+        best = donkey_ge.run(get_param(vectorized=True))
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        # Reproducible from the seed
+        self.assertEqual(str(best), str(donkey_ge.run(get_param(vectorized=True))))
+
+
+class TestDirtyTracking(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(4)
+        self.grammar = donkey_ge.Grammar(ZONA_FRANCA_CONFIGURATION["bnf_grammar"])
+        self.grammar.read_bnf_file(self.grammar.file_name)
+        self.fitness_function = donkey_ge.get_fitness_function(
+            ZONA_FRANCA_CONFIGURATION["fitness_function"]
+        )
+        donkey_ge.Individual.max_length = 10
+        donkey_ge.Individual.codon_size = 100
+        self.individual = donkey_ge.Individual(None)
+        donkey_ge.evaluate_fitness(
+            [self.individual], self.grammar, self.fitness_function, {"cache": {}}
+        )
+
+    def test_evaluated_individual_is_clean(self) -> None:
+        self.assertFalse(self.individual.dirty)
+        self.assertEqual(self.individual.used_input, 3)
+
+    def test_mutation_in_unused_tail(self) -> None:
+        # Mutate all codons after the used inputs
+        genome = self.individual.genome
+        genome[3:] = [-1] * 7
+        self.individual.genome = genome
+        phenotype = self.individual.phenotype
+        donkey_ge.int_flip_mutation(self.individual, 0.0)
+        self.assertFalse(self.individual.dirty)
+        self.assertEqual(self.individual.phenotype, phenotype)
+        copy = donkey_ge.Individual(self.individual.genome[:])
+        donkey_ge.map_input_with_grammar(copy, self.grammar)
+        self.assertEqual(copy.phenotype, phenotype)
+
+    def test_mutation_in_used_codons(self) -> None:
+        donkey_ge.int_flip_mutation(self.individual, 1.0)
+        self.assertTrue(self.individual.dirty)
+        self.assertEqual(self.individual.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        self.assertEqual(self.individual.fitness, donkey_ge.DEFAULT_FITNESS)
+
+    def test_no_crossover_keeps_phenotype(self) -> None:
+        children = donkey_ge.onepoint_crossover(self.individual, self.individual, 0.0)
+        for child in children:
+            self.assertFalse(child.dirty)
+            self.assertEqual(child.phenotype, self.individual.phenotype)
+            self.assertEqual(child.fitness, self.individual.fitness)
+            self.assertIsNot(child.genome, self.individual.genome)
+
+    def test_clean_individuals_are_not_evaluated(self) -> None:
+        cache = donkey_ge.get_fitness_cache({})
+        donkey_ge.evaluate_fitness(
+            [self.individual], self.grammar, self.fitness_function, {"cache": cache}
+        )
+        self.assertEqual(cache.hits + cache.misses, 0)
+
+    def test_run_without_mapping_cache(self) -> None:
+        self.assertEqual(
+            str(donkey_ge.run(get_param())), str(donkey_ge.run(get_param(mapping_cache_size=0)))
+        )
+
+    def test_run_with_incremental_mapping(self) -> None:
+        self.assertEqual(
+            str(donkey_ge.run(get_param())), str(donkey_ge.run(get_param(incremental_mapping=True)))
+        )
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(8)
+        self.individual = get_individuals(1, 10, 100)[0]
+
+    def test_copy_shares_genome(self) -> None:
+        copy = self.individual.copy()
+        self.assertIs(copy.codons, self.individual.codons)
+        donkey_ge.int_flip_mutation(copy, 0.0)
+        self.assertIs(copy.codons, self.individual.codons)
+
+    def test_write_copies_genome(self) -> None:
+        genome = self.individual.codons[:]
+        copy = self.individual.copy()
+        donkey_ge.int_flip_mutation(copy, 1.0)
+        self.assertIsNot(copy.codons, self.individual.codons)
+        self.assertEqual(self.individual.codons, genome)
+        copy.genome[0] = -1
+        self.assertEqual(self.individual.genome, genome)
+
+    def test_slots(self) -> None:
+        with self.assertRaises(AttributeError):
+            self.individual.other = 1
+
+
+class TestParallelEvaluator(unittest.TestCase):
+    def setUp(self) -> None:
+        self.grammar = donkey_ge.Grammar(ZONA_FRANCA_CONFIGURATION["bnf_grammar"])
+        self.grammar.read_bnf_file(self.grammar.file_name)
+        self.fitness_function = donkey_ge.get_fitness_function(
+            ZONA_FRANCA_CONFIGURATION["fitness_function"]
+        )
+
+    def evaluate(self, settings: Dict[str, Any]) -> List[donkey_ge.Individual]:
+        random.seed(2)
+        # Short genomes are invalid and are remapped with new genomes
+        individuals = get_individuals(50, 5, 100)
+        for individual in individuals[::5]:
+            individual.genome = individual.genome[:2]
+        evaluator = donkey_ge.ParallelEvaluator(
+            settings,
+            self.grammar,
+            self.fitness_function,
+            ZONA_FRANCA_CONFIGURATION["fitness_function"],
+        )
+        cache: Dict[str, float] = {}
+        evaluator.evaluate(individuals, cache)
+        evaluator.shutdown()
+        for individual in individuals:
+            self.assertEqual(cache[individual.phenotype], individual.fitness)
+
+        return individuals
+
+    def test_backends_give_same_results(self) -> None:
+        expected = self.evaluate({"backend": "serial"})
+        for settings in (
+            {"backend": "process", "workers": 2},
+            {"backend": "process", "workers": 3, "chunk_size": 7},
+            {"backend": "thread", "workers": 2, "chunk_size": 1},
+        ):
+            individuals = self.evaluate(settings)
+            for individual, _individual in zip(individuals, expected):
+                self.assertEqual(individual.genome, _individual.genome)
+                self.assertEqual(individual.phenotype, _individual.phenotype)
+                self.assertEqual(individual.used_input, _individual.used_input)
+                self.assertEqual(individual.fitness, _individual.fitness)
+
+    def test_same_as_evaluate_fitness(self) -> None:
+        random.seed(3)
+        individuals = get_individuals(20, 5, 100)
+        genomes = [individual.genome[:] for individual in individuals]
+        evaluator = donkey_ge.ParallelEvaluator(
+            {"backend": "process", "workers": 2},
+            self.grammar,
+            self.fitness_function,
+            ZONA_FRANCA_CONFIGURATION["fitness_function"],
+        )
+        donkey_ge.evaluate_fitness(
+            individuals, self.grammar, self.fitness_function, {"cache": {}}, evaluator
+        )
+        evaluator.shutdown()
+        for individual, genome in zip(individuals, genomes):
+            _individual = donkey_ge.Individual(genome)
+            donkey_ge.map_input_with_grammar(_individual, self.grammar)
+            self.assertEqual(individual.phenotype, _individual.phenotype)
+            self.assertEqual(individual.used_input, _individual.used_input)
+
+    def test_threads_share_mapping_cache(self) -> None:
+        param = get_param(
+            population_size=40,
+            generations=10,
+            mutation_probability=0.5,
+            integer_input_element_max=10,
+            mapping_cache_size=3,
+            parallel={"workers": 8, "backend": "thread", "chunk_size": 1},
+        )
+        random.seed(param["seed"])
+        population = donkey_ge.create_population(param)
+        best = donkey_ge.search_loop(population, param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        mapping_cache = population.grammar.mapping_cache
+        # Entries were evicted
+        self.assertEqual(len(mapping_cache), 3)
+        self.assertGreater(mapping_cache.misses, 3)
+
+    def test_shutdown_when_search_fails(self) -> None:
+        param = get_param(parallel={"workers": 2, "backend": "process"})
+        shutdown = mock.patch.object(donkey_ge.ParallelEvaluator, "shutdown", autospec=True)
+        close = mock.patch.object(donkey_ge.FitnessCache, "close", autospec=True)
+        with mock.patch.object(donkey_ge, "evolve_generation", side_effect=RuntimeError):
+            with shutdown as _shutdown, close as _close, self.assertRaises(RuntimeError):
+                donkey_ge.run(param)
+
+        self.assertEqual(_shutdown.call_count, 1)
+        self.assertEqual(_close.call_count, 1)
+        # Stop the workers of the failed search
+        _shutdown.call_args[0][0].shutdown()
+
+    def test_run_parallel(self) -> None:
+        param = get_param(parallel={"workers": 2, "backend": "process"})
+        best = donkey_ge.run(param)
+        self.assertEqual(
+            str(best), str(donkey_ge.run(get_param(parallel={"workers": 1, "backend": "thread"})))
+        )
+
+
+class TestSelectionAndReplacement(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(6)
+        self.rng = np.random.default_rng(6)
+        self.individuals = get_individuals(30, 5, 100)
+        # Ties are broken by position
+        for individual in self.individuals[::3]:
+            individual.fitness = 0.5
+
+    def test_tournament_selection_same_as_sorting(self) -> None:
+        random.seed(7)
+        winners = donkey_ge.tournament_selection(self.individuals, 20, 4)
+        random.seed(7)
+        for winner in winners:
+            competitors = random.sample(self.individuals, 4)
+            self.assertIs(winner, donkey_ge.sort_population(competitors)[0])
+
+    def test_batch_tournament_selection(self) -> None:
+        winners = donkey_ge.batch_tournament_selection(self.individuals, 50, 3, self.rng)
+        self.assertEqual(len(winners), 50)
+        # The worst individuals only win against themselves
+        worst = donkey_ge.sort_population(self.individuals)[-1]
+        n_wins = sum(winner is worst for winner in winners)
+        self.assertLess(n_wins, 5)
+        winners = donkey_ge.batch_tournament_selection(self.individuals, 50, 1, self.rng)
+        self.assertTrue(all(winner in self.individuals for winner in winners))
+
+    def test_array_generational_replacement(self) -> None:
+        new_individuals = get_individuals(30, 5, 100)
+        # Some of the individuals with tied fitness are elites
+        for elite_size in (0, 1, 7, 15):
+            expected = donkey_ge.generational_replacement(
+                new_individuals[:], self.individuals, elite_size, 30
+            )
+            individuals = donkey_ge.array_generational_replacement(
+                new_individuals[:], self.individuals, elite_size, 30
+            )
+            self.assertEqual([_.fitness for _ in individuals], [_.fitness for _ in expected])
+            self.assertEqual([_.genome for _ in individuals], [_.genome for _ in expected])
+
+    def test_run_with_array_operators(self) -> None:
+        param = get_param(selection="batch_tournament", replacement="array_generational")
+        best = donkey_ge.run(param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        self.assertEqual(str(best), str(donkey_ge.run(dict(param))))
+        self.assertEqual(
+            str(donkey_ge.run(get_param())),
+            str(donkey_ge.run(get_param(replacement="array_generational"))),
+        )
+
+    def test_one_sort_per_generation(self) -> None:
+        param = get_param(generations=5)
+        random.seed(param["seed"])
+        population = donkey_ge.create_population(param)
+        sort_population = mock.patch.object(
+            donkey_ge, "sort_population", wraps=donkey_ge.sort_population
+        )
+        with sort_population as _sort_population:
+            donkey_ge.search_loop(population, param)
+
+        self.assertEqual(_sort_population.call_count, param["generations"])
+
+
+class TestSensibleInitialisation(unittest.TestCase):
+    def test_no_remaps(self) -> None:
+        random.seed(2)
+        grammar = donkey_ge.Grammar("")
+        grammar.parse_bnf_string(RECURSIVE_BNF)
+        donkey_ge.Individual.max_length = 4
+        donkey_ge.Individual.codon_size = 100
+        individuals = donkey_ge.initialise_population_sensible(20, grammar, 4)
+        for individual in individuals:
+            donkey_ge.map_input_with_grammar(individual, grammar)
+            self.assertEqual(individual.remaps, 0)
+            self.assertGreaterEqual(len(individual.codons), 4)
+
+        # Grown and full trees of each depth
+        self.assertGreater(len({_.phenotype for _ in individuals}), 10)
+
+    def test_run_reports_remaps(self) -> None:
+        param = get_param(initialisation="sensible", max_depth=3)
+        best = donkey_ge.run(param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        file_name = os.path.join(param["output_dir"], "donkey_ge_remap_values.json")
+        with open(file_name, "r") as in_file:
+            remap_values = json.load(in_file)["remap_values"]
+        self.assertEqual(len(remap_values), param["generations"])
+        self.assertEqual(remap_values[0], [0] * param["population_size"])
+
+
+class TestSeedPhenotypes(unittest.TestCase):
+    def test_seeded_individuals(self) -> None:
+        random.seed(3)
+        phenotypes = ['["NCT", "NCT", "NCT"]', '["FTZ", "NCT", "FTZ"]']
+        population = donkey_ge.create_population(get_param(seed_phenotypes=phenotypes))
+        self.assertEqual(len(population.individuals), ZONA_FRANCA_CONFIGURATION["population_size"])
+        for individual, phenotype in zip(population.individuals, phenotypes):
+            self.assertEqual(len(individual.genome), ZONA_FRANCA_CONFIGURATION["max_length"])
+            donkey_ge.map_input_with_grammar(individual, population.grammar)
+            self.assertEqual(individual.phenotype, phenotype)
+            self.assertEqual(individual.remaps, 0)
+
+
+class TestSubtreeVariation(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(4)
+        self.grammar = donkey_ge.Grammar("")
+        self.grammar.parse_bnf_string(RECURSIVE_BNF)
+        donkey_ge.Individual.max_length = 10
+        donkey_ge.Individual.codon_size = 100
+        self.individuals = donkey_ge.initialise_population_sensible(20, self.grammar, 5)
+        for individual in self.individuals:
+            donkey_ge.map_input_with_grammar(individual, self.grammar)
+
+    def test_children_are_valid(self) -> None:
+        for _ in range(200):
+            parents = random.sample(self.individuals, 2)
+            children = donkey_ge.subtree_crossover(parents[0], parents[1], 1.0, self.grammar, 7)
+            for child in children:
+                child = donkey_ge.subtree_mutation(child, 1.0, self.grammar, 7)
+                donkey_ge.map_input_with_grammar(child, self.grammar)
+                self.assertEqual(child.remaps, 0)
+                tree = donkey_ge.get_derivation_tree(child, self.grammar)
+                self.assertLessEqual(
+                    tree.heights[0],
+                    max(7, *[_.tree.heights[0] for _ in parents if _.tree is not None]),
+                )
+
+    def test_crossover_keeps_rest_of_tree(self) -> None:
+        # Swapping a <choice> only changes one choice, swapping the roots changes all
+        grammar = donkey_ge.Grammar("")
+        grammar.read_bnf_file(ZONA_FRANCA_CONFIGURATION["bnf_grammar"])
+        donkey_ge.Individual.max_length = 5
+        donkey_ge.Individual.codon_size = 100
+        parents = [donkey_ge.Individual([0, 0, 0, 0]), donkey_ge.Individual([1, 1, 1, 0])]
+        for parent in parents:
+            donkey_ge.map_input_with_grammar(parent, grammar)
+
+        for _ in range(20):
+            children = donkey_ge.subtree_crossover(parents[0], parents[1], 1.0, grammar, 10)
+            for child, parent in zip(children, parents):
+                donkey_ge.map_input_with_grammar(child, grammar)
+                changed = [_0 != _1 for _0, _1 in zip(child.codons[:3], parent.codons[:3])]
+                self.assertIn(sum(changed), (1, 3))
+
+    def assert_tree_of_genome(self, individual: donkey_ge.Individual) -> None:
+        tree = donkey_ge.get_derivation_tree(individual, self.grammar)
+        _tree = self.grammar.derive_tree(individual.codons)[3]
+        for attribute in donkey_ge.DerivationTree.__slots__:
+            self.assertEqual(getattr(tree, attribute), getattr(_tree, attribute))
+
+    def test_trees_of_cached_mappings(self) -> None:
+        self.grammar.trees = True
+        self.grammar.mapping_cache = donkey_ge.MappingCache()
+        for _ in range(100):
+            parents = random.sample(self.individuals, 2)
+            for child in donkey_ge.subtree_crossover(parents[0], parents[1], 1.0, self.grammar, 7):
+                for individual in (child, child.copy()):
+                    individual = donkey_ge.subtree_mutation(individual, 0.5, self.grammar, 7)
+                    # A tree of another genome
+                    individual.tree = random.choice(self.individuals).tree
+                    donkey_ge.map_input_with_grammar(individual, self.grammar)
+                    self.assert_tree_of_genome(individual)
+
+        self.assertGreater(self.grammar.mapping_cache.hits, 0)
+
+    def test_trees_of_worker_mappings(self) -> None:
+        self.grammar.trees = True
+        fitness_function_param = {"name": "tests.test_donkey_ge.PhenotypeLength"}
+        evaluator = donkey_ge.ParallelEvaluator(
+            {"backend": "process", "workers": 2},
+            self.grammar,
+            PhenotypeLength(fitness_function_param),
+            fitness_function_param,
+        )
+        children = []
+        for _ in range(20):
+            parents = random.sample(self.individuals, 2)
+            children.extend(
+                donkey_ge.subtree_crossover(parents[0], parents[1], 1.0, self.grammar, 7)
+            )
+
+        # Children with the trees of other genomes
+        for child in children:
+            child.tree = donkey_ge.get_derivation_tree(
+                random.choice(self.individuals), self.grammar
+            )
+        # Short genomes are remapped with new genomes
+        for child in children[::5]:
+            child.genome = child.genome[:1]
+        evaluator.evaluate(children, {})
+        evaluator.shutdown()
+        for child in children:
+            self.assert_tree_of_genome(child)
+
+    def test_run(self) -> None:
+        best = donkey_ge.run(get_param(variation="subtree"))
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        best = donkey_ge.run(
+            get_param(variation="subtree", parallel={"workers": 2, "backend": "process"})
+        )
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+
+
+class TestStructuredGenomes(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(5)
+        self.grammar = donkey_ge.Grammar("")
+        self.grammar.parse_bnf_string(RECURSIVE_BNF)
+        self.grammar.sge_max_depth = 5
+        donkey_ge.Individual.max_length = 10
+        donkey_ge.Individual.codon_size = 100
+        self.individuals = donkey_ge.initialise_population_sge(20, self.grammar, 5)
+        for individual in self.individuals:
+            donkey_ge.map_input_with_grammar(individual, self.grammar)
+            individual.dirty = False
+
+    def test_mutation(self) -> None:
+        genomes = [json.dumps(_.codons) for _ in self.individuals]
+        for individual in self.individuals:
+            child = donkey_ge.sge_mutation(individual.copy(), 1.0, self.grammar)
+            for genes, _genes, arity in zip(
+                individual.codons, child.codons, self.grammar.rule_arity
+            ):
+                self.assertEqual(len(genes), len(_genes))
+                if arity > 1:
+                    self.assertTrue(all(_0 != _1 for _0, _1 in zip(genes, _genes)))
+
+        # Gene lists shared by copies are not changed
+        self.assertEqual([json.dumps(_.codons) for _ in self.individuals], genomes)
+
+    def test_unused_genes(self) -> None:
+        for individual in self.individuals:
+            # Add genes after the used genes
+            individual.genome = [_ + [0] * 5 for _ in individual.codons]
+            used_genes = self.grammar.derive_sge(individual.codons, 5)[1]
+            child = donkey_ge.sge_mutation(individual.copy(), 0.2, self.grammar)
+            changed = any(
+                genes[:n_used] != _genes[:n_used]
+                for genes, _genes, n_used in zip(individual.codons, child.codons, used_genes)
+            )
+            self.assertEqual(child.dirty, changed)
+            if not changed:
+                self.assertEqual(child.phenotype, individual.phenotype)
+
+    def test_crossover(self) -> None:
+        parents = self.individuals[:2]
+        for child in donkey_ge.sge_crossover(parents[0], parents[1], 1.0):
+            for genes, genes_0, genes_1 in zip(child.codons, *[_.codons for _ in parents]):
+                self.assertTrue(genes is genes_0 or genes is genes_1)
+            donkey_ge.map_input_with_grammar(child, self.grammar)
+            self.assertNotEqual(child.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+
+    def test_run(self) -> None:
+        param = get_param(representation="sge", seed_phenotypes=['["NCT", "FTZ", "NCT"]'])
+        best = donkey_ge.run(param)
+        self.assertEqual(best.phenotype, '["FTZ", "FTZ", "FTZ"]')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fitness.fitness import SimpleSumGame
+from heuristics import donkey_ge, donkey_ge_coev
+
+ZONA_FRANCA_GRAMMAR = "tests/grammars/zona_franca/zona_franca_simple_first_example.bnf"
+
+
+def get_coev_param(**kwargs: Any) -> Dict[str, Any]:
+    param: Dict[str, Any] = {
+        "population_size": 8,
+        "max_length": 6,
+        "elite_size": 1,
+        "generations": 3,
+        "tournament_size": 2,
+        "seed": 3,
+        "crossover_probability": 0.8,
+        "mutation_probability": 0.1,
+        "integer_input_element_max": 100,
+        "output_dir": os.path.join(tempfile.gettempdir(), "donkey_ge_test"),
+        "populations": {
+            "attacker": {
+                "adversary": "defender",
+                "bnf_grammar": ZONA_FRANCA_GRAMMAR,
+                "fitness_function": {"name": "fitness.fitness.SimpleSumGame"},
+            },
+            "defender": {
+                "adversary": "attacker",
+                "bnf_grammar": ZONA_FRANCA_GRAMMAR,
+                "fitness_function": {"name": "fitness.fitness.SimpleSumGame"},
+            },
+        },
+    }
+    param.update(kwargs)
+    return param
+
+
+class CountingSimpleSumGame(SimpleSumGame):
+    def __init__(self, param: Dict[str, Any]) -> None:
+        super().__init__(param)
+        self.n_payoffs = 0
+
+    def coev_matrix(
+        self, phenotypes: Sequence[str], adversary_phenotypes: Sequence[str]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        self.n_payoffs += len(phenotypes) * len(adversary_phenotypes)
+        return super().coev_matrix(phenotypes, adversary_phenotypes)
+
+
+class CountingCoev(object):
+    """Fitness function with only the per individual `coev`."""
+
+    def __init__(self) -> None:
+        self.simple_sum_game = SimpleSumGame({})
+        self.n_calls = 0
+        self.n_adversaries = 0
+
+    def coev(
+        self, fcn_str: str, inds: List[donkey_ge.Individual], cache: Dict[str, float]
+    ) -> float:
+        self.n_calls += 1
+        self.n_adversaries += len(inds)
+        return self.simple_sum_game.coev(fcn_str, inds, cache)
+
+
+class TestPayoffMatrix(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(1)
+        self.grammar = donkey_ge.Grammar(ZONA_FRANCA_GRAMMAR)
+        self.grammar.read_bnf_file(self.grammar.file_name)
+        donkey_ge.Individual.max_length = 6
+        donkey_ge.Individual.codon_size = 100
+        self.attackers = donkey_ge.initialise_population(20)
+        self.defenders = donkey_ge.initialise_population(20)
+        for ind in self.defenders:
+            donkey_ge.map_input_with_grammar(ind, self.grammar)
+
+    def evaluate(
+        self, fitness_function: SimpleSumGame, param: Dict[str, Any]
+    ) -> List[donkey_ge.Individual]:
+        return donkey_ge_coev.evaluate_fitness_matrix(
+            self.attackers, self.grammar, fitness_function, self.defenders, param, "a", "d"
+        )
+
+    def test_same_as_coev(self) -> None:
+        fitness_function = SimpleSumGame({})
+        individuals = self.evaluate(fitness_function, {"cache": {}})
+        for ind in individuals:
+            expected = np.mean(
+                [
+                    fitness_function(ind.phenotype, {}) - fitness_function(_.phenotype, {})
+                    for _ in self.defenders
+                ]
+            )
+            self.assertAlmostEqual(ind.fitness, expected)
+            self.assertAlmostEqual(
+                ind.fitness, fitness_function.coev(ind.phenotype, self.defenders, {})
+            )
+
+    def test_unique_phenotypes_and_cached_pairs(self) -> None:
+        fitness_function = CountingSimpleSumGame({})
+        cache = donkey_ge.get_fitness_cache({})
+        self.evaluate(fitness_function, {"cache": cache})
+        n_attackers = len(set(_.phenotype for _ in self.attackers))
+        n_defenders = len(set(_.phenotype for _ in self.defenders))
+        self.assertLess(n_attackers * n_defenders, 20 * 20)
+        self.assertEqual(fitness_function.n_payoffs, n_attackers * n_defenders)
+        # The same matrix serves the adversary population
+        defenders = donkey_ge_coev.evaluate_fitness_matrix(
+            self.defenders,
+            self.grammar,
+            fitness_function,
+            self.attackers,
+            {"cache": cache},
+            "d",
+            "a",
+        )
+        self.assertEqual(fitness_function.n_payoffs, n_attackers * n_defenders)
+        for ind in defenders:
+            self.assertAlmostEqual(
+                ind.fitness, fitness_function.coev(ind.phenotype, self.attackers, {})
+            )
+
+    def test_coev_evaluates_unique_phenotypes(self) -> None:
+        fitness_function = CountingCoev()
+        individuals = donkey_ge_coev.evaluate_fitness(
+            self.attackers, self.grammar, fitness_function, self.defenders, {"cache": {}}
+        )
+        # Each unique phenotype plays each unique adversary once
+        phenotypes = set(_.phenotype for _ in individuals)
+        adversary_phenotypes = set(_.phenotype for _ in self.defenders)
+        self.assertLess(len(adversary_phenotypes), len(self.defenders))
+        self.assertEqual(fitness_function.n_calls, len(phenotypes) * len(adversary_phenotypes))
+        self.assertEqual(fitness_function.n_adversaries, fitness_function.n_calls)
+        expected = self.evaluate(SimpleSumGame({}), {"cache": {}})
+        self.assertEqual([_.fitness for _ in individuals], [_.fitness for _ in expected])
+
+    def test_phenotype_counts(self) -> None:
+        phenotypes, counts = donkey_ge_coev.get_phenotype_counts(self.defenders)
+        self.assertEqual(len(phenotypes), len(set(phenotypes)))
+        self.assertEqual(counts.sum(), len(self.defenders))
+        self.assertEqual(
+            counts.tolist(), [sum(_.phenotype == p for _ in self.defenders) for p in phenotypes]
+        )
+
+    def test_map_individuals_once(self) -> None:
+        population = donkey_ge_coev.CoevPopulation(
+            SimpleSumGame({}), self.grammar, "d", "a", self.attackers
+        )
+        self.assertEqual(population.map_individuals(), 20)
+        self.assertEqual(population.map_individuals(), 0)
+        donkey_ge.int_flip_mutation(population.individuals[0], 1.0)
+        self.assertEqual(population.map_individuals(), 1)
+
+    def test_run_maps_changed_individuals(self) -> None:
+        param = get_coev_param(generations=4)
+        with mock.patch.object(
+            donkey_ge_coev,
+            "map_input_with_grammar",
+            wraps=donkey_ge_coev.map_input_with_grammar,
+        ) as map_input_with_grammar:
+            donkey_ge_coev.run(param)
+
+        # At most the initial populations and the new individuals of each generation
+        n_individuals = 2 * param["population_size"]
+        self.assertLessEqual(
+            map_input_with_grammar.call_count, n_individuals * param["generations"]
+        )
+
+    def test_run(self) -> None:
+        best = donkey_ge_coev.run(get_coev_param())
+        self.assertEqual(
+            {k: str(v) for k, v in best.items()},
+            {k: str(v) for k, v in donkey_ge_coev.run(get_coev_param()).items()},
+        )
+
+    def test_run_subtree(self) -> None:
+        best = donkey_ge_coev.run(get_coev_param(variation="subtree"))
+        for individual in best.values():
+            self.assertNotEqual(individual.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+
+    def test_run_sge(self) -> None:
+        param = get_coev_param(representation="sge")
+        best = donkey_ge_coev.run(param)
+        for individual in best.values():
+            self.assertNotEqual(individual.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+            # One list of genes per non-terminal
+            self.assertTrue(all(isinstance(genes, list) for genes in individual.genome))
+
+
+class TestOpponents(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(2)
+        grammar = donkey_ge.Grammar(ZONA_FRANCA_GRAMMAR)
+        grammar.read_bnf_file(grammar.file_name)
+        donkey_ge.Individual.max_length = 6
+        donkey_ge.Individual.codon_size = 100
+        individuals = donkey_ge.initialise_population(10)
+        for i, ind in enumerate(individuals):
+            ind.fitness = float(i)
+        self.adversary = donkey_ge_coev.CoevPopulation(
+            SimpleSumGame({}), grammar, "a", "d", individuals
+        )
+        self.adversary.map_individuals()
+
+    def test_hall_of_fame(self) -> None:
+        hall_of_fame = donkey_ge_coev.HallOfFame(2)
+        # One individual for each phenotype
+        individuals = list({_.phenotype: _ for _ in self.adversary.individuals}.values())
+        self.assertGreaterEqual(len(individuals), 3)
+        for generation, ind in enumerate(individuals):
+            self.assertTrue(hall_of_fame.update(generation, ind))
+            # Same phenotypes are archived once
+            self.assertFalse(hall_of_fame.update(generation, ind))
+
+        # The oldest individuals are evicted
+        self.assertEqual(len(hall_of_fame), 2)
+        self.assertEqual(
+            [_.phenotype for _ in hall_of_fame.individuals],
+            [_.phenotype for _ in individuals[-2:]],
+        )
+        self.assertFalse(donkey_ge_coev.HallOfFame(0).update(0, individuals[0]))
+
+    def test_get_opponents(self) -> None:
+        self.assertEqual(
+            donkey_ge_coev.get_opponents(self.adversary, {}), self.adversary.individuals
+        )
+        best = donkey_ge_coev.get_opponents(self.adversary, {"sampling": "best", "size": 3})
+        self.assertEqual([_.fitness for _ in best], [9.0, 8.0, 7.0])
+        random.seed(1)
+        opponents = donkey_ge_coev.get_opponents(self.adversary, {"sampling": "random", "size": 4})
+        self.assertEqual(len(opponents), 4)
+        random.seed(1)
+        self.assertEqual(
+            opponents,
+            donkey_ge_coev.get_opponents(self.adversary, {"sampling": "random", "size": 4}),
+        )
+        self.adversary.hall_of_fame = donkey_ge_coev.HallOfFame(3)
+        self.adversary.hall_of_fame.update(0, self.adversary.individuals[0])
+        opponents = donkey_ge_coev.get_opponents(self.adversary, {"sampling": "best", "size": 2})
+        self.assertEqual(len(opponents), 3)
+
+    def test_run_with_hall_of_fame(self) -> None:
+        opponents = {"sampling": "random", "size": 3, "hall_of_fame": 4}
+        param = get_coev_param(opponents=opponents)
+        best = donkey_ge_coev.run(param)
+        self.assertEqual(
+            {k: str(v) for k, v in best.items()},
+            {k: str(v) for k, v in donkey_ge_coev.run(get_coev_param(opponents=opponents)).items()},
+        )
+        for key in param["populations"].keys():
+            file_name = os.path.join(
+                param["output_dir"], "donkey_ge_coev_{}_hall_of_fame.json".format(key)
+            )
+            with open(file_name, "r") as in_file:
+                hall_of_fame = json.load(in_file)["hall_of_fame"]
+
+            self.assertTrue(0 < len(hall_of_fame) <= 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from heuristics import donkey_ge, donkey_ge_exhaustive
+from tests.test_donkey_ge import get_param
+
+
+class TestExhaustive(unittest.TestCase):
+    def test_run(self) -> None:
+        param = get_param(exhaustive={"batch_size": 3})
+        best = donkey_ge_exhaustive.run(param)
+        self.assertEqual(best.phenotype, '["FTZ", "FTZ", "FTZ"]')
+        self.assertEqual(best.fitness, 6)
+        # Every phenotype is evaluated once
+        self.assertEqual(param["cache"].misses, 8)
+        self.assertEqual(param["cache"].hits, 0)
+
+    def test_run_parallel(self) -> None:
+        param = get_param(exhaustive=True, parallel={"workers": 2, "backend": "process"})
+        best = donkey_ge_exhaustive.run(param)
+        self.assertEqual(best.fitness, 6)
+
+    def test_too_large(self) -> None:
+        param = get_param(exhaustive={"max_size": 4})
+        best = donkey_ge_exhaustive.run(param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+
+    def test_not_sge(self) -> None:
+        param = get_param(exhaustive=True, representation="sge")
+        with self.assertRaises(AssertionError):
+            donkey_ge_exhaustive.run(param)
+
+
+if __name__ == "__main__":
+    unittest.main()
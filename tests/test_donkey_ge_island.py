@@ -0,0 +1,73 @@
+import json
+import os
+import random
+import unittest
+
+from heuristics import donkey_ge, donkey_ge_island
+from tests.test_donkey_ge import get_param
+
+
+class TestIsland(unittest.TestCase):
+    def test_topologies(self) -> None:
+        self.assertEqual(donkey_ge_island.get_destinations(3, 4, "ring", 1, 1), [0])
+        self.assertEqual(donkey_ge_island.get_destinations(0, 1, "ring", 1, 1), [])
+        self.assertEqual(donkey_ge_island.get_destinations(1, 3, "fully_connected", 1, 1), [0, 2])
+        for migration in range(10):
+            n_received = 0
+            for island in range(5):
+                destinations = donkey_ge_island.get_destinations(island, 5, "random", 1, migration)
+                self.assertEqual(len(destinations), 1)
+                self.assertNotIn(island, destinations)
+                # The same on all islands
+                self.assertEqual(
+                    destinations,
+                    donkey_ge_island.get_destinations(island, 5, "random", 1, migration),
+                )
+                n_received += len(donkey_ge_island.get_sources(island, 5, "random", 1, migration))
+
+            self.assertEqual(n_received, 5)
+
+    def test_migration(self) -> None:
+        random.seed(1)
+        donkey_ge.Individual.max_length = 3
+        donkey_ge.Individual.codon_size = 10
+        individuals = donkey_ge.initialise_population(5)
+        for i, individual in enumerate(individuals):
+            individual.fitness = float(i)
+
+        emigrants = donkey_ge_island.select_emigrants(
+            donkey_ge.sort_population(individuals), 2, "best"
+        )
+        self.assertEqual([_[3] for _ in emigrants], [4.0, 3.0])
+        emigrants = [([1, 2, 3], "x", 2, 10.0), ([1, 2], "y", 1, 0.5)]
+        individuals = donkey_ge_island.insert_immigrants(individuals, emigrants, "worst")
+        self.assertEqual([_.fitness for _ in individuals], [10.0, 4.0, 3.0, 2.0, 0.5])
+        self.assertFalse(individuals[0].dirty)
+
+    def test_run(self) -> None:
+        settings = {
+            "islands": 3,
+            "topology": "random",
+            "migration_interval": 1,
+            "migration_size": 2,
+        }
+        param = get_param(island=settings, generations=4)
+        best = donkey_ge_island.run(param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        file_name = os.path.join(param["output_dir"], "donkey_ge_fitness_values.json")
+        with open(file_name, "r") as in_file:
+            fitness_values = json.load(in_file)["fitness_values"]
+
+        # Merged stats of all islands for each generation
+        self.assertEqual(len(fitness_values), 4)
+        self.assertEqual(len(fitness_values[0]), 3 * param["population_size"])
+        # Reproducible from the seed
+        self.assertEqual(
+            str(best), str(donkey_ge_island.run(get_param(island=settings, generations=4)))
+        )
+        with open(file_name, "r") as in_file:
+            self.assertEqual(fitness_values, json.load(in_file)["fitness_values"])
+
+
+if __name__ == "__main__":
+    unittest.main()
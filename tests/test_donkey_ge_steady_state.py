@@ -0,0 +1,59 @@
+import unittest
+
+from heuristics import donkey_ge, donkey_ge_steady_state
+from tests.test_donkey_ge import get_param
+
+
+class TestSteadyState(unittest.TestCase):
+    def test_replace_worst(self) -> None:
+        donkey_ge.Individual.max_length = 1
+        individuals = [donkey_ge.Individual([0]) for _ in range(3)]
+        for individual, fitness in zip(individuals, (1.0, 0.0, 2.0)):
+            individual.fitness = fitness
+
+        child = donkey_ge.Individual([1])
+        child.fitness = -1.0
+        self.assertFalse(donkey_ge_steady_state.replace_worst(individuals, child))
+        child.fitness = 0.5
+        self.assertTrue(donkey_ge_steady_state.replace_worst(individuals, child))
+        self.assertEqual([_.fitness for _ in individuals], [1.0, 0.5, 2.0])
+
+    def test_run_serial(self) -> None:
+        param = get_param(steady_state=True)
+        best = donkey_ge_steady_state.run(param)
+        self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+        self.assertEqual(str(best), str(donkey_ge_steady_state.run(get_param(steady_state=True))))
+
+    def test_run_parallel(self) -> None:
+        for backend in ("process", "thread"):
+            param = get_param(
+                steady_state={"max_pending": 3}, parallel={"workers": 2, "backend": backend}
+            )
+            best = donkey_ge_steady_state.run(param)
+            self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+            self.assertGreater(param["cache"].hits + param["cache"].misses, 0)
+
+    def test_run_sge(self) -> None:
+        for backend in ("serial", "process"):
+            param = get_param(
+                steady_state=True, representation="sge", parallel={"workers": 2, "backend": backend}
+            )
+            best = donkey_ge_steady_state.run(param)
+            self.assertEqual(best.phenotype, '["FTZ", "FTZ", "FTZ"]')
+
+    def test_run_subtree(self) -> None:
+        for backend in ("serial", "process"):
+            param = get_param(
+                steady_state=True, variation="subtree", parallel={"workers": 2, "backend": backend}
+            )
+            best = donkey_ge_steady_state.run(param)
+            self.assertNotEqual(best.phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+
+    def test_not_vectorized(self) -> None:
+        param = get_param(steady_state=True, vectorized=True)
+        with self.assertRaises(AssertionError):
+            donkey_ge_steady_state.run(param)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+
+from fitness.fitness import SimpleSum
+from heuristics import donkey_ge
+from heuristics.fitness_cache import (
+    FitnessCache,
+    LFUFitnessCache,
+    LRUFitnessCache,
+    SQLiteFitnessStore,
+    TTLFitnessCache,
+    get_fitness_cache,
+)
+
+
+def write_entries(file_name: str, start: int) -> None:
+    store = SQLiteFitnessStore(file_name, "concurrent", flush_size=7)
+    for i in range(start, start + 200):
+        store.put(str(i), float(i))
+    store.close()
+
+
+class TestFitnessCache(unittest.TestCase):
+    def test_counters(self) -> None:
+        cache = get_fitness_cache({})
+        fitness_function = SimpleSum({})
+        for phenotype in ('["NCT"]', '["FTZ"]', '["NCT"]', '["NCT"]'):
+            fitness_function(phenotype, cache)
+
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hit_rate, 0.5)
+        self.assertEqual(len(cache), 2)
+        # Reading all values is not a lookup
+        self.assertEqual(sorted(cache.values()), [1, 2])
+        self.assertEqual(cache.hits + cache.misses, 4)
+        with self.assertRaises(KeyError):
+            _ = cache["missing"]
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.get('["NCT"]'), 1)
+        self.assertEqual(cache.hits, 3)
+
+    def test_fifo(self) -> None:
+        cache = FitnessCache(max_entries=2)
+        cache["a"], cache["b"] = 1, 2
+        self.assertIn("a", cache)
+        cache["c"] = 3
+        self.assertEqual(list(cache.keys()), ["b", "c"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_lru(self) -> None:
+        cache = LRUFitnessCache(max_entries=2)
+        cache["a"], cache["b"] = 1, 2
+        self.assertIn("a", cache)
+        cache["c"] = 3
+        self.assertEqual(list(cache.keys()), ["a", "c"])
+
+    def test_lfu(self) -> None:
+        cache = LFUFitnessCache(max_entries=2)
+        cache["a"], cache["b"] = 1, 2
+        for _ in range(3):
+            self.assertIn("b", cache)
+        self.assertIn("a", cache)
+        cache["c"] = 3
+        self.assertEqual(sorted(cache.keys()), ["b", "c"])
+        cache["d"] = 4
+        self.assertEqual(sorted(cache.keys()), ["b", "d"])
+        self.assertEqual(cache.evictions, 2)
+
+    def test_ttl(self) -> None:
+        cache = TTLFitnessCache(ttl_generations=2)
+        cache["a"] = 1
+        cache.new_generation(1)
+        cache["b"] = 2
+        cache.new_generation(2)
+        self.assertEqual(list(cache.keys()), ["b"])
+        cache.new_generation(3)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_max_bytes(self) -> None:
+        cache = get_fitness_cache({"policy": "lru", "max_bytes": 500})
+        for i in range(100):
+            cache[str(i)] = float(i)
+            self.assertLessEqual(cache.n_bytes, 500)
+
+        self.assertGreater(cache.evictions, 0)
+        self.assertIn("99", cache)
+
+    def test_pop_new_entries(self) -> None:
+        cache = get_fitness_cache({"max_entries": 2}, track_new_entries=True)
+        cache["a"], cache["b"], cache["c"] = 1, 2, 3
+        self.assertEqual(cache.pop_new_entries(), [("b", 2), ("c", 3)])
+        self.assertEqual(cache.pop_new_entries(), [])
+
+    def test_n_bytes(self) -> None:
+        cache = FitnessCache()
+        cache["a"] = [1.0]
+        cache["a"].extend(range(100))
+        del cache["a"]
+        self.assertEqual(cache.n_bytes, 0)
+
+    def test_threads(self) -> None:
+        cache = LFUFitnessCache(max_entries=50)
+        fitness_function = SimpleSum({})
+
+        def evaluate(offset: int) -> None:
+            for i in range(2000):
+                fitness_function(str(["NCT"] * ((i + offset) % 97)), cache)
+
+        threads = [threading.Thread(target=evaluate, args=(_,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.hits + cache.misses, 8000)
+        self.assertLessEqual(len(cache), 50)
+        self.assertEqual(
+            cache.n_bytes, sum(FitnessCache.get_size(key, value) for key, value in cache.items())
+        )
+
+
+class TestPersistentFitnessCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_shared_between_caches(self) -> None:
+        settings = {"persistent": self.file_name, "max_entries": 1}
+        cache = get_fitness_cache(settings, namespace="a")
+        cache["x"] = 1.0
+        cache["y"] = -float("inf")
+        cache.close()
+
+        cache = get_fitness_cache(settings, namespace="a")
+        self.assertIn("x", cache)
+        self.assertEqual(cache["x"], 1.0)
+        self.assertEqual(cache.get("y"), -float("inf"))
+        self.assertNotIn("z", cache)
+        self.assertEqual((cache.hits, cache.misses, cache.store_hits), (2, 1, 2))
+        # Other namespaces do not share entries
+        cache = get_fitness_cache(settings, namespace="b")
+        self.assertNotIn("x", cache)
+
+    def test_concurrent_writers(self) -> None:
+        processes = [
+            multiprocessing.Process(target=write_entries, args=(self.file_name, start))
+            for start in (0, 100, 200)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        store = SQLiteFitnessStore(self.file_name, "concurrent")
+        for i in range(400):
+            self.assertEqual(store.get(str(i)), float(i))
+        store.close()
+
+    def test_run_reuses_persistent_cache(self) -> None:
+        param = {
+            "population_size": 10,
+            "max_length": 5,
+            "elite_size": 1,
+            "generations": 2,
+            "tournament_size": 2,
+            "seed": 1,
+            "crossover_probability": 0.8,
+            "mutation_probability": 0.1,
+            "integer_input_element_max": 1000,
+            "bnf_grammar": "tests/grammars/zona_franca/zona_franca_simple_first_example.bnf",
+            "fitness_function": {"name": "fitness.fitness.SimpleSum"},
+            "output_dir": self.directory.name,
+            "fitness_cache": {"persistent": self.file_name},
+        }
+        donkey_ge.run(dict(param))
+        _param = dict(param, seed=2)
+        donkey_ge.run(_param)
+        self.assertGreater(_param["cache"].store_hits, 0)
+        # Worker processes read the store, the main process writes their entries
+        _param = dict(param, seed=3, parallel={"workers": 2, "backend": "process"})
+        donkey_ge.run(_param)
+        store = SQLiteFitnessStore(self.file_name, _param["cache"].store.namespace)
+        for key in _param["cache"].keys():
+            self.assertEqual(store.get(key), _param["cache"][key])
+        store.close()
+
+    def test_read_only(self) -> None:
+        cache = get_fitness_cache({"persistent": self.file_name}, read_only=True)
+        cache["x"] = 1.0
+        cache.close()
+        self.assertNotIn("x", get_fitness_cache({"persistent": self.file_name}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import unittest
+from typing import List
+
+from fitness.game_stats import GameStatsWriter, read_game_stats
+from fitness.game_theory_game import PrisonersDilemma
+
+
+class TestGameStats(unittest.TestCase):
+    FILE_NAME = "test_game_stats.jsonl"
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.FILE_NAME):
+            os.remove(self.FILE_NAME)
+
+    def test_sources_written_once(self) -> None:
+        def player_1(history: List[str], iteration: int) -> str:
+            return "C"
+
+        def player_2(history: List[str], iteration: int) -> str:
+            return "D"
+
+        writer = GameStatsWriter(self.FILE_NAME, buffer_size=2)
+        for _ in range(3):
+            writer.write(player_1, player_2, [(3.0, 0.0)], [("C", "D")])
+        writer.close()
+
+        with open(self.FILE_NAME, "r") as in_file:
+            lines = in_file.readlines()
+        # Two player sources and three games
+        self.assertEqual(len(lines), 5)
+        games = list(read_game_stats(self.FILE_NAME))
+        self.assertEqual(len(games), 3)
+        for game in games:
+            self.assertIn('return "C"', game["player_1"])
+            self.assertIn('return "D"', game["player_2"])
+            self.assertEqual(game["payoffs"], [[3.0, 0.0]])
+            self.assertEqual(game["history"], [["C", "D"]])
+
+    def test_read_while_writing(self) -> None:
+        pd = PrisonersDilemma(
+            n_iterations=3, memory_size=1, store_stats=True, out_file_name=self.FILE_NAME
+        )
+
+        def player(history: List[str], iteration: int) -> str:
+            return "C"
+
+        for n_games in range(1, 4):
+            pd.run(player, player)
+            # Buffered games are flushed before reading
+            self.assertEqual(len(list(read_game_stats(self.FILE_NAME))), n_games)
+
+    def test_read_previous_format(self) -> None:
+        with open(self.FILE_NAME, "w") as out_file:
+            out_file.write('[{"player_1": "a", "player_2": "b", "payoffs": [], "history": []}]')
+
+        self.assertEqual(
+            list(read_game_stats(self.FILE_NAME)),
+            [{"player_1": "a", "player_2": "b", "payoffs": [], "history": []}],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from ast import literal_eval
+
+import numpy as np
+
+from fitness.fitness import MemoryOneGame
+from fitness.game_theory_analysis import (
+    get_memory_one_payoffs,
+    get_memory_one_strategy,
+    get_nash_equilibria,
+    get_pure_nash_equilibria,
+    get_stationary_payoffs,
+    is_evolutionarily_stable,
+)
+from fitness.game_theory_game import HawkAndDove, LookupTableStrategy, PrisonersDilemma
+
+
+class TestEquilibria(unittest.TestCase):
+    def test_prisoners_dilemma(self) -> None:
+        game = PrisonersDilemma()
+        D = PrisonersDilemma.DEFECT
+        self.assertEqual(get_pure_nash_equilibria(game), [(D, D)])
+        equilibria = get_nash_equilibria(game)
+        self.assertEqual(len(equilibria), 1)
+        self.assertEqual([_.tolist() for _ in equilibria[0]], [[0, 1], [0, 1]])
+        self.assertTrue(is_evolutionarily_stable(game, np.array([0, 1])))
+        self.assertFalse(is_evolutionarily_stable(game, np.array([1, 0])))
+
+    def test_hawk_and_dove(self) -> None:
+        game = HawkAndDove()
+        H = HawkAndDove.HAWK
+        D = HawkAndDove.DOVE
+        self.assertEqual(get_pure_nash_equilibria(game), [(H, D), (D, H)])
+        # Mixed equilibrium plays hawk with probability V / C
+        p = HawkAndDove.V / HawkAndDove.C
+        mixed = [_ for _ in get_nash_equilibria(game) if 0 < _[0][0] < 1]
+        self.assertEqual(len(mixed), 1)
+        np.testing.assert_allclose(mixed[0][0], [p, 1 - p])
+        np.testing.assert_allclose(mixed[0][1], [p, 1 - p])
+        self.assertTrue(is_evolutionarily_stable(game, np.array([p, 1 - p])))
+        self.assertFalse(is_evolutionarily_stable(game, np.array([1, 0])))
+
+
+class TestMemoryOnePayoffs(unittest.TestCase):
+    def test_same_as_run(self) -> None:
+        rng = np.random.default_rng(1)
+        for game_class in (PrisonersDilemma, HawkAndDove):
+            game = game_class(n_iterations=20, memory_size=1)
+            long_game = game_class(n_iterations=1000, memory_size=1)
+            moves = game.get_moves()
+            for _ in range(20):
+                player_1 = LookupTableStrategy(moves, 1, rng.integers(1, 3, size=3))
+                player_2 = LookupTableStrategy(moves, 1, rng.integers(1, 3, size=3))
+                strategy_1 = get_memory_one_strategy(player_1)
+                strategy_2 = get_memory_one_strategy(player_2)
+                payoffs, _ = game.run(player_1, player_2)
+                np.testing.assert_allclose(
+                    get_memory_one_payoffs(game, strategy_1, strategy_2), np.mean(payoffs, axis=0)
+                )
+                payoffs, _ = long_game.run(player_1, player_2)
+                np.testing.assert_allclose(
+                    get_stationary_payoffs(game, strategy_1, strategy_2),
+                    np.mean(payoffs, axis=0),
+                    atol=1e-2,
+                )
+
+    def test_stochastic(self) -> None:
+        game = PrisonersDilemma(n_iterations=10000, memory_size=1)
+        # Tit for tat and a player that cooperates with probability 0.5
+        tit_for_tat = np.array([[1, 0], [1, 0], [0, 1]])
+        random = np.full((3, 2), 0.5)
+        stationary = get_stationary_payoffs(game, tit_for_tat, random)
+        np.testing.assert_allclose(
+            stationary, get_memory_one_payoffs(game, tit_for_tat, random), atol=1e-3
+        )
+        # Tit for tat copies the random player, each pair of moves is equally likely
+        expected = np.mean(list(PrisonersDilemma.PAYOFF.values()), axis=0)
+        np.testing.assert_allclose(stationary, expected)
+
+
+class TestMemoryOneGame(unittest.TestCase):
+    def test_same_as_run(self) -> None:
+        for name in ("PrisonersDilemma", "HawkAndDove"):
+            fitness_function = MemoryOneGame(
+                {"game": "fitness.game_theory_game." + name, "n_iterations": 10}
+            )
+            game = fitness_function.game
+            moves = game.get_moves()
+            phenotypes = [str([moves[0], moves[0], moves[1]]), str([moves[1]] * 3)]
+            adversary_phenotypes = [str([moves[0]] * 3), str([moves[1], moves[1], moves[0]])]
+            payoffs, adversary_payoffs = fitness_function.coev_matrix(
+                phenotypes, adversary_phenotypes
+            )
+            sign = -1 if game.MINIMIZE else 1
+            for i, phenotype in enumerate(phenotypes):
+                for j, adversary_phenotype in enumerate(adversary_phenotypes):
+                    players = [
+                        LookupTableStrategy(moves, 1, [moves.index(m) + 1 for m in literal_eval(_)])
+                        for _ in (phenotype, adversary_phenotype)
+                    ]
+                    expected = sign * np.mean(game.run(*players)[0], axis=0)
+                    np.testing.assert_allclose((payoffs[i, j], adversary_payoffs[i, j]), expected)
+
+            self.assertAlmostEqual(
+                fitness_function(phenotypes[0], {}), sign * game.PAYOFF[(moves[0], moves[0])][0]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,20 @@
 import os
 import unittest
+from typing import List
 
-from fitness.game_theory_game import PrisonersDilemma, HawkAndDove
+import numpy as np
+
+from fitness.game_theory_game import PrisonersDilemma, HawkAndDove, LookupTableStrategy
 
 
 class TestPrisonersDilemma(unittest.TestCase):
     def test_one_prisoners_dilemma(self) -> None:
-        player_1 = lambda h, i: "C"
-        player_2 = lambda h, i: "C" if h[i] == "C" else "D"
+        def player_1(history: List[str], iteration: int) -> str:
+            return "C"
+
+        def player_2(history: List[str], iteration: int) -> str:
+            return "C" if history[iteration] == "C" else "D"
+
         n_iterations = 2
         memory_size = 1
         expected_sentences = [
@@ -33,8 +40,12 @@ class TestPrisonersDilemma(unittest.TestCase):
 
 class TestHawkAndDove(unittest.TestCase):
     def test_one_hawk_and_dove(self) -> None:
-        player_1 = lambda h, i: "H"
-        player_2 = lambda h, i: "H" if h[i] == "H" else "D"
+        def player_1(history: List[str], iteration: int) -> str:
+            return "H"
+
+        def player_2(history: List[str], iteration: int) -> str:
+            return "H" if history[iteration] == "H" else "D"
+
         n_iterations = 2
         memory_size = 1
         _payoff = HawkAndDove.PAYOFF
@@ -59,5 +70,92 @@ class TestHawkAndDove(unittest.TestCase):
         self.assertTrue(os.path.exists(HawkAndDove.DEFAULT_OUT_FILE))
 
 
+class TestRunBatch(unittest.TestCase):
+    def test_same_as_run(self) -> None:
+        rng = np.random.default_rng(1)
+        for game_class in (PrisonersDilemma, HawkAndDove):
+            for memory_size in (1, 2, 3):
+                game = game_class(n_iterations=7, memory_size=memory_size)
+                moves = game.get_moves()
+                shape = (20, (len(moves) + 1) ** memory_size)
+                tables_1 = rng.integers(1, len(moves) + 1, size=shape)
+                tables_2 = rng.integers(1, len(moves) + 1, size=shape)
+                payoffs, codes = game.run_batch(tables_1, tables_2)
+                self.assertEqual(payoffs.shape, (20, 7, 2))
+                for pair in range(20):
+                    expected = game.run(
+                        LookupTableStrategy(moves, memory_size, tables_1[pair]),
+                        LookupTableStrategy(moves, memory_size, tables_2[pair]),
+                    )
+                    self.assertEqual(game.get_run_output(payoffs, codes, pair), expected)
+
+    def test_tit_for_tat(self) -> None:
+        game = PrisonersDilemma(n_iterations=3, memory_size=1)
+        self.assertEqual(game.get_moves(), [PrisonersDilemma.COOPERATE, PrisonersDilemma.DEFECT])
+        # Cooperate first, then copy the opponent
+        tit_for_tat = np.array([[1, 1, 2]])
+        always_defect = np.array([[2, 2, 2]])
+        payoffs, _ = game.run_batch(tit_for_tat, always_defect)
+        self.assertEqual(
+            payoffs[0].tolist(),
+            [
+                [PrisonersDilemma.S, PrisonersDilemma.T],
+                [PrisonersDilemma.P, PrisonersDilemma.P],
+                [PrisonersDilemma.P, PrisonersDilemma.P],
+            ],
+        )
+
+
+class TestCompileStrategy(unittest.TestCase):
+    def test_same_as_run(self) -> None:
+        game = HawkAndDove(n_iterations=8, memory_size=2)
+
+        def player_1(history: List[str], iteration: int) -> str:
+            return "H" if iteration < 2 or history[-2:] == ["D", "D"] else "D"
+
+        def player_2(history: List[str], iteration: int) -> str:
+            # Depends on the iteration
+            return "D" if history[-1] == "H" and iteration % 2 else "H"
+
+        table_1 = game.compile_strategy(player_1)
+        table_2 = game.compile_strategy(player_2, player_index=2)
+        self.assertEqual(table_1.iteration_tables, [])
+        self.assertEqual(len(table_2.iteration_tables), 7)
+        self.assertEqual(game.run(table_1, table_2), game.run(player_1, player_2))
+
+    def test_tit_for_tat(self) -> None:
+        game = PrisonersDilemma(n_iterations=5, memory_size=1)
+        tit_for_tat = game.compile_strategy(lambda h, i: "C" if i == 0 else h[-1])
+        self.assertEqual(tit_for_tat.table, [1, 1, 2])
+        self.assertEqual(tit_for_tat.iteration_tables, [])
+
+    def test_probes_do_not_depend_on_iterations(self) -> None:
+        calls = []
+
+        def tit_for_tat(history: List[str], iteration: int) -> str:
+            calls.append(len(history))
+            return "C" if iteration == 0 else history[-1]
+
+        for n_iterations in (100, 10000):
+            calls.clear()
+            PrisonersDilemma(n_iterations=n_iterations, memory_size=1).compile_strategy(tit_for_tat)
+            self.assertLess(len(calls), 50)
+            self.assertLessEqual(max(calls), 2)
+
+    def test_last_iteration(self) -> None:
+        game = PrisonersDilemma(n_iterations=50, memory_size=1)
+
+        def defect_last(history: List[str], iteration: int) -> str:
+            return "D" if iteration == 49 or (iteration > 0 and history[-1] == "D") else "C"
+
+        strategies = [game.compile_strategy(defect_last, _) for _ in (1, 2)]
+        self.assertEqual(game.run(*strategies), game.run(defect_last, defect_last))
+
+    def test_not_memory_k(self) -> None:
+        game = PrisonersDilemma(n_iterations=5, memory_size=1)
+        with self.assertRaises(ValueError):
+            game.compile_strategy(lambda h, i: h[-2] if len(h) > 1 and h[-2] else "C")
+
+
 if __name__ == "__main__":
     unittest.main()
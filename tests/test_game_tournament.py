@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from fitness.game_theory_game import PrisonersDilemma
+from fitness.game_tournament import (
+    get_fitness_matrix,
+    get_tournament_payoffs,
+    moran_process,
+    replicator_dynamics,
+)
+
+STRATEGIES = [
+    'lambda h, i: "C"',
+    'lambda h, i: "D"',
+    'lambda h, i: "C" if i == 0 else h[-1]',
+]
+
+
+class TestTournament(unittest.TestCase):
+    def test_payoffs(self) -> None:
+        game = PrisonersDilemma(n_iterations=10, memory_size=1)
+        payoffs = get_tournament_payoffs(game, STRATEGIES)
+        R, P, S, T = PrisonersDilemma.R, PrisonersDilemma.P, PrisonersDilemma.S, PrisonersDilemma.T
+        self.assertEqual(payoffs[0, 0], R)
+        self.assertEqual(payoffs[0, 1], S)
+        self.assertEqual(payoffs[1, 0], T)
+        self.assertEqual(payoffs[1, 1], P)
+        self.assertEqual(payoffs[2, 2], R)
+        # Tit for tat is exploited in the first iteration
+        self.assertAlmostEqual(payoffs[2, 1], (S + 9 * P) / 10)
+        self.assertAlmostEqual(payoffs[1, 2], (T + 9 * P) / 10)
+
+    def test_backends_and_cache(self) -> None:
+        game = PrisonersDilemma(n_iterations=10, memory_size=1)
+        expected = get_tournament_payoffs(game, STRATEGIES)
+        for settings in ({"backend": "process", "workers": 2}, {"backend": "thread"}):
+            np.testing.assert_allclose(get_tournament_payoffs(game, STRATEGIES, settings), expected)
+
+        np.testing.assert_allclose(
+            get_tournament_payoffs(game, STRATEGIES, compile_strategies=True), expected
+        )
+        cache = {}
+        for _ in range(2):
+            np.testing.assert_allclose(
+                get_tournament_payoffs(game, STRATEGIES, cache=cache), expected
+            )
+        # Mean payoff of each player of each pair
+        self.assertEqual(len(cache), 2 * len(STRATEGIES) ** 2)
+
+
+class TestDynamics(unittest.TestCase):
+    def test_replicator_dynamics(self) -> None:
+        game = PrisonersDilemma(n_iterations=10, memory_size=1)
+        fitness = get_fitness_matrix(get_tournament_payoffs(game, STRATEGIES), game.MINIMIZE)
+        shares = replicator_dynamics(fitness, np.full(3, 1 / 3), 200)
+        self.assertEqual(shares.shape, (201, 3))
+        np.testing.assert_allclose(shares.sum(axis=1), 1)
+        # Defectors exploit the cooperators, and tit for tat takes over
+        self.assertLess(shares[-1, 0], shares[0, 0])
+        self.assertEqual(np.argmax(shares[-1]), 2)
+
+    def test_moran_process(self) -> None:
+        fitness = np.array([[2.0, 1.0], [1.0, 1.0]])
+        shares = moran_process(fitness, np.array([5, 5]), 500, np.random.default_rng(1))
+        self.assertEqual(shares.shape, (501, 2))
+        np.testing.assert_allclose(shares.sum(axis=1), 1)
+        self.assertTrue(((shares * 10) % 1 == 0).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,389 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+from typing import List, Tuple
+
+from heuristics import donkey_ge
+
+ZONA_FRANCA_GRAMMAR = "tests/grammars/zona_franca/zona_franca_simple_first_example.bnf"
+ZONA_FRANCA_LARK_GRAMMAR = "tests/grammars/zona_franca/zona_franca_simple_first_example.lark"
+
+RECURSIVE_BNF = """<e> ::= <e> <op> <e> | <v> | (<e>)
+<op> ::= + | - | *
+<v> ::= x | y | 1
+"""
+
+
+def generate_sentence_reference(grammar: donkey_ge.Grammar, inputs: List[int]) -> Tuple[str, int]:
+    """The uncompiled mapper, used as reference for the compiled mapper."""
+    used_input = 0
+    output: List[str] = []
+    cnt = 0
+    break_out = len(inputs) * len(grammar.terminals)
+    unexpanded_symbols: List[Tuple[str, str]] = [grammar.start_rule]
+    while unexpanded_symbols and used_input < len(inputs) and cnt < break_out:
+        current_symbol = unexpanded_symbols.pop(0)
+        if current_symbol[1] != donkey_ge.Grammar.NT:
+            output.append(current_symbol[0])
+        else:
+            production_choices = grammar.rules[current_symbol[0]]
+            current_production = inputs[used_input] % len(production_choices)
+            if len(production_choices) > 1:
+                used_input += 1
+
+            unexpanded_symbols = production_choices[current_production] + unexpanded_symbols
+
+        cnt += 1
+
+    if unexpanded_symbols:
+        return donkey_ge.Individual.DEFAULT_PHENOTYPE, used_input
+
+    return "".join(output), used_input
+
+
+def get_grammar(bnf_string: str) -> donkey_ge.Grammar:
+    grammar = donkey_ge.Grammar("")
+    grammar.parse_bnf_string(bnf_string)
+    return grammar
+
+
+class TestCompiledGrammar(unittest.TestCase):
+    def test_compile_rules(self) -> None:
+        grammar = donkey_ge.Grammar(ZONA_FRANCA_GRAMMAR)
+        grammar.read_bnf_file(grammar.file_name)
+        grammar.compile_rules()
+        self.assertEqual(grammar.rule_arity, [1, 2])
+        self.assertEqual(grammar.start_symbol_id, 0)
+        self.assertEqual(grammar.get_symbol(grammar.start_symbol_id), grammar.start_rule)
+        for production in grammar.productions:
+            for symbol_id in production:
+                self.assertIn(grammar.get_symbol(symbol_id), grammar.symbol_ids)
+
+    def test_generate_sentence_same_as_reference(self) -> None:
+        rnd = random.Random(1)
+        zona_franca = donkey_ge.Grammar(ZONA_FRANCA_GRAMMAR)
+        zona_franca.read_bnf_file(zona_franca.file_name)
+        for grammar in (zona_franca, get_grammar(RECURSIVE_BNF)):
+            for _ in range(500):
+                inputs = [rnd.randint(0, 100) for _ in range(rnd.randint(0, 30))]
+                self.assertEqual(
+                    grammar.generate_sentence(inputs), generate_sentence_reference(grammar, inputs)
+                )
+
+    def test_recompile_after_parse(self) -> None:
+        grammar = get_grammar("<a> ::= x | y")
+        self.assertEqual(grammar.generate_sentence([1, 0]), ("y", 1))
+        grammar.rules.clear()
+        grammar.parse_bnf_string("<a> ::= z | w")
+        self.assertEqual(grammar.generate_sentence([1, 0]), ("w", 1))
+
+    def test_undefined_non_terminal(self) -> None:
+        grammar = get_grammar("<a> ::= <b> x")
+        with self.assertRaises(KeyError):
+            grammar.generate_sentence([0, 0])
+
+
+class TestFiniteLanguage(unittest.TestCase):
+    def test_count_derivations(self) -> None:
+        grammar = donkey_ge.Grammar(ZONA_FRANCA_GRAMMAR)
+        grammar.read_bnf_file(ZONA_FRANCA_GRAMMAR)
+        self.assertEqual(grammar.count_derivations(), 8)
+        self.assertIsNone(get_grammar(RECURSIVE_BNF).count_derivations())
+        # Unreachable recursion does not make the language infinite
+        grammar = get_grammar("<s> ::= <a><b>\n<a> ::= 1 | 2 | 3\n<b> ::= x | y\n<r> ::= <r>r\n")
+        self.assertEqual(grammar.count_derivations(), 6)
+
+    def test_enumerate_inputs(self) -> None:
+        bnf = "<s> ::= <a> | <b><b>\n<a> ::= x | y\n<b> ::= <c>\n<c> ::= 1 | 2 | <a>\n"
+        grammar = get_grammar(bnf)
+        phenotypes = []
+        for inputs in grammar.enumerate_inputs():
+            phenotype, used_input = grammar.generate_sentence(inputs)
+            self.assertEqual(
+                (phenotype, used_input), generate_sentence_reference(get_grammar(bnf), inputs)
+            )
+            phenotypes.append(phenotype)
+
+        self.assertEqual(len(phenotypes), grammar.count_derivations())
+        self.assertEqual(phenotypes[:4], ["x", "y", "11", "12"])
+        self.assertEqual(len(set(phenotypes)), 18)
+
+
+class TestGrammarAnalysis(unittest.TestCase):
+    def test_tables(self) -> None:
+        grammar = get_grammar(RECURSIVE_BNF + "<u> ::= <u>u | <w>\n")
+        grammar.compile_rules()
+        # <w> is undefined, so <u> is not productive
+        symbols = [
+            grammar.symbol_ids[(_, donkey_ge.Grammar.NT)]
+            for _ in ("<e>", "<op>", "<v>", "<u>", "<w>")
+        ]
+        self.assertEqual([grammar.min_depths[_] for _ in symbols[:3]], [2, 1, 1])
+        self.assertEqual([grammar.productive[_] for _ in symbols], [True] * 3 + [False] * 2)
+        self.assertEqual([grammar.recursive[_] for _ in symbols], [True, False, False, True, False])
+        e = symbols[0]
+        offset = grammar.production_offsets[e]
+        end = offset + 3
+        self.assertEqual(grammar.production_recursive[offset:end], [True, False, True])
+        self.assertEqual(grammar.production_min_depths[offset:end], [3, 2, 3])
+
+    def test_generate_inputs(self) -> None:
+        random.seed(3)
+        grammar = get_grammar(RECURSIVE_BNF)
+        donkey_ge.Individual.codon_size = 100
+        for max_depth in (2, 3, 6):
+            for full in (False, True):
+                for _ in range(20):
+                    inputs, steps = grammar.generate_inputs(max_depth, full)
+                    padding = grammar.get_genome_length(len(inputs), steps) - len(inputs)
+                    phenotype, used_input, cnt = grammar.derive(inputs + [0] * padding)
+                    self.assertNotEqual(phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+                    self.assertEqual((used_input, cnt), (len(inputs), steps))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class TestLarkGrammar(unittest.TestCase):
+    def test_same_rules_as_bnf(self) -> None:
+        bnf_grammar = donkey_ge.read_grammar(ZONA_FRANCA_GRAMMAR)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            grammar = donkey_ge.read_grammar(ZONA_FRANCA_LARK_GRAMMAR, cache_dir=cache_dir)
+            self.assertIsInstance(grammar, donkey_ge.LarkGrammar)
+            self.assertEqual(grammar.terminals, bnf_grammar.terminals)
+            self.assertEqual(list(grammar.rules.values()), list(bnf_grammar.rules.values()))
+            self.assertEqual(list(grammar.enumerate_inputs()), list(bnf_grammar.enumerate_inputs()))
+
+    def test_cached_rules(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            grammar = donkey_ge.read_grammar(ZONA_FRANCA_LARK_GRAMMAR, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached_grammar = donkey_ge.read_grammar(ZONA_FRANCA_LARK_GRAMMAR, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(cached_grammar.rules, grammar.rules)
+            self.assertEqual(cached_grammar.start_rule, grammar.start_rule)
+            self.assertEqual(cached_grammar.terminals, grammar.terminals)
+            self.assertEqual(
+                donkey_ge.get_cache_namespace(cached_grammar, {}),
+                donkey_ge.get_cache_namespace(grammar, {}),
+            )
+
+    def test_imported_files_are_not_cached(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, "cache")
+            file_name = os.path.join(directory, "grammar.lark")
+            with open(file_name, "w") as out_file:
+                out_file.write("%import items.item\n%import common.WS\nstart: item\n%ignore WS\n")
+            for items in ('"a" | "b"', '"c"'):
+                with open(os.path.join(directory, "items.lark"), "w") as out_file:
+                    out_file.write("item: {}\n".format(items))
+                grammar = donkey_ge.read_grammar(file_name, cache_dir=cache_dir)
+                self.assertEqual(len(grammar.rules["<item>"]), items.count("|") + 1)
+
+            self.assertFalse(os.path.exists(cache_dir))
+            self.assertFalse(donkey_ge.LarkGrammar.imports_files("%import common.WS\n"))
+
+    def test_ebnf(self) -> None:
+        grammar = donkey_ge.LarkGrammar("", cache_dir="")
+        grammar.parse_lark_string('start: item ("," item)* [";"]\nitem: "a" | "b"\n')
+        for phenotype in ("a", "b;", "a,b,a", "b,b;"):
+            inputs = grammar.reverse_map(phenotype)
+            self.assertEqual(grammar.generate_sentence(inputs)[0], phenotype)
+
+    def test_regular_expression_terminal(self) -> None:
+        grammar = donkey_ge.LarkGrammar("", cache_dir="")
+        with self.assertRaises(ValueError):
+            grammar.parse_lark_string("start: NUMBER\nNUMBER: /[0-9]+/\n")
+
+
+class TestReverseMap(unittest.TestCase):
+    def test_same_phenotype(self) -> None:
+        rnd = random.Random(4)
+        donkey_ge.Individual.codon_size = 100
+        grammar = get_grammar(RECURSIVE_BNF)
+        for _ in range(200):
+            inputs, steps = grammar.generate_inputs(rnd.randint(2, 6), rnd.random() < 0.5, rnd)
+            phenotype = grammar.generate_sentence(
+                inputs + [0] * (grammar.get_genome_length(len(inputs), steps) - len(inputs))
+            )[0]
+            _inputs = grammar.reverse_map(phenotype)
+            self.assertEqual(grammar.generate_sentence(_inputs)[0], phenotype)
+
+    def test_not_in_language(self) -> None:
+        grammar = donkey_ge.read_grammar(ZONA_FRANCA_GRAMMAR)
+        with self.assertRaises(ValueError):
+            grammar.reverse_map('["FTZ", "FTZ"]')
+
+
+class TestDerivationTree(unittest.TestCase):
+    def test_same_as_derive(self) -> None:
+        rnd = random.Random(6)
+        grammar = get_grammar(RECURSIVE_BNF)
+        for _ in range(500):
+            inputs = [rnd.randint(0, 100) for _ in range(rnd.randint(0, 30))]
+            phenotype, used_input, steps, tree = grammar.derive_tree(inputs)
+            self.assertEqual((phenotype, used_input, steps), grammar.derive(inputs))
+            if tree is None:
+                self.assertEqual(phenotype, donkey_ge.Individual.DEFAULT_PHENOTYPE)
+                continue
+
+            self.assertEqual((tree.ends[0], tree.steps[0]), (used_input, steps))
+            for node in range(1, len(tree)):
+                # Subtrees use inputs within the inputs of their parent
+                parent = tree.parents[node]
+                self.assertLessEqual(tree.starts[parent], tree.starts[node])
+                self.assertLessEqual(tree.ends[node], tree.ends[parent])
+                self.assertEqual(tree.depths[node], tree.depths[parent] + 1)
+                self.assertGreater(tree.heights[parent], tree.heights[node])
+
+
+class TestStructuredGenome(unittest.TestCase):
+    def test_same_as_inputs(self) -> None:
+        rnd = random.Random(7)
+        grammar = get_grammar(RECURSIVE_BNF)
+        for _ in range(500):
+            inputs = [rnd.randint(0, 100) for _ in range(rnd.randint(0, 30))]
+            phenotype, _, _, tree = grammar.derive_tree(inputs)
+            if tree is None:
+                continue
+
+            genome = grammar.get_structured_genome(inputs)
+            _phenotype, used_genes, _, _genome = grammar.derive_sge(genome, max(tree.heights))
+            self.assertEqual(_phenotype, phenotype)
+            self.assertIs(_genome, genome)
+            self.assertEqual(used_genes, [len(_) for _ in genome])
+
+    def test_added_genes(self) -> None:
+        rnd = random.Random(8)
+        grammar = get_grammar(RECURSIVE_BNF)
+        grammar.compile_rules()
+        for max_depth in range(2, 8):
+            genome: List[List[int]] = [[] for _ in grammar.rule_arity]
+            phenotype, used_genes, _, _genome = grammar.derive_sge(genome, max_depth, rnd)
+            self.assertEqual(genome, [[] for _ in grammar.rule_arity])
+            self.assertEqual(used_genes, [len(_) for _ in _genome])
+            for genes, arity in zip(_genome, grammar.rule_arity):
+                self.assertTrue(all(0 <= _ < arity for _ in genes))
+
+            # The genes are only added once
+            self.assertEqual(grammar.derive_sge(_genome, max_depth, rnd)[::3], (phenotype, _genome))
+
+
+class TestMappingCache(unittest.TestCase):
+    def test_same_as_mapping(self) -> None:
+        rnd = random.Random(2)
+        grammar = get_grammar(RECURSIVE_BNF)
+        cached_grammar = get_grammar(RECURSIVE_BNF)
+        cached_grammar.mapping_cache = donkey_ge.MappingCache(max_entries=50)
+        donkey_ge.Individual.max_length = 12
+        donkey_ge.Individual.codon_size = 5
+        for _ in range(2000):
+            inputs = [rnd.randint(0, 5) for _ in range(rnd.randint(1, 12))]
+            individual = donkey_ge.Individual(inputs)
+            cached_individual = donkey_ge.Individual(inputs[:])
+            try:
+                donkey_ge.map_input_with_grammar(individual, grammar, random.Random(1))
+            except ValueError:
+                continue
+
+            donkey_ge.map_input_with_grammar(cached_individual, cached_grammar, random.Random(1))
+            self.assertEqual(individual.phenotype, cached_individual.phenotype)
+            self.assertEqual(individual.used_input, cached_individual.used_input)
+
+        self.assertGreater(cached_grammar.mapping_cache.hits, 0)
+        self.assertLessEqual(len(cached_grammar.mapping_cache), 50)
+
+    def test_prefix_must_be_shorter_than_genome(self) -> None:
+        grammar = get_grammar("<a> ::= x | y")
+        grammar.mapping_cache = donkey_ge.MappingCache()
+        self.assertEqual(grammar.derive([1, 0]), ("y", 1, 2))
+        grammar.mapping_cache.put([1, 0], "y", 1, 2)
+        self.assertEqual(grammar.mapping_cache.get([1, 7], 2), ("y", 1))
+        # The mapping stops when all inputs are used
+        self.assertIsNone(grammar.mapping_cache.get([1], 2))
+
+    def test_eviction(self) -> None:
+        cache = donkey_ge.MappingCache(max_entries=2)
+        cache.put([1, 2, 5], "a", 2, 2)
+        cache.put([1, 3], "b", 2, 2)
+        self.assertEqual(cache.get([1, 2, 0], 2), ("a", 2))
+        cache.put([4], "c", 1, 1)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get([1, 3, 0], 2))
+        self.assertEqual(cache.get([1, 2, 0], 2), ("a", 2))
+        cache.put([0], "d", 1, 1)
+        cache.put([4], "c", 1, 1)
+        # Nodes of evicted prefixes are removed
+        self.assertEqual(sorted(cache._root), [0, 4])
+
+    def test_threads(self) -> None:
+        cache = donkey_ge.MappingCache(max_entries=20)
+        errors: List[BaseException] = []
+
+        def put_and_get(seed: int) -> None:
+            rnd = random.Random(seed)
+            try:
+                for _ in range(3000):
+                    genome = [rnd.randint(0, 3) for _ in range(5)]
+                    cache.put(genome, "x", len(genome), 1)
+                    cache.get(genome + [0], 2)
+            except BaseException as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=put_and_get, args=(_,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(cache), 20)
+        self.assertEqual(cache.hits + cache.misses, 8 * 3000)
+
+
+class TestIncrementalMapping(unittest.TestCase):
+    def test_same_as_derive(self) -> None:
+        rnd = random.Random(3)
+        grammar = get_grammar(RECURSIVE_BNF)
+        n_resumed = 0
+        for _ in range(2000):
+            inputs = [rnd.randint(0, 5) for _ in range(rnd.randint(1, 20))]
+            phenotype, used_input, steps, derivation = grammar.derive_incremental(inputs)
+            self.assertEqual((phenotype, used_input, steps), grammar.derive(inputs))
+            if derivation is None:
+                continue
+
+            self.assertEqual(len(derivation.checkpoints), used_input)
+            # Change one codon and the tail, as mutation and crossover do
+            index = rnd.randint(0, len(inputs) - 1)
+            _inputs = inputs[:index] + [rnd.randint(0, 5) for _ in range(rnd.randint(1, 20))]
+            _derivation = derivation.truncate(index)
+            n_resumed += bool(_derivation.checkpoints)
+            self.assertEqual(
+                grammar.derive_incremental(_inputs, _derivation)[:3], grammar.derive(_inputs)
+            )
+
+        self.assertGreater(n_resumed, 0)
+
+    def test_variation_keeps_checkpoints(self) -> None:
+        random.seed(5)
+        grammar = get_grammar(RECURSIVE_BNF)
+        grammar.incremental = True
+        donkey_ge.Individual.max_length = 30
+        donkey_ge.Individual.codon_size = 5
+        parents = [donkey_ge.Individual(None) for _ in range(2)]
+        for parent in parents:
+            donkey_ge.map_input_with_grammar(parent, grammar)
+            parent.dirty = False
+
+        for child in donkey_ge.onepoint_crossover(parents[0], parents[1], 1.0):
+            donkey_ge.int_flip_mutation(child, 0.1)
+            genome = child.genome[:]
+            donkey_ge.map_input_with_grammar(child, grammar)
+            _child = donkey_ge.Individual(genome)
+            donkey_ge.map_input_with_grammar(_child, get_grammar(RECURSIVE_BNF))
+            self.assertEqual(child.phenotype, _child.phenotype)
+            self.assertEqual(child.used_input, _child.used_input)
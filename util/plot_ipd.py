@@ -1,4 +1,3 @@
-import json
 from typing import List, Tuple, Any, Dict, Callable
 import os
 
@@ -6,6 +5,7 @@ import networkx as nx
 import numpy as np
 from matplotlib import pyplot as plt
 
+from fitness.game_stats import read_game_stats
 from fitness.game_theory_game import PrisonersDilemma
 
 
@@ -141,11 +141,8 @@ def get_history_color(choice: str) -> str:
 def plot_ipd_from_file(
     in_file_name: str, out_path: str = ".", name: str = "ipd_test.pdf"
 ) -> None:
-    """Plot from a Prisoners Dilemma statistics file"""
-    with open(in_file_name, "r") as in_file:
-        json_data = json.load(in_file)
-
-    for i, data in enumerate(json_data):
+    """Plot from a Prisoners Dilemma statistics file, the games are read one at a time"""
+    for i, data in enumerate(read_game_stats(in_file_name)):
         _name = "{}_{}".format(i, name)
         plot_iterated_prisoners_dilemma(
             histories=data["history"],